@@ -0,0 +1,167 @@
+"""
+Synthetic stand-ins for the raw recordings and stimuli that the packaging scripts read, in their on-disk formats.
+At `scale=1` the shapes follow the real data; sizes that the loaders assert on are never scaled.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import h5py
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+SOLO_TIMEBINS = 49  # PSTHs from -100ms to 380ms relative to stimulus onset in bins of 10ms
+OBJECTS = ['bear', 'ELEPHANT_M', 'face0001', 'alfa155', 'breed_pug', 'TURTLE_L', 'Apple_Fruit_obj', 'f16',
+           'lo_poly_animal_CHICKDEE', 'interior_details_103_4', 'zebra', 'MB27346', 'build51', 'Hanger_02',
+           'interior_details_130_2', 'motoryacht', 'MB30758', 'lo_poly_animal_RHINO_2', 'MB28699', 'MB29874',
+           'interior_details_033_2', 'MB30203', 'foreign_cat', 'MB29822']
+
+
+def scaled(size, scale, minimum=1):
+    return max(minimum, int(round(size * scale)))
+
+
+def responses(rng, num_images, num_repetitions, num_neuroids, noise=1.):
+    """ images x repetitions x neuroids responses whose image-driven signal makes most neuroids reliable """
+    signal = rng.gamma(2., size=(num_images, 1, num_neuroids))
+    return signal + noise * rng.standard_normal((num_images, num_repetitions, num_neuroids))
+
+
+def write_images(directory, file_names, rng, size=(256, 256)):
+    os.makedirs(directory, exist_ok=True)
+    paths = [os.path.join(directory, file_name) for file_name in file_names]
+    for path in paths:
+        Image.fromarray(rng.integers(0, 256, size, dtype=np.uint8)).save(path)
+    return paths
+
+
+def write_psth(path, rng, num_images, num_repetitions, num_channels):
+    """ images x repetitions x time bins x channels firing rates, rising after the photodiode-delayed onset """
+    rates = responses(rng, num_images, num_repetitions, num_channels)
+    time_course = np.clip(np.arange(SOLO_TIMEBINS) - 12, 0, 4) / 4  # onset at 30ms
+    np.save(path, rates[:, :, np.newaxis, :] * time_course[:, np.newaxis])
+
+
+def solo_recording(root, experiment, num_images, num_repetitions=50, num_channels=288,
+                   num_normalizer_images=25, num_normalizer_repetitions=20, seed=0):
+    """
+    `root/database/solo.rsvp.<experiment>.{experiment,normalizer}_psth.npy` and `root/array-metadata/mapping.json`
+    as read by the Sanghavi scripts
+    """
+    rng = np.random.default_rng(seed)
+    root = Path(root)
+    os.makedirs(root / 'database', exist_ok=True)
+    write_psth(root / 'database' / f'solo.rsvp.{experiment}.experiment_psth.npy', rng,
+               num_images, num_repetitions, num_channels)
+    write_psth(root / 'database' / f'solo.rsvp.{experiment}.normalizer_psth.npy', rng,
+               num_normalizer_images, num_normalizer_repetitions, num_channels)
+    os.makedirs(root / 'array-metadata', exist_ok=True)
+    channels = np.arange(num_channels)
+    mapping = {'neuroid_id': [f"{'ABCDEF'[channel // 96 % 6]}-{channel % 96:03d}" for channel in channels],
+               'arr': ['ABCDEF'[channel // 96 % 6] for channel in channels],
+               'col': (channels % 10).tolist(), 'row': (channels // 10 % 10).tolist(),
+               'bank': ['ABC'[channel // 32 % 3] for channel in channels], 'elec': (channels % 32 + 1).tolist(),
+               'region': ['IT'] * num_channels, 'animal': ['solo'] * num_channels}
+    with open(root / 'array-metadata' / 'mapping.json', 'w') as f:
+        json.dump(mapping, f)
+    return root
+
+
+def nat300_images(root, num_images, seed=0):
+    """ `root/images/nat300/nat_<number>.png` as listed by `sanghavimurty2020.collect_stimuli` """
+    return write_images(Path(root) / 'images' / 'nat300', [f"nat_{number}.png" for number in range(num_images)],
+                        np.random.default_rng(seed))
+
+
+def nat300_stimuli(root, num_images, seed=0):
+    """ `nat300_images` and the stimulus set that `sanghavimurty2020.collect_stimuli` lists for them """
+    paths = nat300_images(root, num_images, seed=seed)
+    return pd.DataFrame({'image_id': np.arange(num_images),
+                         'image_file_name': [os.path.basename(path) for path in paths],
+                         'image_current_local_file_path': paths})
+
+
+def hvm_stimuli(root, num_images, seed=0):
+    """
+    A stand-in for the `dicarlo.hvm` stimulus set, and `root/image-metadata/hvm_map.txt` with its images
+    in a different order, as read by `sanghavi2020.load_responses`
+    """
+    rng = np.random.default_rng(seed)
+    image_ids = [hashlib.sha1(str(number).encode()).hexdigest() for number in range(num_images)]
+    stimuli = pd.DataFrame({'image_id': image_ids, 'id': np.arange(num_images),
+                            'object_name': rng.choice(OBJECTS[:8], num_images),
+                            'variation': rng.choice([0, 3, 6], num_images)})
+    os.makedirs(Path(root) / 'image-metadata', exist_ok=True)
+    with open(Path(root) / 'image-metadata' / 'hvm_map.txt', 'w') as f:
+        f.writelines(f"{image_id}.png {number}\n" for number, image_id in enumerate(rng.permutation(image_ids)))
+    return stimuli
+
+
+def kar_recording(path, num_images, num_repetitions, neuroids_per_monkey=288, monkeys=('nano', 'magneto'), seed=0):
+    """ HDF5 file with an images x neuroids x repetitions `<monkey>/rates` dataset per monkey """
+    rng = np.random.default_rng(seed)
+    with h5py.File(path, 'w') as f:
+        for monkey in monkeys:
+            rates = responses(rng, num_images, num_repetitions, neuroids_per_monkey).transpose(0, 2, 1)
+            f.create_dataset(f'{monkey}/rates', data=rates.astype(np.float32))
+    return path
+
+
+def kar_coco_stimuli(directory, num_images=1600, seed=0):
+    """ `im<number>.png` images and the MATLAB v7.3 `cocogray_labels.mat` with their labels """
+    rng = np.random.default_rng(seed)
+    write_images(directory, [f"im{number}.png" for number in range(num_images)], rng)
+    labels = rng.choice(['car', 'dog', 'plane', 'chair', 'elephant', 'bear', 'apple', 'boat'], num_images)
+    with h5py.File(os.path.join(directory, 'cocogray_labels.mat'), 'w') as f:
+        label_refs = f.create_dataset('lb', (1, num_images), dtype=h5py.ref_dtype)
+        for number, label in enumerate(labels):
+            label_refs[0, number] = f.create_dataset(f'#refs#/{number}', data=[ord(c) for c in label],
+                                                     dtype=np.uint16).ref
+    return directory
+
+
+def movshon_recording(response_file, stimuli_directory, num_cells=(102, 103), seed=0):
+    """
+    HDF5 file with (cells x time bins x repetitions x samples x texture types x texture families) `v1` and `v2`
+    spike trains, and the 450 stimuli named like `tex-320x320-im13-smp2.png`
+    """
+    from mkgu_packaging.movshon.movshon import textureNumOrder, image_name_from_fields
+
+    rng = np.random.default_rng(seed)
+    with h5py.File(response_file, 'w') as f:
+        for region, cells in zip(['v1', 'v2'], num_cells):
+            spikes = rng.random((cells, 300, 20, 15, 2, 15), dtype=np.float32) < .02
+            f.create_dataset(region, data=spikes.astype(np.float32))
+    write_images(stimuli_directory, [image_name_from_fields(texture_type, "320x320", family, sample)
+                                     for texture_type in ["noise", "texture"] for family in textureNumOrder
+                                     for sample in range(1, 16)], rng, size=(320, 320))
+    return response_file
+
+
+def objectome(source_data_path, num_trials=927296, num_images=2400, seed=0):
+    """
+    `objectome24s100_humanpool.pkl` with one row per human trial (~1M at scale 1)
+    and `objectome24s100_imgsubsampled240_pandas.pkl` with the ids of 240 of the images
+    """
+    rng = np.random.default_rng(seed)
+    image_ids = np.array([hashlib.sha1(f"objectome{number}".encode()).hexdigest() for number in range(num_images)])
+    image_objects = np.array(OBJECTS)[np.arange(num_images) % len(OBJECTS)]
+    images = rng.integers(0, num_images, num_trials)
+    sample_obj = image_objects[images]
+    dist_obj = np.array(OBJECTS)[(rng.integers(1, len(OBJECTS), num_trials) +
+                                  np.arange(num_images)[images] % len(OBJECTS)) % len(OBJECTS)]
+    correct = rng.random(num_trials) < .8
+    trials = pd.DataFrame({'id': image_ids[images], 'sample_obj': sample_obj, 'dist_obj': dist_obj,
+                           'choice': np.where(correct, sample_obj, dist_obj), 'correct': correct,
+                           'rt': rng.gamma(4., 200., num_trials),
+                           'WorkerID': [f"A{worker:05d}" for worker in rng.integers(0, 1500, num_trials)],
+                           'AssignmentID': [f"3{assignment:08d}" for assignment in rng.integers(0, 20000, num_trials)],
+                           'DistractorSide': rng.choice(['left', 'right'], num_trials)})
+    os.makedirs(source_data_path, exist_ok=True)
+    trials.to_pickle(os.path.join(source_data_path, 'objectome24s100_humanpool.pkl'))
+    subsample = pd.DataFrame({'id': rng.choice(image_ids, 240, replace=False)})
+    subsample.to_pickle(os.path.join(source_data_path, 'objectome24s100_imgsubsampled240_pandas.pkl'))
+    return source_data_path
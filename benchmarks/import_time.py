@@ -0,0 +1,85 @@
+"""
+Import time of every `mkgu_packaging` module, each imported in a fresh interpreter as a packaging worker would,
+and the heavy dependencies that importing it loads. Heavy dependencies are to be imported on first use.
+
+    python benchmarks/import_time.py                        # exits with 1 if a module loads a heavy dependency
+    python benchmarks/import_time.py --only sanghavi kar
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+HEAVY_MODULES = ['brainscore', 'brainio_base', 'brainio_collection', 'brainio_contrib', 'h5py', 'tables', 'boto3',
+                 'botocore', 'imageio', 'PIL', 'netCDF4', 'zarr', 'sklearn', 'scipy', 'torch']
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+heavy = sorted(name for name in {heavy!r} if name in sys.modules)
+print(json.dumps({{'seconds': seconds, 'heavy': heavy}}))
+"""
+
+
+def modules(package_dir=ROOT / 'mkgu_packaging'):
+    """ Names of all importable modules in `package_dir`, skipping directories that are not packages """
+    names = []
+    for path in sorted(package_dir.rglob('*.py')):
+        parts = path.relative_to(package_dir.parent).with_suffix('').parts
+        if parts[-1] == '__init__':
+            parts = parts[:-1]
+        if all(part.isidentifier() for part in parts) and \
+                all((package_dir.parent.joinpath(*parts[:depth]) / '__init__.py').is_file()
+                    for depth in range(1, len(parts))):
+            names.append('.'.join(parts))
+    return names
+
+
+def measure(module, repeat):
+    """ Median import time of `module` in seconds and the heavy modules it loads, or the error it raises """
+    seconds, heavy = [], []
+    for _ in range(repeat):
+        process = subprocess.run([sys.executable, '-c', _PROBE.format(module=module, heavy=HEAVY_MODULES)],
+                                 cwd=ROOT, capture_output=True, text=True)
+        if process.returncode != 0:
+            return {'error': process.stderr.strip().splitlines()[-1]}
+        result = json.loads(process.stdout.strip().splitlines()[-1])
+        seconds.append(result['seconds'])
+        heavy = result['heavy']
+    return {'seconds': statistics.median(seconds), 'heavy': heavy}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the import time of the packaging modules')
+    parser.add_argument('--only', nargs='*', default=None, help='substrings of the modules to import')
+    parser.add_argument('--repeat', type=int, default=3, help='imports per module, each in a new interpreter')
+    parser.add_argument('--output', type=Path, default=None, help='also write the results to this JSON file')
+    args = parser.parse_args()
+
+    names = [name for name in modules() if not args.only or any(only in name for only in args.only)]
+    results, offenders = {}, []
+    print(f"{'module':<60} {'import [ms]':>12}  heavy dependencies")
+    for name in names:
+        results[name] = measure(name, repeat=args.repeat)
+        if 'error' in results[name]:
+            print(f"{name:<60} {'-':>12}  {results[name]['error']}")
+            continue
+        if results[name]['heavy']:
+            offenders.append(name)
+        print(f"{name:<60} {results[name]['seconds'] * 1000:>12.1f}  {', '.join(results[name]['heavy'])}")
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2) + '\n')
+    if offenders:
+        print(f"{len(offenders)} modules load heavy dependencies at import: {', '.join(offenders)}")
+    return 1 if offenders else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
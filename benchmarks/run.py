@@ -0,0 +1,237 @@
+"""
+Offline benchmarks of the loaders' hot paths on synthetic inputs written by `fixtures.py`.
+Every benchmark reports its wall time (the median of `--repeat` runs) and its peak memory traced by `tracemalloc`
+(in a separate run, since tracing slows down Python-heavy code), and is compared against `baselines.json`.
+
+    python benchmarks/run.py                # compare against the baselines, exit with 1 on a regression
+    python benchmarks/run.py --only kar     # only benchmarks whose name contains 'kar'
+    python benchmarks/run.py --update       # record the results as the new baselines
+"""
+
+import argparse
+import atexit
+import gc
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import traceback
+import tracemalloc
+from pathlib import Path
+
+# keep the hash and stage caches of the benchmarks out of the user's, and never load stages from them.
+# Set before anything imports mkgu_packaging, whose default cache paths are resolved at import
+_home = tempfile.mkdtemp(prefix='mkgu_benchmarks_home_')
+atexit.register(shutil.rmtree, _home, ignore_errors=True)
+os.environ['HOME'] = _home
+os.environ['MKGU_STAGE_CACHE_DISABLE'] = '1'
+
+import fixtures  # noqa: E402
+
+BASELINES_PATH = Path(__file__).parent / 'baselines.json'
+DEFAULT_SCALE = .05
+# baselines are compared at least against these, below which differences are noise
+MIN_WALL_SECONDS, MIN_PEAK_MIB = .01, .1
+BENCHMARKS = {}
+
+
+def benchmark(function):
+    """
+    Register a benchmark: `function(fixture_dir, scale)` writes its inputs to `fixture_dir`
+    and returns the stage to be measured, a function without arguments
+    """
+    BENCHMARKS[function.__name__] = function
+    return function
+
+
+def _cold(stage):
+    """ Run `stage` with an empty hash cache, so that every run hashes all files """
+
+    def cold_stage():
+        from mkgu_packaging.hashing import DEFAULT_CACHE_PATH
+        if os.path.isfile(DEFAULT_CACHE_PATH):
+            os.remove(DEFAULT_CACHE_PATH)
+        return stage()
+
+    return cold_stage
+
+
+@benchmark
+def sanghavimurty2020_collect_stimuli(fixture_dir, scale):
+    from mkgu_packaging.dicarlo.sanghavi import sanghavimurty2020
+    fixtures.nat300_images(fixture_dir, num_images=fixtures.scaled(300, scale, minimum=10))
+    return lambda: sanghavimurty2020.collect_stimuli(fixture_dir)
+
+
+@benchmark
+def sanghavimurty2020_load_responses(fixture_dir, scale):
+    from mkgu_packaging.dicarlo.sanghavi import sanghavimurty2020
+    num_images = fixtures.scaled(300, scale, minimum=10)
+    fixtures.solo_recording(fixture_dir, 'nat300', num_images=num_images)
+    stimuli = fixtures.nat300_stimuli(fixture_dir, num_images=num_images)
+    return lambda: sanghavimurty2020.load_responses(fixture_dir, stimuli)
+
+
+@benchmark
+def sanghavi2020_load_responses(fixture_dir, scale):
+    from mkgu_packaging.dicarlo.sanghavi import sanghavi2020
+    num_images = fixtures.scaled(3200, scale, minimum=10)
+    fixtures.solo_recording(fixture_dir, 'hvm', num_images=num_images, num_repetitions=30)
+    stimuli = fixtures.hvm_stimuli(fixture_dir, num_images=num_images)
+    return lambda: sanghavi2020.load_responses(fixture_dir / 'database', stimuli)
+
+
+@benchmark
+def kar_hvm_load_responses(fixture_dir, scale):
+    from mkgu_packaging.dicarlo.kar2018 import kar_hvm
+    response_file = fixtures.kar_recording(fixture_dir / 'hvm640_neural.h5', num_images=640, num_repetitions=63)
+    stimuli = fixtures.hvm_stimuli(fixture_dir, num_images=640)
+    additional_coords = {'image_id': ('image_id', stimuli['image_id'].values),
+                         'image_generative_id': ('image_id', stimuli['image_id'].str[::-1].values)}
+    return lambda: kar_hvm.load_responses(response_file, additional_coords=additional_coords)
+
+
+@benchmark
+def kar_coco_collect_stimuli(fixture_dir, scale):
+    from mkgu_packaging.dicarlo.kar2018 import kar_coco
+    fixtures.kar_coco_stimuli(fixture_dir / 'stimuli')
+    return _cold(lambda: kar_coco.collect_stimuli(fixture_dir / 'stimuli'))
+
+
+@benchmark
+def kar_coco_load_responses(fixture_dir, scale):
+    from mkgu_packaging.dicarlo.kar2018 import kar_coco
+    response_file = fixtures.kar_recording(fixture_dir / 'cocoGray_neural.h5', num_images=1600, num_repetitions=45)
+    fixtures.kar_coco_stimuli(fixture_dir / 'stimuli')
+    stimuli = kar_coco.collect_stimuli(fixture_dir / 'stimuli')
+    return lambda: kar_coco.load_responses(response_file, stimuli)
+
+
+@benchmark
+def movshon_load_stimuli(fixture_dir, scale):
+    from mkgu_packaging.movshon import movshon
+    fixtures.movshon_recording(fixture_dir / 'responses.mat', fixture_dir / 'stimuli', num_cells=(1, 1))
+    return _cold(lambda: movshon.load_stimuli(fixture_dir / 'stimuli'))
+
+
+@benchmark
+def movshon_write_responses(fixture_dir, scale):
+    from mkgu_packaging.movshon import movshon
+    num_cells = (fixtures.scaled(102, scale), fixtures.scaled(103, scale))
+    response_file = fixtures.movshon_recording(fixture_dir / 'responses.mat', fixture_dir / 'stimuli',
+                                               num_cells=num_cells)
+
+    def stage():
+        presentations, _ = movshon.write_responses_netcdf(response_file, fixture_dir / 'stimuli',
+                                                          fixture_dir / 'responses.nc')
+        return movshon.open_responses(fixture_dir / 'responses.nc', presentations)
+
+    return stage
+
+
+@benchmark
+def objectome_to_xarray(fixture_dir, scale):
+    import pandas as pd
+    from mkgu_packaging.dicarlo import rajalingham2018objectome
+    fixtures.objectome(fixture_dir)  # to_xarray is dominated by the ~1M trials, which is cheap enough to not scale
+    trials = pd.read_pickle(fixture_dir / 'objectome24s100_humanpool.pkl')
+    trials['truth'] = trials['sample_obj']
+    subsample = pd.read_pickle(fixture_dir / 'objectome24s100_imgsubsampled240_pandas.pkl')
+    trials['enough_human_data'] = trials['id'].isin(subsample.values[:, 0])
+    return lambda: rajalingham2018objectome.to_xarray(trials)
+
+
+def measure(stage, repeat):
+    wall_seconds = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = stage()
+        wall_seconds.append(time.perf_counter() - start)
+        del result
+    gc.collect()
+    tracemalloc.start()
+    try:
+        stage()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'wall_seconds': round(statistics.median(wall_seconds), 4), 'peak_mib': round(peak / 2 ** 20, 1)}
+
+
+def compare(results, baselines, wall_tolerance, memory_tolerance):
+    """ Print every result next to its baseline and return the names of the benchmarks that regressed """
+    regressions = []
+    print(f"{'benchmark':<36} {'wall [s]':>10} {'baseline':>10} {'ratio':>6} "
+          f"{'peak [MiB]':>11} {'baseline':>10} {'ratio':>6}")
+    for name, result in results.items():
+        baseline = baselines.get(name)
+        if baseline is None:
+            print(f"{name:<36} {result['wall_seconds']:>10.3f} {'-':>10} {'':>6} {result['peak_mib']:>11.1f} "
+                  f"{'-':>10} {'':>6}  no baseline")
+            continue
+        wall_ratio = result['wall_seconds'] / max(baseline['wall_seconds'], MIN_WALL_SECONDS)
+        memory_ratio = result['peak_mib'] / max(baseline['peak_mib'], MIN_PEAK_MIB)
+        regressed = wall_ratio > 1 + wall_tolerance or memory_ratio > 1 + memory_tolerance
+        if regressed:
+            regressions.append(name)
+        print(f"{name:<36} {result['wall_seconds']:>10.3f} {baseline['wall_seconds']:>10.3f} {wall_ratio:>6.2f} "
+              f"{result['peak_mib']:>11.1f} {baseline['peak_mib']:>10.1f} {memory_ratio:>6.2f}"
+              f"{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the packaging loaders on synthetic data')
+    parser.add_argument('--only', nargs='*', default=None, help='substrings of the benchmarks to run')
+    parser.add_argument('--scale', type=float, default=None,
+                        help=f'size of the scalable inputs relative to the real data '
+                             f'(default: that of the baselines, or {DEFAULT_SCALE})')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per benchmark')
+    parser.add_argument('--wall-tolerance', type=float, default=.5, help='allowed relative increase in wall time')
+    parser.add_argument('--memory-tolerance', type=float, default=.1, help='allowed relative increase in peak memory')
+    parser.add_argument('--baselines', type=Path, default=BASELINES_PATH)
+    parser.add_argument('--update', action='store_true', help='store the results as baselines')
+    parser.add_argument('--output', type=Path, default=None, help='also write the results to this JSON file')
+    args = parser.parse_args()
+
+    stored = json.loads(args.baselines.read_text()) if args.baselines.is_file() else {'benchmarks': {}}
+    scale = args.scale or stored.get('scale', DEFAULT_SCALE)
+    if not args.update and stored.get('scale', scale) != scale:
+        parser.error(f"baselines were recorded at scale {stored['scale']}, not {scale}")
+    names = [name for name in BENCHMARKS if not args.only or any(only in name for only in args.only)]
+
+    results, failures = {}, []
+    with tempfile.TemporaryDirectory(prefix='mkgu_benchmarks_') as temp_dir:
+        for name in names:
+            fixture_dir = Path(temp_dir) / name
+            os.makedirs(fixture_dir)
+            try:
+                stage = BENCHMARKS[name](fixture_dir, scale)
+                results[name] = measure(stage, repeat=args.repeat)
+            except Exception:
+                traceback.print_exc()
+                failures.append(name)
+                continue
+            print(f"{name}: {results[name]['wall_seconds']:.3f}s, {results[name]['peak_mib']:.1f} MiB",
+                  file=sys.stderr)
+
+    if args.output:
+        args.output.write_text(json.dumps({'scale': scale, 'benchmarks': results}, indent=2) + '\n')
+    regressions = compare(results, stored['benchmarks'], args.wall_tolerance, args.memory_tolerance)
+    if args.update:
+        baselines = {**stored['benchmarks'], **results} if stored.get('scale', scale) == scale else results
+        args.baselines.write_text(json.dumps({'scale': scale, 'benchmarks': baselines}, indent=2) + '\n')
+        return 1 if failures else 0
+    if failures:
+        print(f"{len(failures)} benchmarks failed: {', '.join(failures)}")
+    if regressions:
+        print(f"{len(regressions)} regressions: {', '.join(regressions)}")
+    return 1 if failures or regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -14,6 +14,7 @@ from brainio_base.assemblies import NeuronRecordingAssembly
 
 
 from brainio_collection.packaging import package_stimulus_set, package_data_assembly
+from mkgu_packaging.coords import lookup_values
 
 storage_location = ("C:/Users/hsuen/Desktop/bigData/brainscore_img_elec_time_70hz150/")
 
@@ -63,8 +64,7 @@ def load_responses(response_file, stimuli):
                             coords={
                                 'image_num': ('presentation', list(range(neural_responses.shape[0]))),
                                 'image_id': ('presentation',
-                                             [stimuli['image_id'][stimuli['image_number'] == num].values[0]
-                                              for num in range(neural_responses.shape[0])]),
+                                             lookup_values(stimuli, 'image_number', range(neural_responses.shape[0]))),
 
                                 'region': ('neuroid', brodmann_locations),
                                 # right now puts value "brodmann" area for all coords
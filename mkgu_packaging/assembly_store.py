@@ -0,0 +1,191 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+DEFAULT_CHUNK_BYTES = 4 * 2 ** 20
+DEFAULT_SLAB_BYTES = 256 * 2 ** 20
+UNNAMED_VARIABLE = '__xarray_dataarray_variable__'  # name xarray uses for an unnamed DataArray
+CATEGORIES_ATTR = 'categories'
+
+
+def chunk_sizes(dims, sizes, dtype, chunks=None, chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """
+    Chunk size per dimension in `dims` (with lengths `sizes`): `chunks` where given,
+    otherwise filled from the innermost dimension outwards until a chunk holds about `chunk_bytes`.
+    """
+    chunks = dict(chunks or {})
+    remaining = max(1, chunk_bytes // np.dtype(dtype).itemsize // int(np.prod(list(chunks.values()))))
+    result = {}
+    for dim in reversed(dims):
+        if dim in chunks:
+            result[dim] = min(chunks[dim], sizes[dim])
+            continue
+        result[dim] = max(1, min(sizes[dim], remaining))
+        remaining = max(1, remaining // result[dim])
+    return tuple(result[dim] for dim in dims)
+
+
+def _flatten(assembly):
+    multi_indexes = [name for name, index in assembly.indexes.items() if isinstance(index, pd.MultiIndex)]
+    return assembly.reset_index(multi_indexes) if multi_indexes else assembly
+
+
+def _encode_values(values):
+    codes, categories = pd.factorize(np.asarray(values).ravel())  # missing values get code -1
+    if not all(isinstance(category, str) for category in categories):
+        return None, None
+    dtype = next(dtype for dtype in (np.int8, np.int16, np.int32, np.int64) if len(categories) <= np.iinfo(dtype).max)
+    return codes.astype(dtype).reshape(np.shape(values)), list(categories)
+
+
+def encode_categorical(assembly, coords=None):
+    """
+    Replace string coordinates (all non-dimension ones, or those named in `coords`) and string data
+    by the smallest sufficient integer codes, with the lookup table of values in the `categories` attribute.
+    Repetitive strings on long presentation dimensions then take one to eight bytes per entry
+    and survive netCDF serialization; `decode_categorical` restores the strings.
+    """
+    assembly = _flatten(assembly)
+    names = [name for name, coord in assembly.coords.items() if name not in assembly.dims and
+             coord.dtype.kind in 'OUS' and (coords is None or name in coords)]
+    encoded = {}
+    for name in names:
+        coord = assembly.coords[name]
+        codes, categories = _encode_values(coord.values)
+        if categories:
+            encoded[name] = (coord.dims, codes, {**coord.attrs, CATEGORIES_ATTR: categories})
+    assembly = assembly.assign_coords(**encoded)
+    if assembly.dtype.kind in 'OUS':
+        codes, categories = _encode_values(assembly.values)
+        if categories:
+            assembly = assembly.copy(data=codes)
+            assembly.attrs[CATEGORIES_ATTR] = categories
+    return assembly
+
+
+def share_strings(frame):
+    """
+    Copy of the DataFrame `frame` in which the string columns hold one object per distinct value, shared by all rows,
+    instead of one per row as after unpickling or parsing; missing values are kept.
+    Assemblies built from it then keep only the distinct strings alive, e.g. in object-dtype data.
+    """
+    frame = frame.copy(deep=False)
+    for column in frame.columns:
+        if pd.api.types.is_string_dtype(frame[column]):
+            frame[column] = np.asarray(frame[column].astype('category'), dtype=object)
+    return frame
+
+
+def _decode_values(codes, categories):
+    categories = [categories] if isinstance(categories, str) else list(categories)  # netCDF unwraps single values
+    lookup = np.array(categories + [None], dtype=object)  # code -1 maps to the trailing None
+    return lookup[np.asarray(codes)]
+
+
+def decode_categorical(assembly):
+    """ Inverse of `encode_categorical`: turn all coordinates and data with `categories` back into strings """
+    decoded = {}
+    for name, coord in assembly.coords.items():
+        if CATEGORIES_ATTR in coord.attrs:
+            attrs = {key: value for key, value in coord.attrs.items() if key != CATEGORIES_ATTR}
+            decoded[name] = (coord.dims, _decode_values(coord.values, coord.attrs[CATEGORIES_ATTR]), attrs)
+    assembly = assembly.assign_coords(**decoded)
+    if CATEGORIES_ATTR in assembly.attrs:
+        categories = assembly.attrs[CATEGORIES_ATTR]
+        assembly = assembly.copy(data=_decode_values(assembly.values, categories))
+        del assembly.attrs[CATEGORIES_ATTR]
+    return assembly
+
+
+def open_assembly(path, engine=None):
+    """ Load an assembly written by `write_netcdf` or `write_zarr`, decoding categorical coordinates and data """
+    with xr.open_dataarray(path, engine=engine) as assembly:
+        return decode_categorical(assembly.load())
+
+
+def _coord_encodings(coords, complevel, shuffle, encodings):
+    coord_encodings = {name: {'zlib': True, 'complevel': complevel, 'shuffle': shuffle}
+                       for name, coord in coords.variables.items() if coord.dtype.kind in 'biuf'}
+    for name, encoding in (encodings or {}).items():
+        coord_encodings.setdefault(name, {}).update(encoding)
+    return coord_encodings
+
+
+def _categorical(assembly, categorical):
+    if not categorical:
+        return _flatten(assembly)
+    return encode_categorical(assembly, coords=None if categorical is True else categorical)
+
+
+def _slabs(assembly, chunks, slab_bytes):
+    dim, chunk = assembly.dims[0], chunks[0]
+    row_bytes = assembly.dtype.itemsize * int(np.prod(assembly.shape[1:]))
+    rows = max(chunk, slab_bytes // max(row_bytes, 1) // chunk * chunk)
+    for start in range(0, assembly.sizes[dim], rows):
+        yield start, assembly[{dim: slice(start, start + rows)}]
+
+
+def write_netcdf(assembly, target_netcdf_file, chunks=None, complevel=4, shuffle=True, dtype=None, encodings=None,
+                 categorical=False, chunk_bytes=DEFAULT_CHUNK_BYTES, slab_bytes=DEFAULT_SLAB_BYTES):
+    """
+    Write `assembly` to a compressed, chunked netCDF4 file that `xr.open_dataarray` reads back.
+    The data is stored with zlib at `complevel` (with the shuffle filter if `shuffle`), in chunks of `chunk_sizes`,
+    and converted to `dtype` if given. It is written in slabs of about `slab_bytes` along the first dimension,
+    so that lazily loaded assemblies are never fully in memory.
+    Non-numeric data (e.g. strings) is written by xarray without chunking and compression.
+    Numeric coordinates are compressed like the data; `encodings` adds or overrides encodings of coordinates,
+    e.g. `{'repetition': {'dtype': 'int8'}}`.
+    With `categorical` (True or the names of coordinates), string coordinates and data are stored with
+    `encode_categorical`; such files should be loaded with `open_assembly`. brainio_collection opens published
+    assemblies with plain xarray, so files that are registered in the lookup or uploaded must not be categorical.
+    """
+    import netCDF4
+
+    assembly = _categorical(assembly, categorical)
+    dtype = np.dtype(dtype or assembly.dtype)
+    if dtype.kind not in 'biuf':  # variable-length data such as strings cannot be chunked and compressed by netCDF4
+        dataset = assembly.astype(dtype, copy=False).to_dataset(name=assembly.name or UNNAMED_VARIABLE)
+        dataset.to_netcdf(target_netcdf_file, encoding=_coord_encodings(dataset.coords, complevel, shuffle, encodings))
+        return
+    chunks = chunk_sizes(assembly.dims, assembly.sizes, dtype, chunks=chunks, chunk_bytes=chunk_bytes)
+    coords = xr.Dataset(coords=assembly.coords)
+    coords.to_netcdf(target_netcdf_file, encoding=_coord_encodings(coords, complevel, shuffle, encodings))
+
+    with netCDF4.Dataset(target_netcdf_file, 'a') as target:
+        for dim in assembly.dims:
+            if dim not in target.dimensions:  # dimensions without coordinates
+                target.createDimension(dim, assembly.sizes[dim])
+        variable = target.createVariable(assembly.name or UNNAMED_VARIABLE, dtype.newbyteorder('='), assembly.dims,
+                                         zlib=complevel > 0, complevel=complevel, shuffle=shuffle, chunksizes=chunks)
+        variable.setncatts({key: value for key, value in assembly.attrs.items()})
+        variable.coordinates = ' '.join(name for name in coords.coords if name not in assembly.dims)
+        for start, slab in _slabs(assembly, chunks, slab_bytes):
+            variable[start:start + slab.shape[0]] = slab.values.astype(dtype, copy=False)
+
+
+def write_zarr(assembly, target_zarr_dir, chunks=None, complevel=4, shuffle=True, dtype=None, encodings=None,
+               categorical=False, chunk_bytes=DEFAULT_CHUNK_BYTES, slab_bytes=DEFAULT_SLAB_BYTES):
+    """
+    Zarr directory equivalent of `write_netcdf`, with Blosc/zstd compression. Requires the optional `zarr` package.
+    Slabs along the first dimension are appended one after the other.
+    """
+    import zarr
+
+    assembly = _categorical(assembly, categorical)
+    dtype = np.dtype(dtype or assembly.dtype)
+    chunks = chunk_sizes(assembly.dims, assembly.sizes, dtype, chunks=chunks, chunk_bytes=chunk_bytes)
+    name = assembly.name or UNNAMED_VARIABLE
+    if int(zarr.__version__.split('.')[0]) >= 3:
+        compression = {'compressors': [zarr.codecs.BloscCodec(
+            cname='zstd', clevel=complevel, shuffle='shuffle' if shuffle else 'noshuffle')]}
+    else:
+        from numcodecs import Blosc
+        compression = {'compressor': Blosc(cname='zstd', clevel=complevel,
+                                           shuffle=Blosc.SHUFFLE if shuffle else Blosc.NOSHUFFLE)}
+    for start, slab in _slabs(assembly, chunks, slab_bytes):
+        dataset = slab.astype(dtype, copy=False).to_dataset(name=name)
+        if start == 0:
+            encoding = {name: {'chunks': chunks, **compression}, **(encodings or {})}
+            dataset.to_zarr(target_zarr_dir, mode='w', encoding=encoding)
+        else:
+            dataset.to_zarr(target_zarr_dir, append_dim=assembly.dims[0])
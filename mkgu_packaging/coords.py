@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+
+
+def assign_frame_coords(assembly, frame, dim):
+    """
+    Attach every column of the DataFrame `frame` as a coordinate along `dim` of `assembly`.
+    All columns are assigned in a single `assign_coords` call and keep their numpy dtypes,
+    instead of rebuilding the DataArray from a Python list once per column.
+    """
+    assert len(frame) == assembly.sizes[dim], f"{len(frame)} rows for {assembly.sizes[dim]} entries along {dim}"
+    return assembly.assign_coords(**{str(column_name): (dim, column_data.to_numpy())
+                                     for column_name, column_data in frame.items()})
+
+
+def lookup_values(frame, key_column, keys, value_column='image_id'):
+    """
+    Values of `value_column` in the rows of `frame` whose `key_column` equals each of `keys`, e.g. the `image_id` of
+    every position along a response array's image axis via `lookup_values(stimuli, 'image_number', range(N))`.
+    The keys are resolved through one hash index over `key_column` rather than one scan of `frame` per key;
+    duplicate keys in `frame` and keys without a row raise a ValueError.
+    """
+    index = pd.Index(frame[key_column].to_numpy())
+    if not index.is_unique:
+        duplicates = index[index.duplicated()].unique()
+        raise ValueError(f"{len(duplicates)} duplicate values in {key_column}, e.g. {list(duplicates[:5])}")
+    keys = np.asarray(keys)
+    positions = index.get_indexer(keys)
+    missing = positions < 0
+    if missing.any():
+        raise ValueError(f"{missing.sum()} of {len(keys)} keys not found in {key_column}, "
+                         f"e.g. {list(keys[missing][:5])}")
+    return frame[value_column].to_numpy()[positions]
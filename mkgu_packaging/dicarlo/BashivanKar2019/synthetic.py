@@ -5,34 +5,18 @@ import logging
 import numpy as np
 import xarray as xr
 import pandas as pd
-import tables
-from PIL import Image
 
-
-from brainio_collection.lookup import sha1_hash
-from brainio_base.assemblies import NeuronRecordingAssembly
-from brainio_base.stimuli import StimulusSet
-from brainio_collection.packaging import package_data_assembly, package_stimulus_set
+from mkgu_packaging import instrumentation
+from mkgu_packaging.materialize import image_chunks, materialize_chunks, materialize_images, written_frame
+from mkgu_packaging.pipeline import Pipeline
 
 _logger = logging.getLogger(__name__)
 
 
 def np_to_png(img_array, img_temp_path):
-    meta = []
-    for i, img_np in enumerate(img_array):
-        img_pil = Image.fromarray((img_np).astype('uint8'))
-        img_path = img_temp_path / f"img{i}.png"
-        img_pil.save(img_path)
-        sha1 = sha1_hash(img_path)
-        img_path_sha1 = img_temp_path / f"{sha1}.png"
-        img_path.rename(img_path_sha1)
-        meta.append({
-            "image_id": sha1,
-            "image_index": i,
-            "image_current_local_file_path": img_path_sha1
-        })
-        _logger.debug(f"{img_path} -> {img_path_sha1}")
-    return pd.DataFrame(meta)
+    meta = materialize_images(img_array, img_temp_path, format='PNG')
+    _logger.debug(f"Wrote {len(meta)} images to {img_temp_path}")
+    return meta
 
 
 def np_to_xr(monkey, setting, session_neural, stimuli, session_target_inds, stage):
@@ -66,6 +50,8 @@ def np_to_xr(monkey, setting, session_neural, stimuli, session_target_inds, stag
 
 
 def collect_stimuli_nat(h5, data_dir):
+    from brainio_base.stimuli import StimulusSet
+
     img_array = h5.root.images.naturalistic
     img_temp_path = data_dir / "images_temp" / "naturalistic"
     img_temp_path.mkdir(parents=True, exist_ok=True)
@@ -77,6 +63,8 @@ def collect_stimuli_nat(h5, data_dir):
 
 
 def collect_responses_nat(h5, stimuli):
+    from brainio_base.assemblies import NeuronRecordingAssembly
+
     responses_nat_d = {}
     for monkey in h5.root.neural.naturalistic:
         for setting in monkey:
@@ -89,26 +77,39 @@ def collect_responses_nat(h5, stimuli):
 
 
 def collect_synth(h5, data_dir):
+    from brainio_base.assemblies import NeuronRecordingAssembly
+    from brainio_base.stimuli import StimulusSet
+
+    sessions = [(monkey, setting, session_images) for monkey in h5.root.images.synthetic
+                for setting in monkey for session_images in setting]
+
+    def session_chunks():
+        for session_index, (monkey, setting, session_images) in enumerate(sessions):
+            identifier = f"{monkey._v_name[-1]}_{setting._v_name}_{session_images._v_name}"
+            img_temp_path = data_dir / "images_temp" / "synthetic" / identifier
+            for chunk in image_chunks(session_images):
+                yield session_index, chunk, img_temp_path, None
+
+    # encode the images of all sessions in one pool, so that sessions are processed in parallel
+    written = [[] for _ in sessions]
+    for session_index, chunk_written in materialize_chunks(session_chunks(), format='PNG'):
+        written[session_index].extend(chunk_written)
+
     protos_stimuli = []
     responses_synth_d = {}
-    for monkey in h5.root.images.synthetic:
-        for setting in monkey:
-            for session_images in setting:
-                session_neural = h5.root.neural.synthetic[monkey._v_name][setting._v_name][session_images._v_name]
-                session_target_inds = h5.root.target_inds[monkey._v_name][setting._v_name][session_images._v_name]
-
-                identifier = f"{monkey._v_name[-1]}_{setting._v_name}_{session_images._v_name}"
-                img_temp_path = data_dir / "images_temp" / "synthetic" / identifier
-                img_temp_path.mkdir(parents=True, exist_ok=True)
-                proto_stimuli = np_to_png(session_images, img_temp_path)
-                proto_stimuli["animal"] = monkey._v_name
-                proto_stimuli["setting"] = setting._v_name
-                proto_stimuli["session"] = session_images._v_name
-                protos_stimuli.append(proto_stimuli)
-
-                proto_neural = np_to_xr(monkey, setting, session_neural, proto_stimuli, session_target_inds, "synth")
-                proto_neural = NeuronRecordingAssembly(proto_neural)
-                responses_synth_d[proto_neural.name] = proto_neural
+    for (monkey, setting, session_images), session_written in zip(sessions, written):
+        session_neural = h5.root.neural.synthetic[monkey._v_name][setting._v_name][session_images._v_name]
+        session_target_inds = h5.root.target_inds[monkey._v_name][setting._v_name][session_images._v_name]
+
+        proto_stimuli = written_frame(session_written)
+        proto_stimuli["animal"] = monkey._v_name
+        proto_stimuli["setting"] = setting._v_name
+        proto_stimuli["session"] = session_images._v_name
+        protos_stimuli.append(proto_stimuli)
+
+        proto_neural = np_to_xr(monkey, setting, session_neural, proto_stimuli, session_target_inds, "synth")
+        proto_neural = NeuronRecordingAssembly(proto_neural)
+        responses_synth_d[proto_neural.name] = proto_neural
 
     proto_stimuli_all = pd.concat(protos_stimuli, axis=0)
     assert len(np.unique(proto_stimuli_all['image_id'])) == len(proto_stimuli_all)
@@ -118,44 +119,75 @@ def collect_synth(h5, data_dir):
 
 
 def main():
+    import tables
+    from brainio_collection.packaging import package_data_assembly, package_stimulus_set
+
     data_dir = Path("/Users/jjpr/dev/brainio_contrib/mkgu_packaging/dicarlo/BashivanKar2019")
     assert os.path.isdir(data_dir)
     h5_path = data_dir / "from_pouya" / "npc_v4_data.h5"
     h5 = tables.open_file(h5_path)
 
-    stimuli_nat = collect_stimuli_nat(h5, data_dir)
-    stimuli_nat.identifier = "dicarlo.BashivanKar2019.naturalistic"
-
-    responses_nat_d = collect_responses_nat(h5, stimuli_nat)
-
-    stimuli_synth, responses_synth_d = collect_synth(h5, data_dir)
-    stimuli_synth.identifier = "dicarlo.BashivanKar2019.synthetic"
-
-    _logger.debug('Packaging naturalistic stimuli')
-    package_stimulus_set(stimuli_nat, stimulus_set_identifier=stimuli_nat.identifier, bucket_name='brainio.dicarlo')
-
-    _logger.debug('Packaging naturalistic assembly')
-    responses_nat_concat = xr.concat(responses_nat_d.values(), dim="neuroid")
-    assert responses_nat_concat.shape == (24320, 233, 1)
-    package_data_assembly(
-        responses_nat_concat,
-        assembly_identifier="dicarlo.BashivanKar2019.naturalistic",
-        stimulus_set_identifier=stimuli_nat.identifier,
-        bucket_name='brainio.dicarlo'
-    )
-
-    _logger.debug('Packaging synthetic stimuli')
-    package_stimulus_set(stimuli_synth, stimulus_set_identifier=stimuli_synth.identifier, bucket_name='brainio.dicarlo')
-
-    _logger.debug('Packaging synthetic assembly')
-    responses_synth_concat = xr.concat(responses_synth_d.values(), dim="presentation")
-    assert responses_synth_concat.shape ==(21360, 233, 1)
-    package_data_assembly(
-        responses_synth_concat,
-        assembly_identifier="dicarlo.BashivanKar2019.synthetic",
-        stimulus_set_identifier=stimuli_synth.identifier,
-        bucket_name='brainio.dicarlo'
-    )
+    # the naturalistic data is packaged while the synthetic images are written;
+    # PyTables is not thread-safe and the packaging steps all write to the lookup
+    pipeline = Pipeline()
+
+    @pipeline.step(locks=['h5'])
+    def stimuli_nat():
+        stimuli_nat = collect_stimuli_nat(h5, data_dir)
+        stimuli_nat.identifier = "dicarlo.BashivanKar2019.naturalistic"
+        return stimuli_nat
+
+    @pipeline.step(requires=['stimuli_nat'], locks=['h5'])
+    def responses_nat(stimuli_nat):
+        return collect_responses_nat(h5, stimuli_nat)
+
+    @pipeline.step(locks=['h5'])
+    def synth():
+        stimuli_synth, responses_synth_d = collect_synth(h5, data_dir)
+        stimuli_synth.identifier = "dicarlo.BashivanKar2019.synthetic"
+        return stimuli_synth, responses_synth_d
+
+    @pipeline.step(requires=['stimuli_nat'], retries=2, locks=['lookup'])
+    def package_stimuli_nat(stimuli_nat):
+        _logger.debug('Packaging naturalistic stimuli')
+        package_stimulus_set(stimuli_nat, stimulus_set_identifier=stimuli_nat.identifier, bucket_name='brainio.dicarlo')
+
+    @pipeline.step(requires=['stimuli_nat', 'responses_nat'], after=['package_stimuli_nat'], retries=2, locks=['lookup'])
+    def package_assembly_nat(stimuli_nat, responses_nat):
+        _logger.debug('Packaging naturalistic assembly')
+        responses_nat_concat = xr.concat(responses_nat.values(), dim="neuroid")
+        assert responses_nat_concat.shape == (24320, 233, 1)
+        package_data_assembly(
+            responses_nat_concat,
+            assembly_identifier="dicarlo.BashivanKar2019.naturalistic",
+            stimulus_set_identifier=stimuli_nat.identifier,
+            bucket_name='brainio.dicarlo'
+        )
+
+    @pipeline.step(requires=['synth'], retries=2, locks=['lookup'])
+    def package_stimuli_synth(synth):
+        stimuli_synth, _ = synth
+        _logger.debug('Packaging synthetic stimuli')
+        package_stimulus_set(stimuli_synth, stimulus_set_identifier=stimuli_synth.identifier,
+                             bucket_name='brainio.dicarlo')
+
+    @pipeline.step(requires=['synth'], after=['package_stimuli_synth'], retries=2, locks=['lookup'])
+    def package_assembly_synth(synth):
+        stimuli_synth, responses_synth_d = synth
+        _logger.debug('Packaging synthetic assembly')
+        responses_synth_concat = xr.concat(responses_synth_d.values(), dim="presentation")
+        assert responses_synth_concat.shape ==(21360, 233, 1)
+        package_data_assembly(
+            responses_synth_concat,
+            assembly_identifier="dicarlo.BashivanKar2019.synthetic",
+            stimulus_set_identifier=stimuli_synth.identifier,
+            bucket_name='brainio.dicarlo'
+        )
+
+    try:
+        pipeline.run()
+    finally:
+        instrumentation.write_report(data_dir / 'packaging_report.json')
 
 
 if __name__ == '__main__':
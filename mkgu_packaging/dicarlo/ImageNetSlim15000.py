@@ -1,11 +1,11 @@
 import os
 import numpy as np
 import pandas as pd
-from brainio_base.stimuli import StimulusSet
-from brainio_collection.packaging import package_stimulus_set
 
 
 def collect_stimuli(data_path):
+    from brainio_base.stimuli import StimulusSet
+
     assert os.path.isdir(data_path)
     stimulus_df = pd.read_pickle(os.path.join(data_path,'info.pkl'))
     stimulus_set = StimulusSet(stimulus_df)
@@ -22,6 +22,8 @@ def main():
 
 
 def package(stimulus_set):
+    from brainio_collection.packaging import package_stimulus_set
+
     print("Packaging stimuli")
     package_stimulus_set(stimulus_set, stimulus_set_identifier=stimulus_set.identifier, bucket_name = 'brainio.requested')
 
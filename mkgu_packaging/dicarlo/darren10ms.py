@@ -4,8 +4,7 @@ import sys
 
 import xarray as xr
 
-from brainio_base.assemblies import NeuroidAssembly
-from brainio_contrib.packaging import package_data_assembly
+from mkgu_packaging.assembly_store import write_netcdf
 
 
 def create_xarray(savepath):
@@ -15,11 +14,14 @@ def create_xarray(savepath):
     dataset = hvm.HvMWithDiscfade()
     assembly = dataset.xr_from_hvm_10ms_temporal()
     assembly.reset_index(assembly.indexes.keys(), inplace=True)
-    assembly.to_netcdf(savepath)
+    write_netcdf(assembly, savepath)
     return assembly
 
 
 if __name__ == '__main__':
+    from brainio_base.assemblies import NeuroidAssembly
+    from brainio_contrib.packaging import package_data_assembly
+
     logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
     for logger in ['peewee', 's3transfer', 'botocore', 'boto3', 'urllib3', 'PIL']:
         logging.getLogger(logger).setLevel(logging.INFO)
@@ -5,9 +5,7 @@ import numpy as np
 import xarray as xr
 import pandas as pd
 
-import brainio_collection
-from brainio_base.assemblies import NeuronRecordingAssembly
-from brainio_collection.packaging import package_data_assembly
+from mkgu_packaging.merge import merge_blocks
 
 
 animals = ['Chabo_IT_A', 'Chabo_IT_M', 'Tito_IT_A','Tito_IT_M','TitoR_IT_A','TitoR_IT_M','Nano_IT_A',
@@ -66,27 +64,23 @@ def load_responses(metric_bins_path, csv_path):
             data=ra["data"],
             df_hvm=df_hvm
         )
-    concatted_per_var = {}
-    for v in var:
-        aligned = xr.align(*[x["xr_data"] for x in relevant_arrays if x["variation"] == v],
-                           join="outer",
-                           exclude=["neuroid"],
-                           fill_value=np.nan
-                           )
-        concatted_per_var[v] = xr.concat(aligned, dim="neuroid")
-    stacked_per_var = {}
-    for v in concatted_per_var:
-        stacked_per_var[v] = concatted_per_var[v].stack(presentation=["repetition", "stimulus"])
-    final = xr.concat(stacked_per_var.values(), dim="presentation")#.transpose()
+    # scatter every animal and variation into one presentation x neuroid array instead of outer-joining the animals,
+    # so that animals with fewer repetitions are padded once rather than in every intermediate array
+    blocks = [ra["xr_data"].stack(presentation=["repetition", "stimulus"])
+              for v in var for ra in relevant_arrays if ra["variation"] == v]
+    final = merge_blocks(blocks, presentation_keys=["image_id", "repetition"], neuroid_keys=["neuroid_id"])
+    final = final.transpose("neuroid", "presentation")
     final = final.expand_dims('time_bin', 2)
     final['time_bin_start'] = ('time_bin', [70])
     final['time_bin_end'] = ('time_bin', [170])
-    print(final.dims)
     assert final.dims == ("neuroid", "presentation", "time_bin")
     return final
 
 
 def main():
+    import brainio_collection
+    from brainio_collection.packaging import package_data_assembly
+
     metric_bins_path = Path("/braintree/home/darren/work/metric_bins.npy")
     csv_path = Path(__file__).parents[2] / "notebooks" / "2020-11-22_hvm_from_dldata.csv"
 
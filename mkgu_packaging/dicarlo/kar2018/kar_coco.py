@@ -1,7 +1,6 @@
 import os
 from glob import glob
 
-import h5py
 import numpy as np
 import pandas as pd
 import re
@@ -9,27 +8,31 @@ import xarray as xr
 from pathlib import Path
 from tqdm import tqdm
 
-from brainio_base.assemblies import NeuronRecordingAssembly
-from brainio_collection.knownfile import KnownFile as kf
-from brainio_contrib.packaging import package_stimulus_set, package_data_assembly
+from mkgu_packaging.coords import lookup_values
 from mkgu_packaging.dicarlo.kar2018 import filter_neuroids
+from mkgu_packaging.hashing import sha1_files
+from mkgu_packaging.pipeline import Pipeline
 
 
 def collect_stimuli(stimuli_directory):
+    import h5py
+
     meta = os.path.join(stimuli_directory, 'cocogray_labels.mat')
     meta = h5py.File(meta, 'r')
-    labels = [''.join(chr(c) for c in meta[meta['lb'].value[0, i]]) for i in range(meta['lb'].value[0].size)]
+    label_refs = meta['lb'][0]
+    labels = [''.join(chr(c) for c in meta[label_ref]) for label_ref in label_refs]
     stimuli = []
-    for image_file_path in tqdm(glob(os.path.join(stimuli_directory, '*.png'))):
+    image_file_paths = glob(os.path.join(stimuli_directory, '*.png'))
+    sha1s = sha1_files(image_file_paths)
+    for image_file_path, sha1 in tqdm(zip(image_file_paths, sha1s), total=len(image_file_paths)):
         image_file_name = os.path.basename(image_file_path)
         image_number = re.match('im([0-9]+).png', image_file_name)
         image_number = int(image_number.group(1))
-        im_kf = kf(image_file_path)
         stimuli.append({
-            'image_id': im_kf.sha1,
+            'image_id': sha1,
             'image_file_name': image_file_name,
             'image_current_local_file_path': image_file_path,
-            'image_file_sha1': im_kf.sha1,
+            'image_file_sha1': sha1,
             'image_number': image_number,
             'image_path_within_store': image_file_name,
             'label': labels[image_number],
@@ -41,17 +44,19 @@ def collect_stimuli(stimuli_directory):
 
 
 def load_responses(response_file, stimuli):
+    import h5py
+    from brainio_base.assemblies import NeuronRecordingAssembly
+
     responses = h5py.File(response_file, 'r')
     assemblies = []
     neuroid_id_offset = 0
     for monkey in responses.keys():
         spike_rates = responses[monkey]['rates']
-        assembly = xr.DataArray(spike_rates.value,
+        assembly = xr.DataArray(spike_rates[()],
                                 coords={
                                     'image_num': ('image_id', list(range(spike_rates.shape[0]))),
-                                    'image_id': ('image_id', [
-                                        stimuli['image_id'][stimuli['image_number'] == num].values[0]
-                                        for num in range(spike_rates.shape[0])]),
+                                    'image_id': ('image_id', lookup_values(
+                                        stimuli, 'image_number', range(spike_rates.shape[0]))),
                                     'neuroid_id': ('neuroid', list(
                                         range(neuroid_id_offset, neuroid_id_offset + spike_rates.shape[1]))),
                                     'region': ('neuroid', ['IT'] * spike_rates.shape[1]),
@@ -79,18 +84,38 @@ def load_responses(response_file, stimuli):
 
 
 def main():
+    from brainio_contrib.packaging import package_stimulus_set, package_data_assembly
+
     data_dir = Path(__file__).parent / 'coco'
-    stimuli = collect_stimuli(data_dir / 'stimuli')
-    stimuli.name = 'dicarlo.Kar2018cocogray'
-    assembly = load_responses(data_dir / 'cocoGray_neural.h5', stimuli)
-    assembly.name = 'dicarlo.Kar2018cocogray'
-
-    print("Packaging stimuli")
-    package_stimulus_set(stimuli, stimulus_set_name=stimuli.name,
-                         bucket_name="brainio-dicarlo")
-    print("Packaging assembly")
-    package_data_assembly(assembly, data_assembly_name=assembly.name, stimulus_set_name=stimuli.name,
-                          bucket_name="brainio-dicarlo")
+    name = 'dicarlo.Kar2018cocogray'
+    # the stimulus and response branches only meet when the assembly is registered against the stimulus set
+    pipeline = Pipeline()
+
+    @pipeline.step()
+    def stimuli():
+        stimuli = collect_stimuli(data_dir / 'stimuli')
+        stimuli.name = name
+        return stimuli
+
+    @pipeline.step(requires=['stimuli'])
+    def assembly(stimuli):
+        assembly = load_responses(data_dir / 'cocoGray_neural.h5', stimuli)
+        assembly.name = name
+        return assembly
+
+    @pipeline.step(requires=['stimuli'], retries=2)
+    def package_stimuli(stimuli):
+        print("Packaging stimuli")
+        package_stimulus_set(stimuli, stimulus_set_name=stimuli.name,
+                             bucket_name="brainio-dicarlo")
+
+    @pipeline.step(requires=['assembly', 'stimuli'], after=['package_stimuli'], retries=2)
+    def package_assembly(assembly, stimuli):
+        print("Packaging assembly")
+        package_data_assembly(assembly, data_assembly_name=assembly.name, stimulus_set_name=stimuli.name,
+                              bucket_name="brainio-dicarlo")
+
+    pipeline.run()
 
 
 if __name__ == '__main__':
@@ -1,21 +1,20 @@
-import h5py
 import numpy as np
 import xarray as xr
 from pathlib import Path
 
-import brainio_collection
-from brainio_base.assemblies import NeuronRecordingAssembly
-from brainio_contrib.packaging import package_data_assembly
 from mkgu_packaging.dicarlo.kar2018 import filter_neuroids
 
 
 def load_responses(response_file, additional_coords):
+    import h5py
+    from brainio_base.assemblies import NeuronRecordingAssembly
+
     responses = h5py.File(response_file, 'r')
     assemblies = []
     neuroid_id_offset = 0
     for monkey in responses.keys():
         spike_rates = responses[monkey]['rates']
-        assembly = xr.DataArray(spike_rates.value,
+        assembly = xr.DataArray(spike_rates[()],
                                 coords={**{
                                     'image_num': ('image_id', list(range(spike_rates.shape[0]))),
                                     'neuroid_id': ('neuroid', list(
@@ -45,14 +44,16 @@ def load_responses(response_file, additional_coords):
 
 
 def load_stimuli_ids(data_dir):
+    import h5py
+    import brainio_collection
+
     # these stimuli_ids are SHA1 hashes on generative parameters
     stimuli_ids = h5py.File(data_dir / 'hvm640_ids.mat', 'r')
-    stimuli_ids = [''.join(chr(c) for c in stimuli_ids[stimuli_ids['hvm640_ids'].value[0, i]])
-                   for i in range(stimuli_ids['hvm640_ids'].value[0].size)]
+    stimuli_ids = [''.join(chr(c) for c in stimuli_ids[id_ref]) for id_ref in stimuli_ids['hvm640_ids'][0]]
     # we use the filenames to reference into our packaged StimulusSet ids
     stimuli_filenames = h5py.File(data_dir / 'hvm640_names.mat', 'r')
-    stimuli_filenames = [''.join(chr(c) for c in stimuli_filenames[stimuli_filenames['hvm640_img_names'].value[0, i]])
-                         for i in range(stimuli_filenames['hvm640_img_names'].value[0].size)]
+    stimuli_filenames = [''.join(chr(c) for c in stimuli_filenames[name_ref])
+                         for name_ref in stimuli_filenames['hvm640_img_names'][0]]
     # the stimuli_ids in our packaged StimulusSets are SHA1 hashes on pixels.
     # we thus need to reference between those two ids.
     packaged_stimuli = brainio_collection.get_stimulus_set('dicarlo.hvm')
@@ -63,6 +64,8 @@ def load_stimuli_ids(data_dir):
 
 
 def main():
+    from brainio_contrib.packaging import package_data_assembly
+
     data_dir = Path(__file__).parent / 'hvm'
     stimuli_ids = load_stimuli_ids(data_dir)
 
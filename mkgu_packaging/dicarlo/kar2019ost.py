@@ -1,19 +1,13 @@
 import os
 
-import h5py
 import numpy as np
 import pandas as pd
-import scipy.misc
-import scipy.misc
-import scipy.misc
 import xarray as xr
 from result_caching import store
 from tqdm import tqdm
 
-from brainio_base.assemblies import DataAssembly
-from brainio_base.stimuli import StimulusSet
-from brainio_collection.knownfile import KnownFile
-from brainio_contrib.packaging import package_stimulus_set, package_data_assembly
+from mkgu_packaging.materialize import materialize_chunks
+from mkgu_packaging.validation import validate_stimuli
 
 object_lookup = {
     1: 'bear',
@@ -29,33 +23,56 @@ object_lookup = {
 }
 
 
+STIMULI_CHUNK_SIZE = 256
+
+
+def bytescale(images):
+    """ Per-image min-max scaling to uint8, as `scipy.misc.imsave` applies it to every non-uint8 image """
+    if images.dtype == np.uint8:
+        return images
+    axes = tuple(range(1, images.ndim))
+    cmin, cmax = images.min(axis=axes, keepdims=True), images.max(axis=axes, keepdims=True)
+    cscale = cmax - cmin
+    cscale[cscale == 0] = 1
+    scaled = (images - cmin) * (255. / cscale)
+    return (scaled.clip(0, 255) + .5).astype(np.uint8)
+
+
 @store(identifier_ignore=['stimuli_dir'])
 def collect_stimuli(data_path, stimuli_dir):
-    stimuli = []
+    import h5py
+    from brainio_base.stimuli import StimulusSet
+
     with h5py.File(data_path, 'r') as f:
-        images, objects = f['images'], f['obj']
-        os.makedirs(stimuli_dir, exist_ok=True)
-        for image_num, (image, obj) in tqdm(enumerate(zip(images, objects[0])), desc='stimuli', total=len(images)):
-            image = image.transpose([1, 2, 0])
-            obj = object_lookup[obj]
-            filename = f"image_{image_num:04d}.jpg"
-            target_path = os.path.join(stimuli_dir, filename)
-            scipy.misc.imsave(target_path, np.rot90(np.fliplr(image)))
-            im_kf = KnownFile(target_path)
-            stimuli.append({
-                'image_current_local_file_path': target_path,
-                'image_path_within_store': filename,
-                "image_file_sha1": im_kf.sha1,
-                "image_id": im_kf.sha1,
-                'image_num': image_num,
-                'image_label': obj,
-            })
+        images, objects = f['images'], f['obj'][0]
+
+        def chunks():
+            for start in range(0, len(images), STIMULI_CHUNK_SIZE):
+                # images are stored channels-first and transposed:
+                # swapping the axes equals the `rot90(fliplr(image.transpose([1, 2, 0])))` of every single image
+                chunk = bytescale(images[start:start + STIMULI_CHUNK_SIZE].transpose([0, 3, 2, 1]))
+                filenames = [f"image_{image_num:04d}.jpg" for image_num in range(start, start + len(chunk))]
+                yield start, chunk, stimuli_dir, filenames
+
+        written = [image for _, chunk_written in tqdm(
+            materialize_chunks(chunks(), format='JPEG'), desc='stimuli',
+            total=-(-len(images) // STIMULI_CHUNK_SIZE)) for image in chunk_written]
+        stimuli = [{
+            'image_current_local_file_path': target_path,
+            'image_path_within_store': os.path.basename(target_path),
+            'image_num': image_num,
+            'image_label': object_lookup[obj],
+            'image_file_sha1': sha1,
+            'image_id': sha1,
+        } for image_num, ((sha1, target_path), obj) in enumerate(zip(written, objects))]
     stimuli = StimulusSet(stimuli)
     return stimuli
 
 
 @store(identifier_ignore=['stimuli'])
 def collect_data(data_folder, stimuli):
+    import h5py
+
     data = []
     with h5py.File(os.path.join(data_folder, 'dataset.h5'), 'r') as svm_f, \
             h5py.File(os.path.join(data_folder, 'ost_on_logistic.mat'), 'r') as logistic_f:
@@ -71,6 +88,8 @@ def collect_data(data_folder, stimuli):
 
 
 def to_xarray(data):
+    from brainio_base.assemblies import DataAssembly
+
     presentation_columns = [column for column in data.columns if column not in ['ost-svm', 'ost-logistic']]
     data = xr.DataArray(np.stack((data['ost-svm'], data['ost-logistic'])),
                         coords={**{column: ('presentation', data[column]) for column in presentation_columns},
@@ -90,7 +109,8 @@ def main():
 
     assert len(stimuli) == len(assembly['presentation']) == 1320
     assert len(set(assembly['image_id'].values)) == 1318
-    assert set(assembly['image_id'].values) == set(stimuli['image_id'])
+    # 2 of the images were shown as two stimuli each
+    validate_stimuli(assembly, stimuli, columns=['image_label'], allow_duplicates=True)
     assert len(set(assembly['image_label'].values)) == 10
 
     assembly.name = 'dicarlo.Kar2019'
@@ -99,6 +119,8 @@ def main():
 
 
 def package(assembly, stimuli):
+    from brainio_contrib.packaging import package_stimulus_set, package_data_assembly
+
     print("Packaging stimuli")
     package_stimulus_set(stimuli, stimulus_set_name=stimuli.name)
 
@@ -1,20 +1,17 @@
 import os
-import zipfile
 from glob import glob
 from pathlib import Path
 
-import boto3
 import pandas as pd
 import xarray as xr
 
 import mkgu_packaging
-from brainio_base.assemblies import BehavioralAssembly
-from brainio_base.stimuli import StimulusSet
-from brainio_collection.lookup import pwdb
-from brainio_collection.knownfile import KnownFile as kf
-from brainio_collection.assemblies import AssemblyModel, AssemblyStoreMap, AssemblyStoreModel
-from brainio_collection.stimuli import ImageModel, AttributeModel, ImageMetaModel, StimulusSetModel, ImageStoreModel, \
-    StimulusSetImageMap, ImageStoreMap
+from mkgu_packaging import assembly_store, instrumentation
+from mkgu_packaging.image_store import write_image_zip
+from mkgu_packaging.lookup import write_image_lookup
+from mkgu_packaging.pipeline import Pipeline
+from mkgu_packaging.upload import UploadManager
+from mkgu_packaging.validation import validate_stimuli
 
 
 def get_objectome(source_data_path):
@@ -29,6 +26,9 @@ def get_objectome(source_data_path):
 
 
 def to_xarray(objectome):
+    from brainio_base.assemblies import BehavioralAssembly
+
+    objectome = assembly_store.share_strings(objectome)  # repetitive strings such as choice and sample_obj
     columns = objectome.columns
     objectome = xr.DataArray(objectome['choice'],
                              coords={column: ('presentation', objectome[column]) for column in columns},
@@ -40,6 +40,8 @@ def to_xarray(objectome):
 
 
 def load_stimuli(meta_assembly, source_stim_path):
+    from brainio_base.stimuli import StimulusSet
+
     stimuli_paths = list(glob(os.path.join(source_stim_path, '*.png')))
     stimuli_paths.sort()
     stimuli = StimulusSet({'image_current_local_file_path': stimuli_paths,
@@ -62,21 +64,21 @@ def load_responses(source_data_path):
 
 
 def create_image_zip(stimuli, target_zip_path):
-    os.makedirs(os.path.dirname(target_zip_path), exist_ok=True)
-    with zipfile.ZipFile(target_zip_path, 'w') as target_zip:
-        for image in stimuli.itertuples():
-            target_zip.write(image.image_current_local_file_path, arcname=image.image_path_within_store)
-    zip_kf = kf(target_zip_path)
-    return zip_kf.sha1
+    return write_image_zip(stimuli['image_current_local_file_path'], stimuli['image_path_within_store'],
+                           target_zip_path)
 
 
 def write_netcdf(assembly, target_netcdf_file):
-    assembly.reset_index(assembly.indexes.keys(), inplace=True)
-    assembly.to_netcdf(target_netcdf_file)
+    assembly = assembly.reset_index(list(assembly.indexes))
+    # published and opened with plain xarray by brainio_collection, so string coordinates stay strings
+    assembly_store.write_netcdf(assembly, target_netcdf_file)
 
 
 def add_stimulus_set_metadata_and_lookup_to_db(stimuli, stimulus_set_name, bucket_name, zip_file_name,
                                                image_store_unique_name, zip_sha1):
+    from brainio_collection.lookup import pwdb
+    from brainio_collection.stimuli import StimulusSetModel, ImageStoreModel
+
     pwdb.connect(reuse_if_open=True)
     stim_set_model, created = StimulusSetModel.get_or_create(name=stimulus_set_name)
     image_store, created = ImageStoreModel.get_or_create(location_type="S3", store_type="zip",
@@ -88,20 +90,21 @@ def add_stimulus_set_metadata_and_lookup_to_db(stimuli, stimulus_set_name, bucke
 
 
 def add_image_metadata_to_db(stimuli, stim_set_model, image_store):
+    from brainio_collection.lookup import pwdb
+    from brainio_collection.stimuli import AttributeModel
+
     pwdb.connect(reuse_if_open=True)
     eav_image_sample_obj, created = AttributeModel.get_or_create(name="image_sample_obj", type="str")
     eav_image_label, created = AttributeModel.get_or_create(name="image_label", type="str")
 
-    for image in stimuli.itertuples():
-        pw_image, created = ImageModel.get_or_create(image_id=image.image_id)
-        pw_stimulus_set_image_map, created = StimulusSetImageMap.get_or_create(stimulus_set=stim_set_model, image=pw_image)
-        pw_image_image_store_map, created = ImageStoreMap.get_or_create(image=pw_image, image_store=image_store,
-                                                                        path=image.image_path_within_store)
-        ImageMetaModel.get_or_create(image=pw_image, attribute=eav_image_sample_obj, value=str(image.image_sample_obj))
-        ImageMetaModel.get_or_create(image=pw_image, attribute=eav_image_label, value=str(image.image_label))
+    write_image_lookup(stimuli, stim_set_model, image_store, path_column='image_path_within_store',
+                       attributes=[(eav_image_sample_obj, 'image_sample_obj'), (eav_image_label, 'image_label')])
 
 
 def add_assembly_lookup(assembly_name, stim_set_model, bucket_name, target_netcdf_file, assembly_store_unique_name):
+    from brainio_collection.knownfile import KnownFile as kf
+    from brainio_collection.assemblies import AssemblyModel, AssemblyStoreMap, AssemblyStoreModel
+
     kf_netcdf = kf(target_netcdf_file)
     assy, created = AssemblyModel.get_or_create(name=assembly_name, assembly_class="BehavioralAssembly",
                                                 stimulus_set=stim_set_model)
@@ -113,9 +116,8 @@ def add_assembly_lookup(assembly_name, stim_set_model, bucket_name, target_netcd
     assy_store_map, created = AssemblyStoreMap.get_or_create(assembly_model=assy, assembly_store_model=store, role=assembly_name)
 
 
-def upload_to_s3(source_file_path, bucket_name, target_s3_key):
-    client = boto3.client('s3')
-    client.upload_file(source_file_path, bucket_name, target_s3_key)
+def upload_to_s3(uploads):
+    UploadManager().upload(uploads)
 
 
 def main():
@@ -124,6 +126,7 @@ def main():
     source_data_path = source_path / 'data'
     source_stim_path = source_path / 'stim'
     target_path = pkg_path.parent / "objectome" / "out"
+    os.makedirs(target_path, exist_ok=True)
     target_bucket_name = "brainio-dicarlo"
     assembly_name = "dicarlo.Rajalingham2018"
 
@@ -149,44 +152,77 @@ def main():
     private_target_zip_s3_key = private_target_zip_basename
     private_target_netcdf_s3_key = private_target_netcdf_basename
 
-    [all_assembly, public_assembly, private_assembly] = load_responses(source_data_path)
-    all_assembly.name = assembly_name
-    public_assembly.name = public_assembly_unique_name
-    private_assembly.name = private_assembly_unique_name
-    all_stimuli = load_stimuli(all_assembly, source_stim_path)
-    public_stimuli = all_stimuli[all_stimuli['image_id'].isin(public_assembly['image_id'].values)]
-    private_stimuli = all_stimuli[all_stimuli['image_id'].isin(private_assembly['image_id'].values)]
-    public_stimuli.name = public_stimulus_set_unique_name
-    private_stimuli.name = private_stimulus_set_unique_name
-
-    assert len(public_assembly) + len(private_assembly) == len(all_assembly) == 927296
-    assert len(private_assembly) == 341785
-    assert len(set(public_assembly['image_id'].values)) == len(public_stimuli) == 2160
-    assert len(set(private_assembly['image_id'].values)) == len(private_stimuli) == 240
-    assert set(all_stimuli['image_id'].values) == set(all_assembly['image_id'].values)
-    assert set(public_stimuli['image_id'].values) == set(public_assembly['image_id'].values)
-    assert set(private_stimuli['image_id'].values) == set(private_assembly['image_id'].values)
-    assert len(set(private_assembly['choice'].values)) == len(set(public_assembly['choice'].values)) == 24
-
-    print([assembly.name for assembly in [all_assembly, public_assembly, private_assembly]])
-
-    public_zip_sha1 = create_image_zip(public_stimuli, public_target_zip_path)
-    public_stimulus_set_model = add_stimulus_set_metadata_and_lookup_to_db(public_stimuli, public_stimulus_set_unique_name, target_bucket_name, public_target_zip_basename, public_image_store_unique_name, public_zip_sha1)
-    write_netcdf(public_assembly, public_target_netcdf_path)
-    add_assembly_lookup(public_assembly_unique_name,public_stimulus_set_model,target_bucket_name,public_target_netcdf_path, public_assembly_store_unique_name)
-
-    private_zip_sha1 = create_image_zip(private_stimuli, private_target_zip_path)
-    private_stimulus_set_model = add_stimulus_set_metadata_and_lookup_to_db(private_stimuli, private_stimulus_set_unique_name, target_bucket_name, private_target_zip_basename, private_image_store_unique_name, private_zip_sha1)
-    write_netcdf(private_assembly, private_target_netcdf_path)
-    add_assembly_lookup(private_assembly_unique_name,private_stimulus_set_model,target_bucket_name,private_target_netcdf_path, private_assembly_store_unique_name)
-
-    print("uploading to S3")
-    upload_to_s3(str(public_target_zip_path), target_bucket_name, public_target_zip_s3_key)
-    upload_to_s3(str(public_target_netcdf_path), target_bucket_name, public_target_netcdf_s3_key)
-    upload_to_s3(str(private_target_zip_path), target_bucket_name, private_target_zip_s3_key)
-    upload_to_s3(str(private_target_netcdf_path), target_bucket_name, private_target_netcdf_s3_key)
-
-    return [(public_assembly, public_stimuli), (private_assembly, private_stimuli)]
+    # zips and netCDF files are written concurrently, and uploaded while they are registered in the lookup database
+    pipeline = Pipeline()
+
+    @pipeline.step()
+    def responses():
+        [all_assembly, public_assembly, private_assembly] = load_responses(source_data_path)
+        all_assembly.name = assembly_name
+        public_assembly.name = public_assembly_unique_name
+        private_assembly.name = private_assembly_unique_name
+        return {'all': all_assembly, 'public': public_assembly, 'private': private_assembly}
+
+    @pipeline.step(requires=['responses'])
+    def stimuli(responses):
+        all_assembly, public_assembly, private_assembly = responses['all'], responses['public'], responses['private']
+        all_stimuli = load_stimuli(all_assembly, source_stim_path)
+        public_stimuli = all_stimuli[all_stimuli['image_id'].isin(public_assembly['image_id'].values)]
+        private_stimuli = all_stimuli[all_stimuli['image_id'].isin(private_assembly['image_id'].values)]
+        public_stimuli.name = public_stimulus_set_unique_name
+        private_stimuli.name = private_stimulus_set_unique_name
+
+        assert len(public_assembly) + len(private_assembly) == len(all_assembly) == 927296
+        assert len(private_assembly) == 341785
+        assert len(set(public_assembly['image_id'].values)) == len(public_stimuli) == 2160
+        assert len(set(private_assembly['image_id'].values)) == len(private_stimuli) == 240
+        for assembly, stimuli in [(all_assembly, all_stimuli), (public_assembly, public_stimuli),
+                                  (private_assembly, private_stimuli)]:
+            validate_stimuli(assembly, stimuli, columns={'sample_obj': 'image_sample_obj'})
+        assert len(set(private_assembly['choice'].values)) == len(set(public_assembly['choice'].values)) == 24
+
+        print([assembly.name for assembly in [all_assembly, public_assembly, private_assembly]])
+        return {'all': all_stimuli, 'public': public_stimuli, 'private': private_stimuli}
+
+    @pipeline.step(requires=['stimuli'])
+    def public_zip(stimuli):
+        return create_image_zip(stimuli['public'], public_target_zip_path)
+
+    @pipeline.step(requires=['stimuli'])
+    def private_zip(stimuli):
+        return create_image_zip(stimuli['private'], private_target_zip_path)
+
+    # HDF5 is not thread-safe
+    @pipeline.step(requires=['responses'], after=['stimuli'], locks=['hdf5'])
+    def public_netcdf(responses):
+        write_netcdf(responses['public'], public_target_netcdf_path)
+
+    @pipeline.step(requires=['responses'], after=['stimuli'], locks=['hdf5'])
+    def private_netcdf(responses):
+        write_netcdf(responses['private'], private_target_netcdf_path)
+
+    @pipeline.step(requires=['stimuli', 'public_zip', 'private_zip'], after=['public_netcdf', 'private_netcdf'])
+    def register(stimuli, public_zip, private_zip):
+        public_stimulus_set_model = add_stimulus_set_metadata_and_lookup_to_db(stimuli['public'], public_stimulus_set_unique_name, target_bucket_name, public_target_zip_basename, public_image_store_unique_name, public_zip)
+        add_assembly_lookup(public_assembly_unique_name,public_stimulus_set_model,target_bucket_name,public_target_netcdf_path, public_assembly_store_unique_name)
+        private_stimulus_set_model = add_stimulus_set_metadata_and_lookup_to_db(stimuli['private'], private_stimulus_set_unique_name, target_bucket_name, private_target_zip_basename, private_image_store_unique_name, private_zip)
+        add_assembly_lookup(private_assembly_unique_name,private_stimulus_set_model,target_bucket_name,private_target_netcdf_path, private_assembly_store_unique_name)
+
+    # interrupted uploads resume from their recorded parts, so retrying only sends what is missing
+    @pipeline.step(after=['public_zip', 'private_zip', 'public_netcdf', 'private_netcdf'], retries=3)
+    def upload():
+        print("uploading to S3")
+        upload_to_s3([(str(public_target_zip_path), target_bucket_name, public_target_zip_s3_key),
+                      (str(public_target_netcdf_path), target_bucket_name, public_target_netcdf_s3_key),
+                      (str(private_target_zip_path), target_bucket_name, private_target_zip_s3_key),
+                      (str(private_target_netcdf_path), target_bucket_name, private_target_netcdf_s3_key)])
+
+    try:
+        results = pipeline.run()
+    finally:
+        instrumentation.write_report(target_path / 'packaging_report.json')
+    responses, stimuli = results['responses'], results['stimuli']
+    return [(responses['public'], stimuli['public']), (responses['private'], stimuli['private'])]
 
 
 if __name__ == '__main__':
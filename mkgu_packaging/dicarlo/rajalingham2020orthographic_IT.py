@@ -5,12 +5,12 @@ import pickle
 import numpy as np
 import xarray as xr
 
-from brainio_base.stimuli import StimulusSet
-from brainio_base.assemblies import NeuronRecordingAssembly
-from brainio_collection.packaging import package_stimulus_set, package_data_assembly
+from mkgu_packaging.coords import assign_frame_coords
 
 
 def collect_stimuli(data_dir):
+    from brainio_base.stimuli import StimulusSet
+
     IT_base616 = pickle.load(open(os.path.join(data_dir, 'data_IT_base616.pkl'), 'rb'))
     stimuli = IT_base616['meta']
 
@@ -37,6 +37,8 @@ def collect_stimuli(data_dir):
 
 
 def load_responses(data_dir, stimuli):
+    from brainio_base.assemblies import NeuronRecordingAssembly
+
     IT_base616 = pickle.load(open(os.path.join(data_dir, 'data_IT_base616.pkl'), 'rb'))
     features = IT_base616['IT_features']  # Shaped images x neuroids x repetitions x time_bins
 
@@ -60,11 +62,9 @@ def load_responses(data_dir, stimuli):
                                     'repetition': ('repetition', list(range(features.shape[2])))},
                             dims=['image', 'neuroid', 'repetition', 'time_bin'])
 
-    for column_name, column_data in neuroid_meta.iteritems():
-        assembly = assembly.assign_coords(**{f'{column_name}': ('neuroid', list(column_data.values))})
+    assembly = assign_frame_coords(assembly, neuroid_meta, 'neuroid')
 
-    for column_name, column_data in stimuli.iteritems():
-        assembly = assembly.assign_coords(**{f'{column_name}': ('image', list(column_data.values))})
+    assembly = assign_frame_coords(assembly, stimuli, 'image')
 
     # Collapse dimensions 'image' and 'repetitions' into a single 'presentation' dimension
     assembly = assembly.stack(presentation=('image', 'repetition')).reset_index('presentation')
@@ -77,6 +77,8 @@ def load_responses(data_dir, stimuli):
 
 
 def main():
+    from brainio_collection.packaging import package_stimulus_set, package_data_assembly
+
     data_dir = Path(__file__).parents[5] / 'data2' / 'active' / 'users' / 'sachis' / 'database' / 'Rajalingham2020'
     assert os.path.isdir(data_dir)
     stimuli = collect_stimuli(data_dir)
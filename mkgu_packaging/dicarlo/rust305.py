@@ -4,12 +4,11 @@ import numpy as np
 import xarray as xr
 import pandas as pd
 
-import brainio_collection
-from brainio_base.assemblies import NeuronRecordingAssembly
-from brainio_collection.packaging import package_data_assembly
-
 
 def main():
+    import brainio_collection
+    from brainio_collection.packaging import package_data_assembly
+
     stimuli = brainio_collection.get_stimulus_set('dicarlo.Rust2012')
 
     single_nc_path = Path("/Users/jjpr/dev/dldata/scripts/rust_single.nc")
@@ -0,0 +1,31 @@
+"""
+Re-package all Solo RSVP datasets in one pipeline: stimuli are collected and packaged concurrently,
+while the recordings are loaded one after the other under the `solo` lock
+"""
+
+import os
+from pathlib import Path
+
+from mkgu_packaging import instrumentation
+from mkgu_packaging.dicarlo.sanghavi import sanghavi2020, sanghavijozwik2020, sanghavimurty2020, \
+    sanghavimurty2020things1, sanghavimurty2020things2
+from mkgu_packaging.pipeline import Pipeline
+
+DATASETS = [sanghavi2020, sanghavimurty2020, sanghavimurty2020things1, sanghavimurty2020things2, sanghavijozwik2020]
+
+
+def main():
+    data_dir = Path(__file__).parents[6] / 'data2' / 'active' / 'users' / 'sachis'
+    assert os.path.isdir(data_dir)
+
+    pipeline = Pipeline()
+    for dataset in DATASETS:
+        dataset.add_steps(pipeline, data_dir)
+    try:
+        pipeline.run()
+    finally:
+        instrumentation.write_report(data_dir / 'packaging_report.json')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,17 @@
 import os
 from pathlib import Path
-import json
 
 import numpy as np
-import xarray as xr
 import pandas as pd
 
-from brainio_base.assemblies import NeuronRecordingAssembly
-from brainio_base.stimuli import StimulusSet
-from brainio_collection.packaging import package_data_assembly, package_stimulus_set
-from mkgu_packaging.dicarlo.sanghavi import filter_neuroids
+from mkgu_packaging.dicarlo.sanghavi.solo import SOLO_MODULES, SoloRecording, add_packaging_steps, solo_inputs
+from mkgu_packaging.pipeline import Pipeline
+from mkgu_packaging.stage_cache import stage
 
 
 def collect_stimuli(data_dir):
+    from brainio_base.stimuli import StimulusSet
+
     image_dir = data_dir / 'images' / 'things-1'
     assert os.path.isdir(image_dir)
     files = sorted(os.listdir(image_dir), key=lambda x: int(os.path.splitext(x)[0]))
@@ -33,84 +32,29 @@ def collect_stimuli(data_dir):
     return stimuli
 
 
-def load_responses(data_dir, stimuli):
-    data_dir = data_dir / 'database'
-    assert os.path.isdir(data_dir)
-    psth = np.load(data_dir / 'solo.rsvp.things-1.experiment_psth.npy')  # Shaped images x repetitions x time_bins x channels
-
-    # Compute firing rate for given time bins
-    timebins = [[70, 170], [170, 270], [50, 100], [100, 150], [150, 200], [200, 250], [70, 270]]
-    photodiode_delay = 30  # Delay recorded on photodiode is ~30ms
-    timebase = np.arange(-100, 381, 10)  # PSTH from -100ms to 380ms relative to stimulus onset
-    assert len(timebase) == psth.shape[2]
-    rate = np.empty((len(timebins), psth.shape[0], psth.shape[1], psth.shape[3]))
-    for idx, tb in enumerate(timebins):
-        t_cols = np.where((timebase >= (tb[0] + photodiode_delay)) & (timebase < (tb[1] + photodiode_delay)))[0]
-        rate[idx] = np.mean(psth[:, :, t_cols, :], axis=2)  # Shaped time bins x images x repetitions x channels
-
-    assembly = xr.DataArray(rate,
-                            coords={'repetition': ('repetition', list(range(rate.shape[2]))),
-                                    'time_bin_id': ('time_bin', list(range(rate.shape[0]))),
-                                    'time_bin_start': ('time_bin', [x[0] for x in timebins]),
-                                    'time_bin_stop': ('time_bin', [x[1] for x in timebins])},
-                            dims=['time_bin', 'image', 'repetition', 'neuroid'])
-
-    # Add neuroid related meta data
-    neuroid_meta = pd.DataFrame(json.load(open(data_dir.parent / 'array-metadata' / 'mapping.json')))
-    for column_name, column_data in neuroid_meta.iteritems():
-        assembly = assembly.assign_coords(**{f'{column_name}': ('neuroid', list(column_data.values))})
-
-    # Add stimulus related meta data
-    for column_name, column_data in stimuli.iteritems():
-        assembly = assembly.assign_coords(**{f'{column_name}': ('image', list(column_data.values))})
-
-    # Collapse dimensions 'image' and 'repetitions' into a single 'presentation' dimension
-    assembly = assembly.stack(presentation=('image', 'repetition')).reset_index('presentation')
-    assembly = assembly.drop('image')
-    assembly = NeuronRecordingAssembly(assembly)
-
-    # Filter noisy electrodes
-    psth = np.load(data_dir / 'solo.rsvp.things-1.normalizer_psth.npy')
-    t_cols = np.where((timebase >= (70 + photodiode_delay)) & (timebase < (170 + photodiode_delay)))[0]
-    rate = np.mean(psth[:, :, t_cols, :], axis=2)
-    normalizer_assembly = xr.DataArray(rate,
-                                       coords={'repetition': ('repetition', list(range(rate.shape[1]))),
-                                               'image_id': ('image', list(range(rate.shape[0]))),
-                                               'id': ('image', list(range(rate.shape[0])))},
-                                       dims=['image', 'repetition', 'neuroid'])
-    for column_name, column_data in neuroid_meta.iteritems():
-        normalizer_assembly = normalizer_assembly.assign_coords(
-            **{f'{column_name}': ('neuroid', list(column_data.values))})
-    normalizer_assembly = normalizer_assembly.stack(presentation=('image', 'repetition')).reset_index('presentation')
-    normalizer_assembly = normalizer_assembly.drop('image')
-    normalizer_assembly = normalizer_assembly.transpose('presentation', 'neuroid')
-    normalizer_assembly = NeuronRecordingAssembly(normalizer_assembly)
-
-    filtered_assembly = filter_neuroids(normalizer_assembly, 0.7)
-    assembly = assembly.sel(neuroid=np.isin(assembly.neuroid_id, filtered_assembly.neuroid_id))
-    assembly = assembly.transpose('presentation', 'neuroid', 'time_bin')
-
-    # Add other experiment and data processing related info
-    assembly.attrs['image_size_degree'] = 8
-    assembly.attrs['stim_on_time_ms'] = 100
-
-    return assembly
+@stage(version=SoloRecording.version, inputs=lambda data_dir, **_: solo_inputs(data_dir / 'database', 'things-1'),
+       ignore=['memory_budget'], depends_on=SOLO_MODULES)
+def load_responses(data_dir, stimuli, memory_budget=None):
+    assert os.path.isdir(data_dir / 'database')
+    recording = SoloRecording(data_dir / 'database', 'things-1', image_size_degree=8, stim_on_time_ms=100,
+                              memory_budget=memory_budget)
+    return recording.load(stimuli)
+
+
+def add_steps(pipeline, data_dir):
+    add_packaging_steps(pipeline, 'sanghavimurty2020things1', lambda: collect_stimuli(data_dir),
+                        lambda stimuli: load_responses(data_dir, stimuli),
+                        stimulus_set_identifier='dicarlo.THINGS1',
+                        assembly_identifier='dicarlo.SanghaviMurty2020THINGS1')
 
 
 def main():
     data_dir = Path(__file__).parents[6] / 'data2' / 'active' / 'users' / 'sachis'
     assert os.path.isdir(data_dir)
 
-    stimuli = collect_stimuli(data_dir)
-    stimuli.identifier = 'dicarlo.THINGS1'
-    assembly = load_responses(data_dir, stimuli)
-    assembly.name = 'dicarlo.SanghaviMurty2020THINGS1'
-
-    print('Packaging stimuli')
-    package_stimulus_set(stimuli, stimulus_set_identifier=stimuli.identifier, bucket_name='brainio.dicarlo')
-    print('Packaging assembly')
-    package_data_assembly(assembly, assembly_identifier=assembly.name, stimulus_set_identifier=stimuli.identifier,
-                          bucket_name='brainio.dicarlo')
+    pipeline = Pipeline()
+    add_steps(pipeline, data_dir)
+    pipeline.run()
     return
 
 
@@ -0,0 +1,219 @@
+"""
+Shared processing of the solo.rsvp.* recordings (PSTHs shaped images x repetitions x time_bins x channels)
+"""
+
+import json
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from mkgu_packaging.coords import assign_frame_coords
+from mkgu_packaging.reliability import split_half_consistency
+
+NEUROIDS_PER_BLOCK = 16
+# modules whose code the loaded assemblies depend on, to key their cached stages on
+SOLO_MODULES = [__name__, 'mkgu_packaging.coords', 'mkgu_packaging.reliability']
+
+
+def timebin_columns(timebins, timebase, photodiode_delay):
+    """
+    Column bounds `[start, stop)` into `timebase` for every time bin, shifted by the photodiode delay.
+    Equivalent to `np.where((timebase >= start + delay) & (timebase < stop + delay))` on a sorted timebase.
+    """
+    timebins = np.asarray(timebins)
+    assert np.all(np.diff(timebase) > 0), "timebase must be strictly increasing"
+    starts = np.searchsorted(timebase, timebins[:, 0] + photodiode_delay, side='left')
+    stops = np.searchsorted(timebase, timebins[:, 1] + photodiode_delay, side='left')
+    empty = stops <= starts
+    if np.any(empty):
+        raise ValueError(f"time bins {timebins[empty].tolist()} do not cover any PSTH columns")
+    return starts, stops
+
+
+def bin_rates(psth, timebins, timebase, photodiode_delay, time_axis=2, neuroids_per_block=NEUROIDS_PER_BLOCK):
+    """
+    Average `psth` over all `timebins` (in ms relative to stimulus onset) from cumulative sums along `time_axis`,
+    instead of copying the PSTH columns once per bin.
+    The cumulative sums are computed for `neuroids_per_block` entries of the last axis (the channels) at a time,
+    so that besides the rates only the float64 sums of one block of channels are held in memory.
+    Returns the rates with the time bins as the first axis, followed by the remaining axes of `psth`.
+    """
+    assert len(timebase) == psth.shape[time_axis]
+    starts, stops = timebin_columns(timebins, timebase=timebase, photodiode_delay=photodiode_delay)
+    first, last = starts.min(), stops.max()
+
+    # Only accumulate the columns covered by any bin. The leading zero row makes the sum over
+    # columns [start, stop) equal to cumulative[stop] - cumulative[start].
+    psth = np.moveaxis(psth, time_axis, 0)[first:last]
+    num_neuroids = psth.shape[-1]
+    block_size = max(1, min(neuroids_per_block, num_neuroids))
+    cumulative = np.zeros((last - first + 1,) + psth.shape[1:-1] + (block_size,), dtype=np.float64)
+
+    rate = np.empty((len(starts),) + psth.shape[1:], dtype=np.float64)
+    for block_start in range(0, num_neuroids, block_size):
+        block = slice(block_start, min(block_start + block_size, num_neuroids))
+        block_cumulative = cumulative[..., :block.stop - block.start]
+        np.cumsum(psth[..., block], axis=0, dtype=np.float64, out=block_cumulative[1:])
+        for idx, (start, stop) in enumerate(zip(starts - first, stops - first)):
+            np.subtract(block_cumulative[stop], block_cumulative[start], out=rate[idx, ..., block])
+            rate[idx, ..., block] /= stop - start
+    return rate
+
+
+def load_rates(psth_path, timebins, timebase, photodiode_delay, memory_budget=None):
+    """
+    Load the PSTH stored at `psth_path` and bin it with :func:`bin_rates`.
+    Without a `memory_budget`, the whole PSTH is read into memory first.
+    With a `memory_budget` (in bytes), the file is memory-mapped and binned in blocks of images so that the
+    working memory of each block stays within the budget, and only the binned rates are held in memory.
+    Blocks run along images rather than channels since the .npy files are stored images-major,
+    i.e. a block of images is a contiguous slab of the file whereas a block of channels strides all of it.
+    """
+    if memory_budget is None:
+        return bin_rates(np.load(psth_path), timebins, timebase, photodiode_delay)
+
+    psth = np.load(psth_path, mmap_mode='r')  # Shaped images x repetitions x time_bins x channels
+    assert len(timebase) == psth.shape[2]
+    starts, stops = timebin_columns(timebins, timebase=timebase, photodiode_delay=photodiode_delay)
+    num_columns = stops.max() - starts.min()
+    # per image: the accumulated columns (plus leading zeros) of a block of channels and the binned rates, in float64
+    block_size = min(NEUROIDS_PER_BLOCK, psth.shape[3])
+    bytes_per_image = psth.shape[1] * np.dtype(np.float64).itemsize * \
+        (block_size * (num_columns + 1) + psth.shape[3] * len(starts))
+    block_size = max(1, int(memory_budget // bytes_per_image))
+
+    rate = np.empty((len(starts), psth.shape[0], psth.shape[1], psth.shape[3]), dtype=np.float64)
+    for block_start in range(0, psth.shape[0], block_size):
+        block = slice(block_start, block_start + block_size)
+        rate[:, block] = bin_rates(psth[block], timebins, timebase, photodiode_delay)
+    return rate
+
+
+def solo_inputs(database_dir, experiment):
+    """ Files that the responses of `experiment` (e.g. `hvm`) are loaded from, to key their cached stages on """
+    return [database_dir / f'solo.rsvp.{experiment}.experiment_psth.npy',
+            database_dir / f'solo.rsvp.{experiment}.normalizer_psth.npy',
+            database_dir.parent / 'array-metadata' / 'mapping.json']
+
+
+class SoloRecording:
+    """
+    Loads the responses of one solo.rsvp.<experiment> recording in `database_dir` into a presentation x neuroid x
+    time_bin assembly. The PSTHs of the experiment and of the normalizer images are each read and binned once;
+    neuroids are filtered on the split-half consistency of the normalizer rates and the experiment rates
+    before any assembly is built, so that the coordinates are attached once, to the reliable neuroids only.
+    """
+
+    version = 1  # of the loaded assemblies, to be increased with changes to them outside of `SOLO_MODULES`
+    timebins = [[70, 170], [170, 270], [50, 100], [100, 150], [150, 200], [200, 250], [70, 270]]
+    normalizer_timebin = [70, 170]
+    photodiode_delay = 30  # Delay recorded on photodiode is ~30ms
+    timebase = np.arange(-100, 381, 10)  # PSTH from -100ms to 380ms relative to stimulus onset
+
+    def __init__(self, database_dir, experiment, image_size_degree, stim_on_time_ms, reliability_threshold=.7,
+                 memory_budget=None):
+        """ :param memory_budget: bytes to bin the PSTHs in, see :func:`load_rates` """
+        self.database_dir = database_dir
+        self.experiment = experiment
+        self.image_size_degree = image_size_degree
+        self.stim_on_time_ms = stim_on_time_ms
+        self.reliability_threshold = reliability_threshold
+        self.memory_budget = memory_budget
+
+    @property
+    def inputs(self):
+        return solo_inputs(self.database_dir, self.experiment)
+
+    def neuroid_meta(self):
+        with open(self.database_dir.parent / 'array-metadata' / 'mapping.json') as f:
+            return pd.DataFrame(json.load(f))
+
+    def rates(self, psth='experiment', timebins=None):
+        """ Rates of the `experiment` or `normalizer` PSTH, shaped time bins x images x repetitions x channels """
+        return load_rates(self.database_dir / f'solo.rsvp.{self.experiment}.{psth}_psth.npy',
+                          self.timebins if timebins is None else timebins, self.timebase, self.photodiode_delay,
+                          memory_budget=self.memory_budget)
+
+    def reliable_neuroids(self):
+        """ Boolean mask of the channels whose split-half consistency on the normalizer images passes the threshold """
+        rate = self.rates('normalizer', timebins=[self.normalizer_timebin])[0]  # images x repetitions x channels
+        return split_half_consistency(rate) >= self.reliability_threshold
+
+    def load(self, stimuli, image_positions=None):
+        """
+        :param stimuli: one row per image, in the order of the PSTH's images unless `image_positions` is given
+        :param image_positions: position in the PSTH of the image of every row of `stimuli`,
+            for recordings whose images are stored in a different order than the stimulus set
+        """
+        from brainio_base.assemblies import NeuronRecordingAssembly
+
+        reliable = self.reliable_neuroids()
+        rate = self.rates()
+        image_positions = np.arange(rate.shape[1]) if image_positions is None else np.asarray(image_positions)
+        assert len(stimuli) == len(image_positions), f"{len(stimuli)} stimuli for {len(image_positions)} images"
+        # a single copy of the selected images and neuroids, laid out as presentations x neuroids x time bins
+        rate = rate[np.ix_(np.arange(rate.shape[0]), image_positions, np.arange(rate.shape[2]),
+                           np.flatnonzero(reliable))]
+        num_images, num_repetitions = rate.shape[1:3]
+        rate = np.moveaxis(rate, 0, -1).reshape(num_images * num_repetitions, rate.shape[3], rate.shape[0])
+
+        assembly = xr.DataArray(rate,
+                                coords={'time_bin_id': ('time_bin', list(range(len(self.timebins)))),
+                                        'time_bin_start': ('time_bin', [x[0] for x in self.timebins]),
+                                        'time_bin_stop': ('time_bin', [x[1] for x in self.timebins])},
+                                dims=['presentation', 'neuroid', 'time_bin'])
+        assembly = assign_frame_coords(assembly, self.neuroid_meta()[reliable], 'neuroid')
+        # presentations run over the repetitions of every image, like `stack(presentation=('image', 'repetition'))`
+        presentations = pd.DataFrame(stimuli).iloc[np.repeat(np.arange(num_images), num_repetitions)]
+        presentations = presentations.assign(repetition=np.tile(np.arange(num_repetitions), num_images))
+        assembly = assign_frame_coords(assembly, presentations, 'presentation')
+        assembly = NeuronRecordingAssembly(assembly)
+
+        assembly.attrs['image_size_degree'] = self.image_size_degree
+        assembly.attrs['stim_on_time_ms'] = self.stim_on_time_ms
+        return assembly
+
+
+def add_packaging_steps(pipeline, name, collect_stimuli, load_responses, stimulus_set_identifier, assembly_identifier,
+                        package_stimuli=True, bucket_name='brainio.dicarlo'):
+    """
+    Add the steps that load and package one dataset to `pipeline`, named `<name>_stimuli`, `<name>_assembly`,
+    `<name>_package_stimuli` and `<name>_package_assembly`, so that the steps of several datasets fit in one pipeline.
+    The responses are loaded under the `solo` lock, which keeps the PSTHs of only one recording in memory at a time.
+
+    :param collect_stimuli: function without arguments that returns the stimulus set
+    :param load_responses: function that returns the assembly for the stimulus set
+    :param package_stimuli: whether to package the stimulus set too, rather than only refer to it
+    """
+    from brainio_collection.packaging import package_data_assembly, package_stimulus_set
+
+    stimuli_step, assembly_step = f'{name}_stimuli', f'{name}_assembly'
+
+    def stimuli():
+        stimuli = collect_stimuli()
+        stimuli.identifier = stimulus_set_identifier
+        return stimuli
+
+    def assembly(**results):
+        assembly = load_responses(results[stimuli_step])
+        assembly.name = assembly_identifier
+        return assembly
+
+    def package_stimuli_step(**results):
+        print(f'Packaging stimuli {stimulus_set_identifier}')
+        package_stimulus_set(results[stimuli_step], stimulus_set_identifier=stimulus_set_identifier,
+                             bucket_name=bucket_name)
+
+    def package_assembly(**results):
+        print(f'Packaging assembly {assembly_identifier}')
+        package_data_assembly(results[assembly_step], assembly_identifier=assembly_identifier,
+                              stimulus_set_identifier=stimulus_set_identifier, bucket_name=bucket_name)
+
+    # the stimulus and response branches only meet when the assembly is registered against the stimulus set
+    pipeline.add(stimuli_step, stimuli)
+    pipeline.add(assembly_step, assembly, requires=[stimuli_step], locks=['solo'])
+    after = []
+    if package_stimuli:
+        after.append(pipeline.add(f'{name}_package_stimuli', package_stimuli_step, requires=[stimuli_step], retries=2))
+    pipeline.add(f'{name}_package_assembly', package_assembly, requires=[assembly_step], after=after, retries=2)
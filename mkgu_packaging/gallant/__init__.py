@@ -6,10 +6,14 @@ import numpy as np
 import pandas as pd
 import xarray as xr
 
+from mkgu_packaging.assembly_store import write_netcdf
+
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--directory', type=str, default=os.path.join('V1Data', 'NatRev'))
+    parser.add_argument('--compact', action='store_true',
+                        help="store one response per presentation instead of a NaN-padded presentation x cell matrix")
     args = parser.parse_args()
     print("Running with args {}".format(vars(args)))
 
@@ -21,40 +25,49 @@ def main():
     data['image_file_name'] = [file.replace('\\', '/') for file in data['image_file_name']]
     data['image_id'] = [os.path.basename(os.path.splitext(file)[0])
                         for file in data['image_file_name']]
-    neuroids, neuroid_indices = unique_ordered(data['neuroid'].values, return_index=True)
     print("Found responses for {} cells, average spike count {:.4f}, {} duplicates".format(
-        len(neuroids), np.mean(data['response']), num_duplicates))
+        len(data['neuroid'].unique()), np.mean(data['response']), num_duplicates))
 
-    responses = np.full((len(data), len(neuroids)), np.nan)
-    row = 0
-    for neuroid_iter, neuroid in enumerate(neuroids):
-        neuroid_data = data[data['neuroid'] == neuroid]
-        responses[row:row + len(neuroid_data), neuroid_iter] = neuroid_data['response'].values
-        row += len(neuroid_data)
-
-    assembly = xr.DataArray(responses,
-                            coords={
-                                'image_id': data['image_id'],
-                                'image_file_name': ('image_id', data['image_file_name']),
-                                'category_name': ('image_id', data['stimulusCategory']),
-                                'stimulusRepeats': ('image_id', data['stimulusRepeats']),
-
-                                'neuroid': neuroids,
-                                'region': ('neuroid', data['area'].iloc[neuroid_indices]),
-                                'animal': ('neuroid', data['animal'].iloc[neuroid_indices])},
-                            dims=['image_id', 'neuroid'])
+    assembly = pivot_responses(data, compact=args.compact)
     print("Created {} assembly".format(" x ".join(map(str, assembly.shape))))
     savepath = os.path.abspath(os.path.join(args.directory, 'data.nc'))
-    assembly.to_netcdf(savepath)
+    write_netcdf(assembly, savepath)
     print("Saved to {}".format(savepath))
 
 
-def unique_ordered(x, return_index=False):
-    _, indices = np.unique(x, return_index=True)
-    ordered_x = x[np.sort(indices)]
-    if not return_index:
-        return ordered_x
-    return ordered_x, indices
+def pivot_responses(data, compact=False):
+    """
+    Arrange the concatenated per-cell response rows into an assembly in a single pass.
+    By default, every row keeps its position along `image_id` and its response is written into the column of its cell,
+    with all other cells NaN. With `compact`, the rows are kept as a flat `presentation` dimension
+    that carries the cell coordinates alongside the image coordinates, without any NaN padding.
+    """
+    image_coords = {
+        'image_file_name': data['image_file_name'].values,
+        'category_name': data['stimulusCategory'].values,
+        'stimulusRepeats': data['stimulusRepeats'].values,
+    }
+    if compact:
+        return xr.DataArray(data['response'].values,
+                            coords={'image_id': ('presentation', data['image_id'].values),
+                                    **{coord: ('presentation', values) for coord, values in image_coords.items()},
+                                    'neuroid': ('presentation', data['neuroid'].values),
+                                    'region': ('presentation', data['area'].values),
+                                    'animal': ('presentation', data['animal'].values)},
+                            dims=['presentation'])
+
+    neuroid_codes, neuroids = pd.factorize(data['neuroid'])  # cells in order of first appearance
+    _, first_rows = np.unique(neuroid_codes, return_index=True)
+    responses = np.full((len(data), len(neuroids)), np.nan)
+    responses[np.arange(len(data)), neuroid_codes] = data['response'].values
+    return xr.DataArray(responses,
+                        coords={
+                            'image_id': data['image_id'].values,
+                            **{coord: ('image_id', values) for coord, values in image_coords.items()},
+                            'neuroid': neuroids.values,
+                            'region': ('neuroid', data['area'].values[first_rows]),
+                            'animal': ('neuroid', data['animal'].values[first_rows])},
+                        dims=['image_id', 'neuroid'])
 
 
 if __name__ == '__main__':
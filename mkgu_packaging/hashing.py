@@ -0,0 +1,93 @@
+import hashlib
+import logging
+import os
+import sqlite3
+
+from mkgu_packaging.pipeline import process_pool
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.mkgu_packaging', 'sha1_cache.sqlite')
+LOOKUP_BATCH = 900  # paths per query, below SQLite's limit of 999 parameters in versions before 3.32
+
+
+def sha1_file(path, buffer_size=64 * 2 ** 10):
+    """ Same digest as `brainio_collection.knownfile.KnownFile(path).sha1` """
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for buffer in iter(lambda: f.read(buffer_size), b''):
+            sha1.update(buffer)
+    return sha1.hexdigest()
+
+
+class Sha1Cache:
+    """
+    Persistent map from (path, size, mtime) to SHA1, so that files that did not change since they were last hashed
+    are not read again, across runs and across packaging scripts.
+    """
+
+    def __init__(self, cache_path=DEFAULT_CACHE_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+        self._connection = sqlite3.connect(cache_path)
+        with self._connection:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS sha1 ("
+                                     "path TEXT NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, "
+                                     "sha1 TEXT NOT NULL, PRIMARY KEY (path, size, mtime_ns))")
+
+    def lookup(self, keys):
+        """ SHA1s of those (path, size, mtime_ns) `keys` that are cached, queried in batches of paths """
+        keys = set(keys)
+        paths = sorted({key[0] for key in keys})
+        found = {}
+        for start in range(0, len(paths), LOOKUP_BATCH):
+            batch = paths[start:start + LOOKUP_BATCH]
+            rows = self._connection.execute(
+                f"SELECT path, size, mtime_ns, sha1 FROM sha1 WHERE path IN ({', '.join('?' * len(batch))})", batch)
+            found.update({(path, size, mtime_ns): sha1 for path, size, mtime_ns, sha1 in rows
+                          if (path, size, mtime_ns) in keys})
+        return found
+
+    def update(self, hashes):
+        with self._connection:  # single transaction
+            self._connection.executemany("INSERT OR REPLACE INTO sha1 (path, size, mtime_ns, sha1) VALUES (?, ?, ?, ?)",
+                                         [(*key, sha1) for key, sha1 in hashes.items()])
+
+    def close(self):
+        self._connection.close()
+
+
+def file_key(path):
+    path = os.path.realpath(path)
+    stat = os.stat(path)
+    return path, stat.st_size, stat.st_mtime_ns
+
+
+def sha1_files(paths, processes=None, cache_path=DEFAULT_CACHE_PATH):
+    """
+    SHA1 hex digests of all `paths`, in order.
+    Files without a valid cache entry are hashed in a pool of `processes` worker processes (default: all cores),
+    each distinct file only once. Pass `cache_path=None` to not use the on-disk cache.
+    """
+    paths = [str(path) for path in paths]
+    keys = [file_key(path) for path in paths]
+    cache = Sha1Cache(cache_path) if cache_path is not None else None
+    try:
+        hashes = cache.lookup(set(keys)) if cache is not None else {}
+        missing = sorted(set(keys) - set(hashes))
+        _logger.debug(f"Hashing {len(missing)} of {len(set(keys))} files ({len(hashes)} cached)")
+        if len(missing) == 1 or processes == 1:
+            computed = [sha1_file(key[0]) for key in missing]
+        elif missing:
+            with process_pool(max_workers=processes) as executor:
+                chunksize = max(1, len(missing) // (4 * (processes or os.cpu_count() or 1)))
+                computed = list(executor.map(sha1_file, [key[0] for key in missing], chunksize=chunksize))
+        else:
+            computed = []
+        computed = dict(zip(missing, computed))
+        if cache is not None and computed:
+            cache.update(computed)
+        hashes.update(computed)
+    finally:
+        if cache is not None:
+            cache.close()
+    return [hashes[key] for key in keys]
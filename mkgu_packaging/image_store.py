@@ -0,0 +1,60 @@
+import hashlib
+import os
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class _HashingWriter:
+    """
+    Write-only file wrapper that computes the SHA1 of everything written through it.
+    It deliberately does not support `seek` so that `zipfile` streams every entry sequentially
+    (with data descriptors) instead of seeking back to patch local headers, which would invalidate the running hash.
+    """
+
+    def __init__(self, file):
+        self._file = file
+        self._position = 0
+        self.sha1 = hashlib.sha1()
+
+    def write(self, data):
+        self.sha1.update(data)
+        self._position += len(data)
+        return self._file.write(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        self._file.flush()
+
+
+def _read_member(path, arcname):
+    info = zipfile.ZipInfo.from_file(path, arcname=arcname)
+    info.compress_type = zipfile.ZIP_STORED
+    with open(path, 'rb') as f:
+        return info, f.read()
+
+
+def write_image_zip(paths, arcnames, target_zip_path, num_threads=8, max_pending=64):
+    """
+    Write the files at `paths` into a zip at `target_zip_path` under `arcnames`, in order, and return the zip's SHA1.
+    Members are stored uncompressed, as in the existing image stores; images are compressed already.
+    They are read by `num_threads` threads
+    with at most `max_pending` members held in memory, and the SHA1 is computed while writing,
+    so the archive does not need to be read again.
+    """
+    paths, arcnames = [str(path) for path in paths], [str(arcname) for arcname in arcnames]
+    assert len(paths) == len(arcnames)
+    os.makedirs(os.path.dirname(os.path.abspath(target_zip_path)), exist_ok=True)
+    with open(target_zip_path, 'wb') as target_file, ThreadPoolExecutor(max_workers=num_threads) as executor:
+        hashing_writer = _HashingWriter(target_file)
+        with zipfile.ZipFile(hashing_writer, 'w') as target_zip:
+            pending = deque()
+            for path, arcname in zip(paths, arcnames):
+                pending.append(executor.submit(_read_member, path, arcname))
+                if len(pending) >= max_pending:
+                    target_zip.writestr(*pending.popleft().result())
+            while pending:
+                target_zip.writestr(*pending.popleft().result())
+    return hashing_writer.sha1.hexdigest()
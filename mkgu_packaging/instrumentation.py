@@ -0,0 +1,179 @@
+import datetime
+import functools
+import json
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+
+_logger = logging.getLogger(__name__)
+
+SAMPLE_INTERVAL = .05
+
+
+def _rss_bytes():
+    """ Current resident set size of this process, or None where `/proc` is not available """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _max_rss_bytes(who=resource.RUSAGE_SELF):
+    max_rss = resource.getrusage(who).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024  # kilobytes on Linux
+
+
+def _io_bytes():
+    """
+    Bytes this process passed through read and write calls so far (including network and page cache hits),
+    or Nones where `/proc/self/io` is not available
+    """
+    try:
+        with open('/proc/self/io') as f:
+            fields = dict(line.split(': ') for line in f.read().splitlines())
+        return int(fields['rchar']), int(fields['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def _cpu_seconds():
+    """ User and system time of this process and of its terminated child processes, e.g. of process pools """
+    own, children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def _difference(end, start):
+    return end - start if end is not None and start is not None else None
+
+
+def _peak(*values):
+    """ Largest of `values` that are not None, e.g. of RSS readings that failed transiently, or None """
+    values = [value for value in values if value is not None]
+    return max(values) if values else None
+
+
+class _Stage:
+    def __init__(self, instrumentation, name):
+        self._instrumentation = instrumentation
+        self.name = name
+        self.record = None
+
+    def __enter__(self):
+        self.record = self._instrumentation._start(self.name)
+        return self.record
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._instrumentation._stop(self.record, failed=exc_type is not None)
+        return False
+
+    def __call__(self, function):
+        name = self.name or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with _Stage(self._instrumentation, name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+
+class Instrumentation:
+    """
+    Records the wall time, CPU time, peak RSS and bytes read and written of the stages of a packaging run,
+    to be written as a JSON report with `write_report`.
+    Stages nest: a stage started within another one is named `outer/inner`.
+    CPU time and I/O are counted for the whole process, so stages that run concurrently in threads
+    (e.g. the steps of a `Pipeline`) each include the others' share; the CPU time of child processes is counted
+    once they terminate, e.g. when a process pool shuts down. The peak RSS is sampled every `sample_interval` seconds
+    and covers this process only.
+    """
+
+    def __init__(self, sample_interval=SAMPLE_INTERVAL):
+        self.sample_interval = sample_interval
+        self.records = []
+        self._created = time.monotonic()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._active = []
+        self._sampler = None
+
+    def stage(self, name=None):
+        """
+        Context manager (`with instrumentation.stage('write netCDF'):`) or decorator (`@instrumentation.stage()`,
+        named after the function by default) that records a stage
+        """
+        return _Stage(self, name)
+
+    def report(self):
+        return {'created': datetime.datetime.now().isoformat(timespec='seconds'), 'argv': sys.argv, 'pid': os.getpid(),
+                'max_rss_bytes': _max_rss_bytes(), 'children_max_rss_bytes': _max_rss_bytes(resource.RUSAGE_CHILDREN),
+                'stages': sorted(self.records, key=lambda record: record['started_seconds'])}
+
+    def write_report(self, path):
+        """ Write all stages recorded so far as JSON to `path`, e.g. next to the packaged files """
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+        _logger.info(f"Wrote report of {len(self.records)} stages to {path}")
+        return path
+
+    def _start(self, name):
+        stack = self._local.__dict__.setdefault('stack', [])
+        name = '/'.join([stack[-1]['name'], name]) if stack else name
+        read_bytes, written_bytes = _io_bytes()
+        record = {'name': name, 'status': 'running', 'started_seconds': time.monotonic() - self._created,
+                  '_wall': time.monotonic(), '_cpu': _cpu_seconds(), '_read': read_bytes, '_written': written_bytes,
+                  'peak_rss_bytes': _rss_bytes()}
+        stack.append(record)
+        with self._lock:
+            self._active.append(record)
+            if self._sampler is None and record['peak_rss_bytes'] is not None:
+                self._sampler = threading.Thread(target=self._sample, name='instrumentation-sampler', daemon=True)
+                self._sampler.start()
+        return record
+
+    def _stop(self, record, failed):
+        read_bytes, written_bytes = _io_bytes()
+        rss = _rss_bytes()
+        with self._lock:
+            self._active.remove(record)
+            record['peak_rss_bytes'] = _peak(record['peak_rss_bytes'], rss)
+        self._local.stack.remove(record)
+        record.update({'status': 'failed' if failed else 'ok',
+                       'wall_seconds': time.monotonic() - record.pop('_wall'),
+                       'cpu_seconds': _cpu_seconds() - record.pop('_cpu'),
+                       'read_bytes': _difference(read_bytes, record.pop('_read')),
+                       'written_bytes': _difference(written_bytes, record.pop('_written'))})
+        if record['peak_rss_bytes'] is None:  # without /proc, fall back to the peak over the process' lifetime
+            record['peak_rss_bytes'] = _max_rss_bytes()
+        with self._lock:
+            self.records.append(record)
+        _logger.info(f"{record['name']} {record['status']}: {record['wall_seconds']:.1f}s wall, "
+                     f"{record['cpu_seconds']:.1f}s CPU, {record['peak_rss_bytes'] / 2 ** 20:.0f} MiB peak RSS")
+
+    def _sample(self):
+        while True:
+            time.sleep(self.sample_interval)
+            rss = _rss_bytes()
+            with self._lock:
+                if not self._active:
+                    self._sampler = None
+                    return
+                for record in self._active:
+                    record['peak_rss_bytes'] = _peak(record['peak_rss_bytes'], rss)
+
+
+default_instrumentation = Instrumentation()
+
+
+def stage(name=None):
+    """ `Instrumentation.stage` of the module-wide instrumentation """
+    return default_instrumentation.stage(name)
+
+
+def write_report(path):
+    """ `Instrumentation.write_report` of the module-wide instrumentation """
+    return default_instrumentation.write_report(path)
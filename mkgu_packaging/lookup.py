@@ -0,0 +1,89 @@
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# stay below SQLite's default limit of 999 variables per statement
+QUERY_BATCH_SIZE = 900
+
+
+def _batches(values, batch_size):
+    values = list(values)
+    for start in range(0, len(values), batch_size):
+        yield values[start:start + batch_size]
+
+
+def _image_pks(models, image_ids, batch_size):
+    pks = {}
+    for batch in _batches(image_ids, batch_size):
+        query = models.ImageModel.select(models.ImageModel.id, models.ImageModel.image_id) \
+            .where(models.ImageModel.image_id.in_(batch))
+        pks.update({image.image_id: image.id for image in query})
+    return pks
+
+
+def _insert_many(model, rows, batch_size):
+    if not rows:
+        return
+    rows_per_statement = max(1, batch_size // len(rows[0]))  # every field of every row is one variable
+    for batch in _batches(rows, rows_per_statement):
+        model.insert_many(batch).execute()
+
+
+def write_image_lookup(stimuli, stimulus_set_model, image_store_model, path_column, attributes,
+                       models=None, batch_size=QUERY_BATCH_SIZE):
+    """
+    Bulk equivalent of calling `get_or_create` per image for the `ImageModel`, `StimulusSetImageMap`,
+    `ImageStoreMap` and `ImageMetaModel` rows of all `stimuli`.
+    Existing rows are looked up with set-based queries, only the missing rows are inserted with batched `insert_many`
+    calls, and everything is committed in a single transaction.
+
+    :param path_column: the column of `stimuli` with the path of each image within the image store
+    :param attributes: pairs of (`AttributeModel` instance, column of `stimuli`) to store as image meta data
+    :param models: module providing the lookup models, `brainio_collection.stimuli` by default
+    """
+    if models is None:
+        import brainio_collection.stimuli
+        models = brainio_collection.stimuli
+    ImageModel, StimulusSetImageMap, ImageStoreMap, ImageMetaModel = \
+        models.ImageModel, models.StimulusSetImageMap, models.ImageStoreMap, models.ImageMetaModel
+    image_ids = [str(image_id) for image_id in stimuli['image_id']]
+    unique_image_ids = list(dict.fromkeys(image_ids))
+
+    with ImageModel._meta.database.atomic():
+        image_pks = _image_pks(models, unique_image_ids, batch_size)
+        missing_images = [image_id for image_id in unique_image_ids if image_id not in image_pks]
+        _insert_many(ImageModel, [{'image_id': image_id} for image_id in missing_images], batch_size)
+        image_pks.update(_image_pks(models, missing_images, batch_size))
+        pks = [image_pks[image_id] for image_id in image_ids]
+        unique_pks = list(dict.fromkeys(pks))
+
+        existing = set()
+        for batch in _batches(unique_pks, batch_size):
+            existing.update(row.image_id for row in StimulusSetImageMap.select(StimulusSetImageMap.image)
+                            .where((StimulusSetImageMap.stimulus_set == stimulus_set_model) &
+                                   StimulusSetImageMap.image.in_(batch)))
+        _insert_many(StimulusSetImageMap, [{'stimulus_set': stimulus_set_model.id, 'image': pk}
+                                           for pk in unique_pks if pk not in existing], batch_size)
+
+        paths = [str(path) for path in stimuli[path_column]]
+        existing = set()
+        for batch in _batches(unique_pks, batch_size):
+            existing.update((row.image_id, row.path) for row in
+                            ImageStoreMap.select(ImageStoreMap.image, ImageStoreMap.path)
+                            .where((ImageStoreMap.image_store == image_store_model) & ImageStoreMap.image.in_(batch)))
+        rows = list(dict.fromkeys(zip(pks, paths)))
+        _insert_many(ImageStoreMap, [{'image': pk, 'image_store': image_store_model.id, 'path': path}
+                                     for pk, path in rows if (pk, path) not in existing], batch_size)
+
+        for attribute, column in attributes:
+            values = [str(value) for value in stimuli[column]]
+            existing = set()
+            for batch in _batches(unique_pks, batch_size):
+                existing.update((row.image_id, row.value) for row in
+                                ImageMetaModel.select(ImageMetaModel.image, ImageMetaModel.value)
+                                .where((ImageMetaModel.attribute == attribute) & ImageMetaModel.image.in_(batch)))
+            rows = list(dict.fromkeys(zip(pks, values)))
+            _insert_many(ImageMetaModel, [{'image': pk, 'attribute': attribute.id, 'value': value}
+                                          for pk, value in rows if (pk, value) not in existing], batch_size)
+    _logger.debug(f"Wrote lookup of {len(unique_image_ids)} images ({len(missing_images)} new) "
+                  f"for stimulus set {stimulus_set_model.name}")
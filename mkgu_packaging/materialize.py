@@ -0,0 +1,89 @@
+import hashlib
+import io
+import os
+from collections import deque
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from mkgu_packaging.pipeline import process_pool
+
+EXTENSIONS = {'PNG': '.png', 'JPEG': '.jpg'}
+
+
+def encode_image(image, format='PNG', **save_kwargs):
+    """ Encode the array `image` into the bytes of an image file in `format`, without touching the filesystem """
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.fromarray(np.asarray(image).astype('uint8')).save(buffer, format=format, **save_kwargs)
+    return buffer.getvalue()
+
+
+def write_images(images, target_dir, format='PNG', names=None, **save_kwargs):
+    """
+    Encode every array in `images`, hash the encoded bytes and write them once to `target_dir`.
+    Files are named `<sha1><extension>` unless `names` are given; since such files are named by their content,
+    an existing file of that name is left as is.
+    :return: a (sha1, path) pair per image
+    """
+    extension = EXTENSIONS.get(format.upper(), '.' + format.lower())
+    written = []
+    for index, image in enumerate(images):
+        data = encode_image(image, format=format, **save_kwargs)
+        sha1 = hashlib.sha1(data).hexdigest()
+        path = os.path.join(target_dir, names[index] if names is not None else sha1 + extension)
+        if names is not None or not os.path.isfile(path):
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        written.append((sha1, path))
+    return written
+
+
+def image_chunks(images, chunk_size=64):
+    """ Read `images` (a numpy array or an array-like HDF5 node) in chunks of `chunk_size` along the first axis """
+    for start in range(0, len(images), chunk_size):
+        yield images[start:start + chunk_size]
+
+
+def materialize_chunks(chunks, format='PNG', processes=None, max_pending=None, **save_kwargs):
+    """
+    Run `write_images` on every `(key, images, target_dir, names)` of `chunks` in `processes` worker processes
+    and yield `(key, [(sha1, path), ...])` in the order of `chunks`.
+    Chunks are only read from `chunks` while fewer than `max_pending` (default: twice the processes) are in flight,
+    so that chunks from several sources can be interleaved without loading all of them into memory.
+    """
+    processes = processes or os.cpu_count()
+    max_pending = max_pending or 2 * processes
+    with process_pool(max_workers=processes) as executor:
+        pending = deque()
+        for key, images, target_dir, names in chunks:
+            os.makedirs(target_dir, exist_ok=True)
+            pending.append((key, executor.submit(write_images, images, str(target_dir), format, names, **save_kwargs)))
+            if len(pending) >= max_pending:
+                key, future = pending.popleft()
+                yield key, future.result()
+        while pending:
+            key, future = pending.popleft()
+            yield key, future.result()
+
+
+def written_frame(written):
+    """ Stimulus rows for the (sha1, path) pairs of `written`, in order """
+    return pd.DataFrame({'image_id': [sha1 for sha1, _ in written],
+                         'image_index': range(len(written)),
+                         'image_current_local_file_path': [Path(path) for _, path in written]})
+
+
+def materialize_images(images, target_dir, format='PNG', chunk_size=64, processes=None, **save_kwargs):
+    """
+    Encode the arrays in `images` to `format` files named by their SHA1 in `target_dir`, in parallel.
+    :return: a DataFrame with the `image_id` (SHA1), `image_index` and `image_current_local_file_path` of every image
+    """
+    chunks = ((None, chunk, target_dir, None) for chunk in image_chunks(images, chunk_size=chunk_size))
+    written = [image for _, chunk in materialize_chunks(chunks, format=format, processes=processes, **save_kwargs)
+               for image in chunk]
+    return written_frame(written)
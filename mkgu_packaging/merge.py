@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+
+def _dim_frame(block, dim):
+    return pd.DataFrame({coord: values.values for coord, values in block.coords.items()
+                         if values.dims == (dim,) and coord != dim})
+
+
+def _key_index(frame, keys):
+    return pd.MultiIndex.from_frame(frame[list(keys)])
+
+
+def _target_frame(frames, keys, dim):
+    for frame in frames:
+        if frame.duplicated(subset=list(keys)).any():
+            raise ValueError(f"block with duplicate {dim} keys {keys}")
+    frame = pd.concat(frames, ignore_index=True)
+    return frame.drop_duplicates(subset=list(keys)).reset_index(drop=True)
+
+
+def _merge(blocks, presentation_keys, neuroid_keys, presentation_dim, neuroid_dim, fill_value):
+    presentation_frames = [_dim_frame(block, presentation_dim) for block in blocks]
+    neuroid_frames = [_dim_frame(block, neuroid_dim) for block in blocks]
+    presentations = _target_frame(presentation_frames, presentation_keys, presentation_dim)
+    neuroids = _target_frame(neuroid_frames, neuroid_keys, neuroid_dim)
+    presentation_index, neuroid_index = \
+        _key_index(presentations, presentation_keys), _key_index(neuroids, neuroid_keys)
+
+    dtype = np.result_type(*[block.dtype for block in blocks], np.min_scalar_type(fill_value))
+    values = np.full((len(presentations), len(neuroids)), fill_value, dtype=dtype)
+    filled = np.zeros(values.shape, dtype=bool)
+    for block, presentation_frame, neuroid_frame in zip(blocks, presentation_frames, neuroid_frames):
+        rows = presentation_index.get_indexer(_key_index(presentation_frame, presentation_keys))
+        columns = neuroid_index.get_indexer(_key_index(neuroid_frame, neuroid_keys))
+        target = np.ix_(rows, columns)
+        if filled[target].any():
+            raise ValueError(f"blocks overlap in {filled[target].sum()} values")
+        values[target] = block.transpose(presentation_dim, neuroid_dim).values
+        filled[target] = True
+    return xr.DataArray(values, dims=[presentation_dim, neuroid_dim],
+                        coords={**{coord: (presentation_dim, presentations[coord].values) for coord in presentations},
+                                **{coord: (neuroid_dim, neuroids[coord].values) for coord in neuroids}})
+
+
+def merge_blocks(blocks, presentation_keys, neuroid_keys, presentation_dim='presentation', neuroid_dim='neuroid',
+                 fill_value=np.nan, ragged=False):
+    """
+    Merge recording blocks (presentation x neuroid DataArrays) that cover different presentations and/or neuroids,
+    e.g. animals with different numbers of repetitions, into a single assembly.
+    The target presentations and neuroids are the union of the blocks' `presentation_keys`/`neuroid_keys` coordinates
+    in order of first appearance. The output is allocated once and filled with `fill_value`,
+    and every block is scattered directly into its rows and columns; overlapping blocks raise a ValueError.
+
+    :param ragged: instead of padding, merge only blocks recorded from the same neuroids
+        and return one assembly per distinct set of neuroids
+    """
+    groups = {}
+    for block in blocks:
+        neuroids = tuple(_key_index(_dim_frame(block, neuroid_dim), neuroid_keys)) if ragged else None
+        groups.setdefault(neuroids, []).append(block)
+    merged = [_merge(group, presentation_keys, neuroid_keys, presentation_dim, neuroid_dim, fill_value)
+              for group in groups.values()]
+    return merged if ragged else merged[0]
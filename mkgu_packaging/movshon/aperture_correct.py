@@ -3,28 +3,26 @@ Method to correct images in the movshon stimulus set by adding a cosine aperture
 """
 
 import argparse
+import hashlib
 import logging
 import os
 import numpy as np
-import imageio
 from tqdm import tqdm
 import copy
 from pathlib import Path
 import pandas as pd
 import xarray as xr
 
-from brainio_collection import get_stimulus_set, get_assembly
-from brainio_base.stimuli import StimulusSet
-from brainio_collection.knownfile import KnownFile as kf
-from brainio_contrib.packaging import package_stimulus_set, package_data_assembly
-from brainio_collection import fetch
+from mkgu_packaging import instrumentation
+from mkgu_packaging.pipeline import process_pool
 
-logging.basicConfig(level=logging.DEBUG, filename=f"{__file__}.log", format='%(asctime)s - %(levelname)s - %(message)s')
 _logger = logging.getLogger(__name__)
 
 
 class ApplyCosineAperture:
-    def __init__(self, target_dir):
+    def __init__(self, target_dir, dtype=np.float64):
+        # float64 reproduces the images, and thereby the image ids, that were packaged before byte-for-byte.
+        # float32 halves the memory traffic but leaves a few pixels one gray level off, which changes the ids.
         self._target_dir = target_dir
 
         self.gray_c = 128
@@ -56,35 +54,63 @@ class ApplyCosineAperture:
         cos_mask = 1 / 2 * (1 + np.cos(np.sqrt((xv - cnt_px[1]) ** 2 + (yv - cnt_px[0]) ** 2) / a * np.pi))
         cos_mask[np.logical_not(inner_mask)] = 0
 
-        self.cos_mask = cos_mask
+        self.cos_mask = cos_mask.astype(dtype)
+
+    def convert_images(self, images):
+        """
+        Apply the aperture to a stack of grayscale uint8 images (images x height x width) at once,
+        in place on a single output buffer.
+        """
+        images = np.asarray(images)
+        im_masked = np.zeros((len(images), *self.size_px_out), dtype=self.cos_mask.dtype)
+        im_template = im_masked[:, self.fill_ind[0][0]:self.fill_ind[0][1], self.fill_ind[1][0]:self.fill_ind[1][1]]
+        np.subtract(images, self.gray_c, out=im_template, dtype=im_masked.dtype)
+        im_masked *= self.cos_mask
+        im_masked += self.gray_c
+        return im_masked.astype(np.uint8)
+
+    def convert_files(self, image_paths):
+        """
+        Read, convert and encode a batch of images and write each to `target_dir` under its original file name.
+        The encoded bytes are hashed before they are written.
+        :return: a (target_path, sha1) pair per image
+        """
+        import imageio
+
+        converted = self.convert_images([imageio.imread(image_path) for image_path in image_paths])
+        results = []
+        for image_path, im_masked in zip(image_paths, converted):
+            target_path = self._target_dir + os.sep + os.path.basename(image_path)
+            data = imageio.imwrite('<bytes>', im_masked, format=os.path.splitext(image_path)[1].lstrip('.'))
+            with open(target_path, 'wb') as f:
+                f.write(data)
+            results.append((target_path, hashlib.sha1(data).hexdigest()))
+        return results
 
     def convert_image(self, image_path):
-
-        im = imageio.imread(image_path)
-        im = im - self.gray_c * np.ones(self.size_px)
-        im_template = np.zeros(self.size_px_out)
-
-        im_template[self.fill_ind[0][0]:self.fill_ind[0][1], self.fill_ind[1][0]:self.fill_ind[1][1]] = im
-        im_masked = (im_template * self.cos_mask) + self.gray_c * np.ones(self.size_px_out)
-
-        target_path = self._target_dir + os.sep + os.path.basename(image_path)
-
-        imageio.imwrite(target_path, np.uint8(im_masked))
-
+        [(target_path, _)] = self.convert_files([image_path])
         return target_path
 
 
 # saves converted image in a new folder given by the target_dir
 # returns the converted StimulusSet with the new image_paths and new stimuli_id (with -aperture added in the end)
-def convert_stimuli(stimulus_set_existing, stimulus_set_name_new, image_dir_new):
+def convert_stimuli(stimulus_set_existing, stimulus_set_name_new, image_dir_new,
+                    batch_size=32, processes=None, dtype=np.float64):
+    from brainio_base.stimuli import StimulusSet
+
     Path(image_dir_new).mkdir(parents=True, exist_ok=True)
 
-    image_converter = ApplyCosineAperture(target_dir=image_dir_new)
+    image_converter = ApplyCosineAperture(target_dir=image_dir_new, dtype=dtype)
     converted_image_paths = {}
     converted_image_ids = {}
-    for image_id in tqdm(stimulus_set_existing['image_id'], total=len(stimulus_set_existing), desc='apply cosine aperture'):
-        converted_image_path = image_converter.convert_image(image_path=stimulus_set_existing.get_image(image_id))
-        converted_image_id = kf(converted_image_path).sha1
+    image_ids = stimulus_set_existing['image_id']
+    image_paths = [stimulus_set_existing.get_image(image_id) for image_id in image_ids]
+    batches = [image_paths[start:start + batch_size] for start in range(0, len(image_paths), batch_size)]
+    with process_pool(max_workers=processes) as executor:
+        converted = [converted_image for batch in tqdm(executor.map(image_converter.convert_files, batches),
+                                                       total=len(batches), desc='apply cosine aperture')
+                     for converted_image in batch]
+    for image_id, (converted_image_path, converted_image_id) in zip(image_ids, converted):
         converted_image_ids[image_id] = converted_image_id
         converted_image_paths[converted_image_id] = converted_image_path
         _logger.debug(f"{image_id} -> {converted_image_id}:  {converted_image_path}")
@@ -125,6 +151,9 @@ def convert_assembly(data_assembly_existing, data_assembly_name_new, stimulus_se
 
 # main function should be run two times, one for each stimulus set access='public' and access='target'
 def main(access):
+    from brainio_collection import get_stimulus_set, get_assembly, fetch
+    from brainio_contrib.packaging import package_stimulus_set, package_data_assembly
+
     local_data_path = fetch._local_data_path
     name_root = 'movshon.FreemanZiemba2013'
     stimulus_set_name_existing = name_root + "-" + access if access != "both" else name_root
@@ -132,22 +161,33 @@ def main(access):
     data_assembly_name_existing = name_root + "." + access if access != "both" else name_root
     data_assembly_name_new = name_root + ".aperture." + access if access != "both" else name_root + ".aperture"
     temp_dir = os.path.join(local_data_path, "temp_" + data_assembly_name_new.replace(".", "_"))
-
-    stimulus_set_existing = get_stimulus_set(stimulus_set_name_existing)
-    stimulus_set_new = convert_stimuli(stimulus_set_existing, stimulus_set_name_new, temp_dir)
-    mapping = stimulus_set_new.id_mapping
-    _logger.debug(f"Packaging stimuli: {stimulus_set_new.name}")
-    package_stimulus_set(stimulus_set_new, stimulus_set_name=stimulus_set_new.name,
-                         bucket_name="brainio-contrib")
-
-    data_assembly_existing = get_assembly(data_assembly_name_existing)
-    proto_data_assembly_new = convert_assembly(data_assembly_existing, data_assembly_name_new, stimulus_set_new, mapping)
-    _logger.debug(f"Packaging assembly: {data_assembly_name_new}")
-    package_data_assembly(proto_data_assembly_new, data_assembly_name_new, stimulus_set_name_new,
-                          bucket_name="brainio-contrib")
+    Path(temp_dir).mkdir(parents=True, exist_ok=True)  # also holds the report of the run
+
+    try:
+        with instrumentation.stage('convert stimuli'):
+            stimulus_set_existing = get_stimulus_set(stimulus_set_name_existing)
+            stimulus_set_new = convert_stimuli(stimulus_set_existing, stimulus_set_name_new, temp_dir)
+        mapping = stimulus_set_new.id_mapping
+        _logger.debug(f"Packaging stimuli: {stimulus_set_new.name}")
+        with instrumentation.stage('package stimuli'):
+            package_stimulus_set(stimulus_set_new, stimulus_set_name=stimulus_set_new.name,
+                                 bucket_name="brainio-contrib")
+
+        with instrumentation.stage('convert assembly'):
+            data_assembly_existing = get_assembly(data_assembly_name_existing)
+            proto_data_assembly_new = convert_assembly(data_assembly_existing, data_assembly_name_new,
+                                                       stimulus_set_new, mapping)
+        _logger.debug(f"Packaging assembly: {data_assembly_name_new}")
+        with instrumentation.stage('package assembly'):
+            package_data_assembly(proto_data_assembly_new, data_assembly_name_new, stimulus_set_name_new,
+                                  bucket_name="brainio-contrib")
+    finally:
+        instrumentation.write_report(os.path.join(temp_dir, 'packaging_report.json'))
 
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.DEBUG, filename=f"{__file__}.log",
+                        format='%(asctime)s - %(levelname)s - %(message)s')
     parser = argparse.ArgumentParser(description='Convert Movshon stimuli')
     parser.add_argument('--access', dest='access', type=str,
                       help='access', choices=["both", "public", "private"],
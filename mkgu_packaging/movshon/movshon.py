@@ -1,19 +1,16 @@
 import os
 import re
-import zipfile
 from glob import glob
 
-import brainscore
-import h5py
 import numpy as np
 import pandas as pd
 import xarray as xr
 
-from brainscore.knownfile import KnownFile as kf
-from brainscore.lookup import pwdb
-from brainscore.assemblies import AssemblyModel, AssemblyStoreMap, AssemblyStoreModel
-from brainscore.stimuli import ImageModel, AttributeModel, ImageMetaModel, StimulusSetModel, ImageStoreModel, \
-    StimulusSetImageMap, ImageStoreMap
+from mkgu_packaging import assembly_store
+from mkgu_packaging.hashing import sha1_files
+from mkgu_packaging.image_store import write_image_zip
+from mkgu_packaging.lookup import write_image_lookup
+from mkgu_packaging.validation import validate_stimuli
 
 # from FreemanZiemba2013_V1V2data_readme.m
 textureNumOrder = [327, 336, 393, 402, 13, 18, 23, 30, 38, 48, 52, 56, 60, 71, 99]
@@ -21,15 +18,15 @@ textureNumOrder = [327, 336, 393, 402, 13, 18, 23, 30, 38, 48, 52, 56, 60, 71, 9
 
 def load_stimuli(stimuli_directory):
     stimuli = []
-    for image_file_path in glob(f"{stimuli_directory}/*.png"):
+    image_file_paths = glob(f"{stimuli_directory}/*.png")
+    for image_file_path, sha1 in zip(image_file_paths, sha1_files(image_file_paths)):
         image_file_name = os.path.basename(image_file_path)
         fields = fields_from_image_name(image_file_name)
-        im_kf = kf(image_file_path)
         extra_fields = {
             'image_file_path': image_file_path,
             'image_file_name': image_file_name,
-            "image_file_sha1": im_kf.sha1,
-            "image_id": im_kf.sha1,
+            "image_file_sha1": sha1,
+            "image_id": sha1,
             "image_store_path": "movshon_stimuli/" + image_file_name
         }
         stimuli.append({**fields, **extra_fields})
@@ -45,68 +42,104 @@ def load_stimuli(stimuli_directory):
     return stimuli
 
 
-def load_responses(response_file, stimuli_directory):
-    # from the readme.m: data is in the form:
-    # (texFamily) x (texType) x (sample) x (rep) x (timeBin) x (cellNum)
-    # (15)        x (2)       x (15)     x (20)  x (300)     x (102+)
-    # in python, ordering is inverted:
-    # (cellNum) x (timeBin) x (rep) x (sample) x (texType) x (texFamily)
-    # (102+)    x (300)     x (20)  x (15)     x (2)       x (15)
-    responses = h5py.File(response_file, 'r')
-    v1, v2 = responses['v1'], responses['v2']
-    assert v1.shape[1:] == v2.shape[1:]  # same except cells
-    responses = np.concatenate([v1, v2])
-
-    assembly = xr.DataArray(responses,
-                            coords={
-                                'neuroid_id': ("neuroid", list(range(1, responses.shape[0] + 1))),
-                                'region': ('neuroid', ['V1'] * v1.shape[0] + ['V2'] * v2.shape[0]),
-                                'time_bin_start': ("time_bin", list(range(responses.shape[1]))),  # each bin is 1 ms
-                                'time_bin_end': ("time_bin", list(range(1, responses.shape[1] + 1))),
-                                'repetition': list(range(responses.shape[2])),
-                                'sample': list(range(1, responses.shape[3] + 1)),
-                                'texture_type': ["noise", "texture"],
-                                'texture_family': textureNumOrder
-                            },
-                            dims=['neuroid', 'time_bin', 'repetition', 'sample', 'texture_type', 'texture_family'])
-
-    assembly = assembly.stack(presentation=['texture_type', 'texture_family', 'sample', 'repetition'])
-
-    image_fields = zip(*[assembly[k].values for k in ['texture_type', 'texture_family', 'sample']])
-    image_names = [image_name_from_fields(im[0], "320x320", im[1], im[2]) for im in image_fields]
-    assembly["image_file_name"] = ("presentation", image_names)
-
-    kfs = {}
-    sha1s = []
-    for image_name in image_names:
-        if image_name in kfs:
-            im_kf = kfs[image_name]
-        else:
-            im_kf = kf(os.path.join(stimuli_directory, image_name))
-            kfs[image_name] = im_kf
-        sha1s.append(im_kf.sha1)
-    assembly["image_id"] = ("presentation", sha1s)
-
-    return brainscore.assemblies.NeuronRecordingAssembly(assembly)
-
-
-def write_netcdf(assembly, target_netcdf_file):
-    assembly.reset_index(assembly.indexes.keys(), inplace=True)
-    result = assembly.drop(["image_file_name", "texture_type", "texture_family", "sample"])
-    result.reset_index(result.indexes.keys(), inplace=True)
-    result.to_netcdf(target_netcdf_file)
+def presentation_coords(stimuli_directory, num_repetitions, num_samples):
+    """
+    Presentation-level coordinates, in the order of
+    `stack(presentation=['texture_type', 'texture_family', 'sample', 'repetition'])` of the responses
+    """
+    presentations = pd.MultiIndex.from_product(
+        [["noise", "texture"], textureNumOrder, list(range(1, num_samples + 1)), list(range(num_repetitions))],
+        names=['texture_type', 'texture_family', 'sample', 'repetition']).to_frame(index=False)
+    image_names = [image_name_from_fields(texture_type, "320x320", texture_family, sample) for
+                   texture_type, texture_family, sample in
+                   zip(presentations['texture_type'], presentations['texture_family'], presentations['sample'])]
+    presentations["image_file_name"] = image_names
+
+    unique_image_names = sorted(set(image_names))
+    sha1s = sha1_files([os.path.join(stimuli_directory, image_name) for image_name in unique_image_names])
+    sha1s = dict(zip(unique_image_names, sha1s))
+    presentations["image_id"] = [sha1s[image_name] for image_name in image_names]
+    return presentations
+
+
+def write_responses_netcdf(response_file, stimuli_directory, target_netcdf_file, cells_per_slab=4, complevel=4):
+    """
+    Write the responses stacked into presentations to netCDF, without the presentation-level coordinates
+    other than `repetition` and `image_id`, which :func:`open_responses` restores.
+    The v1 and v2 responses are read in slabs of `cells_per_slab` cells, and every slab is stacked into presentations
+    and written to the netCDF file directly, so that only about two copies of one slab are in memory at a time.
+    The responses are stored with zlib at `complevel` in chunks of one cell.
+    Returns the presentation-level coordinates and the number of non-zero responses.
+    """
+    import h5py
+    import netCDF4
+
+    with h5py.File(response_file, 'r') as responses:
+        v1, v2 = responses['v1'], responses['v2']
+        assert v1.shape[1:] == v2.shape[1:]  # same except cells
+        num_cells = v1.shape[0] + v2.shape[0]
+        num_time_bins, num_repetitions, num_samples = v1.shape[1:4]
+        presentations = presentation_coords(stimuli_directory, num_repetitions=num_repetitions,
+                                            num_samples=num_samples)
+
+        # the stimulus-level coordinates are only kept in the stimulus set
+        coords = xr.Dataset(coords={
+            'neuroid_id': ("neuroid", list(range(1, num_cells + 1))),
+            'region': ('neuroid', ['V1'] * v1.shape[0] + ['V2'] * v2.shape[0]),
+            'time_bin_start': ("time_bin", list(range(num_time_bins))),  # each bin is 1 ms
+            'time_bin_end': ("time_bin", list(range(1, num_time_bins + 1))),
+            'repetition': ('presentation', presentations['repetition'].values),
+            'image_id': ('presentation', presentations['image_id'].values),
+        })
+        coords.to_netcdf(target_netcdf_file)
+
+        nonzero = 0
+        with netCDF4.Dataset(target_netcdf_file, 'a') as target:
+            dims = ('neuroid', 'time_bin', 'presentation')
+            chunks = assembly_store.chunk_sizes(dims, dict(zip(dims, (num_cells, num_time_bins, len(presentations)))),
+                                                v1.dtype, chunks={'neuroid': 1})
+            variable = target.createVariable(assembly_store.UNNAMED_VARIABLE, v1.dtype.newbyteorder('='), dims,
+                                             zlib=complevel > 0, complevel=complevel, shuffle=True, chunksizes=chunks)
+            variable.coordinates = ' '.join(coords.coords)
+            neuroid = 0
+            for responses_region in (v1, v2):
+                for cell_start in range(0, responses_region.shape[0], cells_per_slab):
+                    slab = responses_region[cell_start:cell_start + cells_per_slab]
+                    # (cellNum) x (timeBin) x (rep) x (sample) x (texType) x (texFamily) ->
+                    # (cellNum) x (timeBin) x (texType x texFamily x sample x rep)
+                    slab = slab.transpose(0, 1, 4, 5, 3, 2).reshape(slab.shape[0], slab.shape[1], -1)
+                    variable[neuroid:neuroid + slab.shape[0]] = slab
+                    nonzero += np.count_nonzero(slab)
+                    neuroid += slab.shape[0]
+    return presentations, nonzero
+
+
+def open_responses(target_netcdf_file, presentations):
+    """
+    Load the responses written by :func:`write_responses_netcdf` into memory, with the presentation-level
+    coordinates of `presentations` and the presentation MultiIndex of the responses stacked in memory,
+    i.e. `stack(presentation=['texture_type', 'texture_family', 'sample', 'repetition'])`
+    """
+    from brainio_base.assemblies import NeuronRecordingAssembly
+
+    with xr.open_dataarray(target_netcdf_file) as assembly:
+        assembly = assembly.load()
+    assert all(assembly['image_id'].values == presentations['image_id'].values)
+    assembly = assembly.assign_coords(**{column: ('presentation', presentations[column].values) for column in
+                                         ['texture_type', 'texture_family', 'sample', 'image_file_name']})
+    assembly = assembly.set_index(presentation=['texture_type', 'texture_family', 'sample', 'repetition'])
+    return NeuronRecordingAssembly(assembly)
 
 
 def create_image_zip(stimuli, target_zip_path):
-    os.makedirs(os.path.dirname(target_zip_path), exist_ok=True)
-    with zipfile.ZipFile(target_zip_path, 'w') as target_zip:
-        for image in stimuli.itertuples():
-            target_zip.write(image.image_file_path, arcname=image.image_store_path)
-    zip_kf = kf(target_zip_path)
-    return zip_kf.sha1
+    return write_image_zip(stimuli['image_file_path'], stimuli['image_store_path'], target_zip_path)
 
 
 def add_image_lookup(stimuli, target_zip_path, zip_sha1, stimulus_set_name, image_store_unique_name, bucket_name):
+    import brainscore.stimuli
+    from brainscore.lookup import pwdb
+    from brainscore.stimuli import AttributeModel, StimulusSetModel, ImageStoreModel
+
     pwdb.connect(reuse_if_open=True)
     zip_file_name = os.path.basename(target_zip_path)
 
@@ -122,22 +155,22 @@ def add_image_lookup(stimuli, target_zip_path, zip_sha1, stimulus_set_name, imag
     eav_image_sample, created = AttributeModel.get_or_create(name="sample", type="int")
     eav_image_resolution, created = AttributeModel.get_or_create(name="resolution", type="str")
 
-    for image in stimuli.itertuples():
-        pw_image, created = ImageModel.get_or_create(image_id=image.image_id)
-        pw_stimulus_set_image_map, created = StimulusSetImageMap.get_or_create(stimulus_set=stim_set_model, image=pw_image)
-        pw_image_image_store_map, created = ImageStoreMap.get_or_create(image=pw_image, image_store=image_store,
-                                                                        path=image.image_store_path)
-        ImageMetaModel.get_or_create(image=pw_image, attribute=eav_image_file_sha1, value=str(image.image_file_sha1))
-        ImageMetaModel.get_or_create(image=pw_image, attribute=eav_image_file_name, value=str(image.image_file_name))
-        ImageMetaModel.get_or_create(image=pw_image, attribute=eav_image_texture_type, value=str(image.texture_type))
-        ImageMetaModel.get_or_create(image=pw_image, attribute=eav_image_texture_family, value=str(image.texture_family))
-        ImageMetaModel.get_or_create(image=pw_image, attribute=eav_image_sample, value=str(image.sample))
-        ImageMetaModel.get_or_create(image=pw_image, attribute=eav_image_resolution, value=str(image.resolution))
+    write_image_lookup(stimuli, stim_set_model, image_store, path_column='image_store_path',
+                       attributes=[(eav_image_file_sha1, 'image_file_sha1'),
+                                   (eav_image_file_name, 'image_file_name'),
+                                   (eav_image_texture_type, 'texture_type'),
+                                   (eav_image_texture_family, 'texture_family'),
+                                   (eav_image_sample, 'sample'),
+                                   (eav_image_resolution, 'resolution')],
+                       models=brainscore.stimuli)
 
     return stim_set_model
 
 
 def add_assembly_lookup(assembly_name, stim_set_model, bucket_name, target_netcdf_file, assembly_store_unique_name):
+    from brainscore.knownfile import KnownFile as kf
+    from brainscore.assemblies import AssemblyModel, AssemblyStoreMap, AssemblyStoreModel
+
     kf_netcdf = kf(target_netcdf_file)
     assy, created = AssemblyModel.get_or_create(name=assembly_name, assembly_class="NeuronRecordingAssembly",
                                                 stimulus_set=stim_set_model)
@@ -181,20 +214,18 @@ def main():
     target_netcdf_file = os.path.join(output_path, assembly_name + ".nc")
 
     stimuli = load_stimuli(stimuli_directory)
-    assembly = load_responses(response_file, stimuli_directory)
+    os.makedirs(output_path, exist_ok=True)
+    presentations, nonzero = write_responses_netcdf(response_file, stimuli_directory, target_netcdf_file)
 
-    nonzero = np.count_nonzero(assembly)
     assert nonzero > 0
 
-    all_ids = lambda assembly, stimuli, i: assembly.sel(image_file_name=stimuli["image_file_name"][i])["image_id"]
-    all_match = lambda assembly, stimuli, i: all(all_ids(assembly, stimuli, i) == stimuli["image_id"][i])
-    assert all([all_match(assembly, stimuli, i) for i in range(len(stimuli))])
+    validate_stimuli(presentations, stimuli, key="image_file_name", columns=["image_id"])
 
     zip_sha1 = create_image_zip(stimuli, target_zip_path)
     stim_set_model = add_image_lookup(stimuli, target_zip_path, zip_sha1, stimulus_set_name, image_store_unique_name, bucket_name)
-    write_netcdf(assembly, target_netcdf_file)
     add_assembly_lookup(assembly_name, stim_set_model, bucket_name, target_netcdf_file, assembly_store_unique_name)
 
+    assembly = open_responses(target_netcdf_file, presentations)
     return (assembly, stimuli)
 
 
@@ -0,0 +1,126 @@
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from mkgu_packaging import instrumentation
+
+_logger = logging.getLogger(__name__)
+
+
+def process_pool(max_workers=None):
+    """
+    Process pool for work within a step. Steps run on threads, and a child forked from a multi-threaded process
+    can deadlock on a lock that another thread held at the fork, so the workers are spawned instead.
+    """
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+class _Step:
+    def __init__(self, name, function, args, kwargs, requires, after, locks, retries, retry_delay):
+        self.name = name
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.requires = list(requires)
+        self.dependencies = set(requires) | set(after)
+        self.locks = set(locks)
+        self.retries = retries
+        self.retry_delay = retry_delay
+
+
+class Pipeline:
+    """
+    Runs the steps of a packaging script as a graph in `max_workers` threads: every step starts as soon as the steps
+    it depends on are done, so that independent branches, e.g. zipping and registering stimuli and loading and writing
+    responses, run concurrently. Steps that name the same lock never run at the same time,
+    e.g. for libraries that are not thread-safe such as HDF5, or for writes to the lookup database.
+    Failed steps are retried with exponential backoff, and the wall time of every step is logged and kept in `timings`;
+    every attempt is also recorded as a stage of `mkgu_packaging.instrumentation`.
+    """
+
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        self.timings = {}
+        self._steps = {}
+
+    def add(self, name, function, *args, requires=(), after=(), locks=(), retries=0, retry_delay=5, **kwargs):
+        """
+        Add a step that calls `function(*args, **kwargs)`, with the results of the steps in `requires`
+        as further keyword arguments named after those steps.
+        Dependencies have to be added first, which keeps the graph acyclic.
+
+        :param after: names of steps that have to finish first but whose results are not passed,
+            e.g. registering a stimulus set before the assembly that refers to it
+        :param locks: names of locks held while the step runs
+        :param retries: number of times a failing step is run again, after `retry_delay`, `2 * retry_delay`, ... seconds
+        :return: `name`
+        """
+        if name in self._steps:
+            raise ValueError(f"step {name} already exists")
+        unknown = [dependency for dependency in [*requires, *after] if dependency not in self._steps]
+        if unknown:
+            raise ValueError(f"step {name} depends on unknown steps {unknown}")
+        self._steps[name] = _Step(name, function, args, kwargs, requires=requires, after=after, locks=locks,
+                                  retries=retries, retry_delay=retry_delay)
+        return name
+
+    def step(self, requires=(), after=(), locks=(), retries=0, retry_delay=5):
+        """ Decorator form of `add` that names the step after the decorated function """
+
+        def decorator(function):
+            self.add(function.__name__, function, requires=requires, after=after, locks=locks,
+                     retries=retries, retry_delay=retry_delay)
+            return function
+
+        return decorator
+
+    def run(self):
+        """
+        Run all steps and return their results by step name.
+        Once a step has failed on all its attempts, no further steps are started,
+        and its exception is raised when the running ones have finished.
+        """
+        start = time.monotonic()
+        pending, running, results, held = list(self._steps.values()), {}, {}, set()
+        error = None
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while running or (pending and error is None):
+                for step in list(pending if error is None else []):
+                    if step.dependencies <= results.keys() and not step.locks & held:
+                        pending.remove(step)
+                        held |= step.locks
+                        kwargs = {dependency: results[dependency] for dependency in step.requires}
+                        running[executor.submit(self._run_step, step, kwargs)] = step
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    step = running.pop(future)
+                    held -= step.locks
+                    try:
+                        results[step.name] = future.result()
+                    except Exception as e:
+                        _logger.error(f"Step {step.name} failed, not starting {len(pending)} pending steps")
+                        error = error or e
+        if error is not None:
+            raise error
+        _logger.info(f"Ran {len(results)} steps in {time.monotonic() - start:.1f}s "
+                     f"({sum(self.timings.values()):.1f}s if run one after the other)")
+        return results
+
+    def _run_step(self, step, kwargs):
+        for attempt in range(step.retries + 1):
+            start = time.monotonic()
+            try:
+                with instrumentation.stage(step.name):
+                    result = step.function(*step.args, **step.kwargs, **kwargs)
+            except Exception:
+                if attempt == step.retries:
+                    raise
+                delay = step.retry_delay * 2 ** attempt
+                _logger.warning(f"Step {step.name} failed on attempt {attempt + 1} of {step.retries + 1}, "
+                                f"retrying in {delay}s", exc_info=True)
+                time.sleep(delay)
+            else:
+                self.timings[step.name] = time.monotonic() - start
+                _logger.info(f"Step {step.name} took {self.timings[step.name]:.1f}s")
+                return result
@@ -0,0 +1,75 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+
+def split_half_masks(num_repetitions, num_splits=10, train_size=.5, seed=1):
+    """
+    Boolean (splits x repetitions) masks of the two halves, drawn exactly like
+    `sklearn.model_selection.ShuffleSplit(n_splits=num_splits, train_size=train_size, random_state=seed)`
+    which brainscore's `InternalConsistency` uses to split the unique repetitions.
+    """
+    num_train = int(np.floor(train_size * num_repetitions))
+    num_test = num_repetitions - num_train
+    rng = np.random.RandomState(seed)
+    train, test = np.zeros((2, num_splits, num_repetitions), dtype=bool)
+    for split in range(num_splits):
+        permutation = rng.permutation(num_repetitions)
+        test[split, permutation[:num_test]] = True
+        train[split, permutation[num_test:num_test + num_train]] = True
+    return train, test
+
+
+def _half_means(responses, masks):
+    # responses: images x repetitions x neuroids, masks: splits x repetitions -> splits x images x neuroids
+    valid = ~np.isnan(responses)
+    sums = np.einsum('sr,irn->sin', masks.astype(responses.dtype), np.where(valid, responses, 0))
+    counts = np.einsum('sr,irn->sin', masks.astype(responses.dtype), valid.astype(responses.dtype))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return sums / counts
+
+
+def _consistency(responses, train, test):
+    half1, half2 = _half_means(responses, train), _half_means(responses, test)
+    half1 = half1 - half1.mean(axis=1, keepdims=True)
+    half2 = half2 - half2.mean(axis=1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        correlation = (half1 * half2).sum(axis=1) / np.sqrt((half1 ** 2).sum(axis=1) * (half2 ** 2).sum(axis=1))
+    return 2 * correlation / (1 + correlation)  # Spearman-Brown correction for two halves
+
+
+def split_half_consistency(responses, num_splits=10, train_size=.5, seed=1, num_threads=None, neuroids_per_block=64):
+    """
+    Spearman-Brown corrected split-half consistency of every neuroid in `responses` (images x repetitions x neuroids),
+    averaged over `num_splits` random splits of the repetitions.
+    Per split, the responses are averaged over the repetitions of each half and correlated (Pearson) across images,
+    like brainscore's `InternalConsistency` aggregated with `CrossValidation().aggregate(...).sel(aggregation='center')`.
+    All splits are computed at once, in blocks of neuroids that are spread over `num_threads` threads.
+    """
+    responses = np.asarray(responses, dtype=np.float64)
+    train, test = split_half_masks(responses.shape[1], num_splits=num_splits, train_size=train_size, seed=seed)
+    blocks = [slice(start, start + neuroids_per_block) for start in range(0, responses.shape[2], neuroids_per_block)]
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        consistencies = list(executor.map(lambda block: _consistency(responses[:, :, block], train, test), blocks))
+    consistency = np.concatenate(consistencies, axis=1) if consistencies else np.empty((num_splits, 0))
+    with np.errstate(invalid='ignore'):
+        return np.nanmean(consistency, axis=0)
+
+
+def assembly_to_array(assembly):
+    """ Re-arrange a presentation x neuroid assembly into images x repetitions x neuroids, NaN-filling gaps """
+    assembly = assembly.transpose('presentation', 'neuroid')
+    image_index, images = pd.factorize(assembly['image_id'].values)
+    repetitions, repetition_index = np.unique(assembly['repetition'].values, return_inverse=True)
+    responses = np.full((len(images), len(repetitions), assembly.sizes['neuroid']), np.nan)
+    responses[image_index, repetition_index] = assembly.values
+    return responses
+
+
+def filter_neuroids(assembly, threshold, **kwargs):
+    """ Keep only the neuroids whose split-half consistency over repetitions is at least `threshold` """
+    ceiling = split_half_consistency(assembly_to_array(assembly), **kwargs)
+    pass_threshold = ceiling >= threshold
+    assembly = assembly[{'neuroid': pass_threshold}]
+    return assembly
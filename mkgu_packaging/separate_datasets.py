@@ -1,23 +1,22 @@
 import numpy as np
-from brainio_base.assemblies import walk_coords, array_is_element
+import pandas as pd
 from numpy.random.mtrand import RandomState
-from sklearn.model_selection import StratifiedShuffleSplit
 from xarray import DataArray
 
-from brainio_collection.fetch import fetch_assembly, get_assembly
-from brainio_collection.transform import subset
-from brainio_contrib.packaging import package_data_assembly, package_stimulus_set
+from mkgu_packaging.subsets import subset_splits
 
 
 def adapt_stimulus_set(assembly, name_suffix):
     stimulus_set_name = f"{assembly.stimulus_set.name}-{name_suffix}"
     assembly.attrs['stimulus_set'] = assembly.stimulus_set[
-        assembly.stimulus_set['image_id'].isin(assembly['image_id'].values)]
+        assembly.stimulus_set['image_id'].isin(pd.unique(assembly['image_id'].values))]
     assembly.stimulus_set.name = stimulus_set_name
     assembly.attrs['stimulus_set_name'] = stimulus_set_name
 
 
 def load_assembly(assembly_name):
+    from brainio_collection.fetch import get_assembly
+
     assembly = get_assembly(assembly_name)
 
     if not hasattr(assembly.stimulus_set, 'name'):
@@ -37,6 +36,9 @@ def apply_keep_attrs(assembly, fnc):  # workaround to keeping attrs
 
 
 def package_Movshon_datasets(name):
+    from sklearn.model_selection import StratifiedShuffleSplit
+    from brainio_contrib.packaging import package_data_assembly, package_stimulus_set
+
     assembly = load_assembly(name)
     assembly.load()
     base_assembly = assembly
@@ -49,11 +51,8 @@ def package_Movshon_datasets(name):
     split = next(splitter.split(np.zeros(len(image_ids)), stratification_values))
     access_indices = {assembly_type: image_indices
                       for assembly_type, image_indices in zip(['public', 'private'], split)}
-    for access in ['public', 'private']:
-        indices = access_indices[access]
-        subset_image_ids = image_ids[indices]
-        assembly = base_assembly[
-            {'presentation': [image_id in subset_image_ids for image_id in base_assembly['image_id'].values]}]
+    splits = {access: image_ids[access_indices[access]] for access in ['public', 'private']}
+    for access, assembly in subset_splits(base_assembly, 'image_id', splits):
         adapt_stimulus_set(assembly, access)
         package_stimulus_set(assembly.attrs['stimulus_set'], stimulus_set_name=assembly.attrs['stimulus_set_name'])
         del assembly.attrs['stimulus_set']
@@ -72,19 +71,18 @@ def _filter_erroneous_neuroids(assembly):
                     'Tito_L_P_3_5', 'Tito_L_P_6_8', 'Tito_L_P_2_8', 'Tito_L_P_9_7', 'Tito_L_P_6_7',
                     'Tito_L_P_1_0', 'Tito_L_P_4_5', 'Tito_L_P_4_9', 'Tito_L_P_7_8', 'Tito_L_P_4_7',
                     'Tito_L_P_4_0', 'Tito_L_P_3_9', 'Tito_L_P_7_7', 'Tito_L_P_4_3', 'Tito_L_P_9_5']
-    good_neuroids = [i for i, neuroid_id in enumerate(assembly['neuroid_id'].values)
-                     if neuroid_id not in err_neuroids]
-    assembly = assembly.isel(neuroid=good_neuroids)
+    good_neuroids = ~np.isin(assembly['neuroid_id'].values, err_neuroids)
+    assembly = assembly.isel(neuroid=np.flatnonzero(good_neuroids))
     return assembly
 
 
 def package_dicarlo_datasets(name):
+    from brainio_contrib.packaging import package_data_assembly, package_stimulus_set
+
     base_assembly = load_assembly(name)
     base_assembly.load()
     base_assembly = _filter_erroneous_neuroids(base_assembly)
-    for variation_name, target_variation in {'public': [0, 3], 'private': [6]}.items():
-        assembly = base_assembly[
-            {'presentation': [variation in target_variation for variation in base_assembly['variation'].values]}]
+    for variation_name, assembly in subset_splits(base_assembly, 'variation', {'public': [0, 3], 'private': [6]}):
         assert hasattr(assembly, 'variation')
         adapt_stimulus_set(assembly, name_suffix=variation_name)
         package_stimulus_set(assembly.attrs['stimulus_set'], stimulus_set_name=assembly.attrs['stimulus_set_name'],
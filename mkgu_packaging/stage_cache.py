@@ -0,0 +1,146 @@
+import functools
+import hashlib
+import importlib
+import inspect
+import logging
+import os
+import pickle
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from mkgu_packaging.hashing import sha1_files
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.mkgu_packaging', 'stage_cache')
+DEFAULT_MAX_BYTES = 50 * 2 ** 30
+DISABLE_ENV = 'MKGU_STAGE_CACHE_DISABLE'
+
+
+def _is_file(value):
+    return isinstance(value, (str, os.PathLike)) and os.path.isfile(value)
+
+
+def value_digest(value):
+    """ SHA1 of an argument value: contents for DataFrames and numeric arrays, the pickle for everything else """
+    sha1 = hashlib.sha1(type(value).__name__.encode())
+    try:
+        if isinstance(value, (pd.DataFrame, pd.Series)):
+            sha1.update(repr(list(value.columns) if isinstance(value, pd.DataFrame) else value.name).encode())
+            sha1.update(pd.util.hash_pandas_object(value, index=True).values.tobytes())
+            return sha1.hexdigest()
+        if isinstance(value, np.ndarray) and value.dtype.kind != 'O':
+            sha1.update(f"{value.dtype.str}{value.shape}".encode())
+            sha1.update(np.ascontiguousarray(value).tobytes())
+            return sha1.hexdigest()
+    except TypeError:  # e.g. unhashable objects in a DataFrame column
+        pass
+    try:
+        sha1.update(pickle.dumps(value, protocol=4))
+    except (pickle.PicklingError, TypeError, AttributeError):
+        sha1.update(repr(value).encode())
+    return sha1.hexdigest()
+
+
+def code_digest(function, depends_on=()):
+    """
+    SHA1 of the source of `function`, of the module it is defined in, and of `depends_on`:
+    modules, module names, or functions and classes
+    """
+    sha1 = hashlib.sha1()
+    for code in [function, inspect.getmodule(function), *depends_on]:
+        if isinstance(code, str):
+            code = importlib.import_module(code)
+        try:
+            sha1.update(inspect.getsource(code).encode())
+        except (OSError, TypeError):  # e.g. defined interactively
+            if hasattr(code, '__code__'):
+                sha1.update(code.__code__.co_code)
+    return sha1.hexdigest()
+
+
+def disabled():
+    """ Whether `MKGU_STAGE_CACHE_DISABLE` is set to a value other than `0` or `false` """
+    return os.environ.get(DISABLE_ENV, '').strip().lower() not in ('', '0', 'false')
+
+
+def evict(cache_dir, max_bytes):
+    """ Remove the least recently used entries of `cache_dir` until it holds at most `max_bytes` """
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.is_file() and entry.name.endswith('.pkl'):
+            stat = entry.stat()
+            entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        os.remove(path)
+        total -= size
+        _logger.debug(f"Evicted {path} ({size / 2 ** 20:.1f} MiB)")
+
+
+def stage(version=0, inputs=None, ignore=(), depends_on=(), cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+    """
+    Decorator that caches the result of a packaging stage on disk, keyed on the contents of its inputs:
+    arguments that are paths to files are keyed on the files' SHA1, other arguments on their value,
+    and the stage itself on its source code, the source of its module and of `depends_on`, and `version`.
+    Code that the stage calls outside of these, e.g. in other libraries, is not hashed:
+    increase `version` when a change to it changes the results.
+    Results are stored as pickles in `cache_dir`, and the least recently used ones are evicted
+    once the cache exceeds `max_bytes`. Set the environment variable `MKGU_STAGE_CACHE_DISABLE=1` to bypass the cache.
+
+    :param inputs: function called with the stage's arguments that returns the paths of further files the stage reads,
+        e.g. files within a directory argument
+    :param ignore: names of arguments that do not affect the result, e.g. memory or parallelism settings
+    :param depends_on: modules (or their names), functions or classes whose code the result depends on
+    """
+
+    def decorator(function):
+        signature = inspect.signature(function)
+        identifier = f"{function.__module__}.{function.__qualname__}"
+        function_digest = None
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            nonlocal function_digest
+            if disabled():
+                return function(*args, **kwargs)
+            if function_digest is None:  # on first use, once all of `depends_on` can be imported
+                function_digest = code_digest(function, depends_on)
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = {name: value for name, value in bound.arguments.items() if name not in ignore}
+            files = [value for value in arguments.values() if _is_file(value)]
+            files += list(inputs(**bound.arguments)) if inputs is not None else []
+            file_digests = iter(sha1_files(files))
+            key = hashlib.sha1(f"{identifier}:{version}:{function_digest}".encode())
+            for name, value in arguments.items():
+                key.update(f"{name}={next(file_digests) if _is_file(value) else value_digest(value)};".encode())
+            for digest in file_digests:
+                key.update(f"input={digest};".encode())
+
+            path = os.path.join(cache_dir, f"{identifier}-{key.hexdigest()}.pkl")
+            if os.path.isfile(path):
+                _logger.debug(f"Loading {identifier} from {path}")
+                os.utime(path)  # mark as recently used
+                with open(path, 'rb') as f:
+                    return pickle.load(f)
+            result = function(*args, **kwargs)
+            os.makedirs(cache_dir, exist_ok=True)
+            with tempfile.NamedTemporaryFile(dir=cache_dir, prefix=f"{identifier}-", suffix='.tmp', delete=False) as f:
+                try:
+                    pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+                except BaseException:
+                    f.close()
+                    os.remove(f.name)
+                    raise
+            os.replace(f.name, path)
+            evict(cache_dir, max_bytes)
+            return result
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,23 @@
+import numpy as np
+import pandas as pd
+
+
+def split_masks(values, splits):
+    """
+    Boolean masks over `values`, one per entry of `splits` (split name -> the values that split keeps).
+    `values` are factorized once, so membership is only tested for the unique values of every split
+    and then broadcast back with an integer gather.
+    """
+    codes, uniques = pd.factorize(np.asarray(values))
+    uniques = pd.Index(uniques)
+    return {name: uniques.isin(np.asarray(keep))[codes] & (codes >= 0) for name, keep in splits.items()}
+
+
+def subset_splits(base_assembly, coord, splits):
+    """
+    Yield `(split name, assembly)` for every entry of `splits` (split name -> values of `coord` to keep),
+    all selected from the same `base_assembly` along `presentation` with masks from `split_masks`.
+    """
+    masks = split_masks(base_assembly[coord].values, splits)
+    for name, mask in masks.items():
+        yield name, base_assembly.isel(presentation=np.flatnonzero(mask))
@@ -1,5 +1,4 @@
 import numpy as np
-from PIL import Image
 import os
 
 
@@ -15,6 +14,8 @@ def main():
 
 
 def _show_image(img, savepath=None):
+    from PIL import Image
+
     img = Image.fromarray((img * 255).astype('uint8'))
     if savepath:
         img.save(savepath)
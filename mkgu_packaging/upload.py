@@ -0,0 +1,150 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+_logger = logging.getLogger(__name__)
+
+MIN_PART_SIZE = 5 * 2 ** 20  # S3 rejects smaller parts, except for the last one
+DEFAULT_STATE_DIR = os.path.join(os.path.expanduser('~'), '.mkgu_packaging', 'uploads')
+
+
+class _Upload:
+    """ State of one multipart upload, persisted after every completed part so that it can be resumed. """
+
+    def __init__(self, source_file_path, bucket_name, target_s3_key, part_size, state_dir):
+        self.source_file_path = os.path.abspath(source_file_path)
+        self.bucket_name, self.target_s3_key = bucket_name, target_s3_key
+        stat = os.stat(self.source_file_path)
+        self.size, self.mtime_ns = stat.st_size, stat.st_mtime_ns
+        self.part_size = part_size
+        self.num_parts = max(1, -(-self.size // part_size))
+        identifier = f"{bucket_name}/{target_s3_key}/{self.source_file_path}"
+        self.state_path = os.path.join(state_dir, hashlib.sha1(identifier.encode()).hexdigest() + '.json')
+        self.upload_id = None
+        self.parts = {}  # part number -> ETag
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+
+    def load(self):
+        if not os.path.isfile(self.state_path):
+            return False
+        with open(self.state_path) as f:
+            state = json.load(f)
+        if (state['size'], state['mtime_ns'], state['part_size']) != (self.size, self.mtime_ns, self.part_size):
+            _logger.info(f"{self.source_file_path} changed since the interrupted upload, starting over")
+            return False
+        self.upload_id = state['upload_id']
+        self.parts = {int(part_number): etag for part_number, etag in state['parts'].items()}
+        return True
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        state = {'source_file_path': self.source_file_path, 'bucket_name': self.bucket_name,
+                 'target_s3_key': self.target_s3_key, 'size': self.size, 'mtime_ns': self.mtime_ns,
+                 'part_size': self.part_size, 'upload_id': self.upload_id, 'parts': self.parts}
+        temp_path = self.state_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(temp_path, self.state_path)
+
+    def complete_part(self, part_number, etag, num_bytes):
+        with self._lock:
+            self.parts[part_number] = etag
+            self.bytes_sent += num_bytes
+            self.save()
+
+    def remove_state(self):
+        if os.path.isfile(self.state_path):
+            os.remove(self.state_path)
+
+
+class UploadManager:
+    """
+    Uploads several files to S3 concurrently. Files larger than `part_size` are sent as multipart uploads whose parts
+    are spread over `num_threads` threads, shared across all files. The completed parts of every upload are recorded
+    in `state_dir`, so that re-running an interrupted upload only sends the missing parts.
+    """
+
+    def __init__(self, client=None, part_size=64 * 2 ** 20, num_threads=8, state_dir=DEFAULT_STATE_DIR):
+        if part_size < MIN_PART_SIZE:
+            raise ValueError(f"part_size must be at least {MIN_PART_SIZE} bytes, got {part_size}")
+        if client is None:
+            import boto3
+            client = boto3.client('s3')
+        self._client = client
+        self.part_size = part_size
+        self.num_threads = num_threads
+        self.state_dir = state_dir
+
+    def upload(self, uploads):
+        """
+        :param uploads: (source_file_path, bucket_name, target_s3_key) triples
+        :return: a dict per upload with the bytes sent in this call, the seconds until it finished and the throughput
+        """
+        start = time.monotonic()
+        uploads = [_Upload(str(source_file_path), bucket_name, target_s3_key, self.part_size, self.state_dir)
+                   for source_file_path, bucket_name, target_s3_key in uploads]
+        with ThreadPoolExecutor(max_workers=self.num_threads) as executor:
+            futures = [(upload, self._submit(executor, upload)) for upload in uploads]
+            stats = []
+            for upload, part_futures in futures:
+                for part_future in part_futures:
+                    part_future.result()
+                if upload.upload_id is not None:
+                    self._client.complete_multipart_upload(
+                        Bucket=upload.bucket_name, Key=upload.target_s3_key, UploadId=upload.upload_id,
+                        MultipartUpload={'Parts': [{'ETag': etag, 'PartNumber': part_number}
+                                                   for part_number, etag in sorted(upload.parts.items())]})
+                    upload.remove_state()
+                stats.append(self._report(upload, time.monotonic() - start))
+        total_bytes, total_seconds = sum(stat['bytes'] for stat in stats), time.monotonic() - start
+        _logger.info(f"Uploaded {total_bytes / 2 ** 20:.1f} MiB in {total_seconds:.1f}s "
+                     f"({total_bytes / 2 ** 20 / max(total_seconds, 1e-9):.1f} MiB/s)")
+        return stats
+
+    def _submit(self, executor, upload):
+        if upload.size <= self.part_size:
+            return [executor.submit(self._put, upload)]
+        if not upload.load() or not self._is_alive(upload):
+            upload.parts = {}
+            upload.upload_id = self._client.create_multipart_upload(
+                Bucket=upload.bucket_name, Key=upload.target_s3_key)['UploadId']
+            upload.save()
+        else:
+            _logger.info(f"Resuming upload of {upload.source_file_path} with "
+                         f"{len(upload.parts)}/{upload.num_parts} parts done")
+        return [executor.submit(self._upload_part, upload, part_number)
+                for part_number in range(1, upload.num_parts + 1) if part_number not in upload.parts]
+
+    def _is_alive(self, upload):
+        try:
+            self._client.list_parts(Bucket=upload.bucket_name, Key=upload.target_s3_key, UploadId=upload.upload_id)
+            return True
+        except self._client.exceptions.NoSuchUpload:
+            return False
+
+    def _put(self, upload):
+        with open(upload.source_file_path, 'rb') as f:
+            self._client.put_object(Bucket=upload.bucket_name, Key=upload.target_s3_key, Body=f)
+        upload.bytes_sent += upload.size
+
+    def _upload_part(self, upload, part_number):
+        with open(upload.source_file_path, 'rb') as f:
+            f.seek((part_number - 1) * upload.part_size)
+            data = f.read(upload.part_size)
+        response = self._client.upload_part(Bucket=upload.bucket_name, Key=upload.target_s3_key,
+                                            UploadId=upload.upload_id, PartNumber=part_number, Body=data)
+        upload.complete_part(part_number, response['ETag'], len(data))
+
+    def _report(self, upload, seconds):
+        stat = {'source_file_path': upload.source_file_path,
+                'target': f"s3://{upload.bucket_name}/{upload.target_s3_key}",
+                'bytes': upload.bytes_sent, 'seconds': seconds,
+                'mib_per_second': upload.bytes_sent / 2 ** 20 / max(seconds, 1e-9)}
+        _logger.info(f"Uploaded {stat['source_file_path']} to {stat['target']}: "
+                     f"{stat['bytes'] / 2 ** 20:.1f} MiB in {seconds:.1f}s ({stat['mib_per_second']:.1f} MiB/s)")
+        return stat
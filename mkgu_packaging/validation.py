@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+
+MISMATCH_COLUMNS = ['issue', 'key', 'column', 'assembly_value', 'stimulus_value']
+
+
+class StimulusMismatchError(ValueError):
+    def __init__(self, mismatches, max_rows=20):
+        self.mismatches = mismatches
+        counts = mismatches['issue'].value_counts()
+        super(StimulusMismatchError, self).__init__(
+            f"{len(mismatches)} mismatches between assembly and stimulus set "
+            f"({', '.join(f'{count} {issue}' for issue, count in counts.items())}):\n"
+            f"{mismatches.head(max_rows).to_string(index=False)}")
+
+
+def _issues(issue, keys, column=None, assembly_values=None, stimulus_values=None):
+    missing = [None] * len(keys)
+    return pd.DataFrame({'issue': issue, 'key': keys, 'column': column,
+                         'assembly_value': missing if assembly_values is None else assembly_values,
+                         'stimulus_value': missing if stimulus_values is None else stimulus_values},
+                        columns=MISMATCH_COLUMNS)
+
+
+def _unequal(left, right):
+    with np.errstate(invalid='ignore'):
+        equal = np.asarray(left == right, dtype=bool)
+    return ~(equal | (pd.isna(left) & pd.isna(right)))
+
+
+def stimulus_mismatches(assembly, stimuli, key='image_id', columns=(), require_all_stimuli=True,
+                        allow_duplicates=False):
+    """
+    Compare the presentations of `assembly` (a DataArray or a DataFrame of presentation coordinates)
+    against the rows of `stimuli`, joined on `key`, and return every disagreement as one row of a table with columns
+    `issue`, `key`, `column`, `assembly_value` and `stimulus_value`.
+    Presentations are first reduced to their unique combinations of key and meta data,
+    so that the comparisons scale with the number of images rather than with the number of presentations.
+
+    :param columns: meta data that has to agree, either names present in both
+        or a dict from assembly coordinate to stimulus set column
+    :param require_all_stimuli: whether every stimulus has to occur in the assembly, i.e. the keys are equal as sets
+    :param allow_duplicates: whether stimuli may share a key, e.g. the same image shown as two stimuli,
+        as long as their `columns` agree
+    """
+    columns = dict(columns) if isinstance(columns, dict) else {column: column for column in columns}
+    presentations = pd.DataFrame({coord: np.asarray(assembly[coord].values) for coord in [key, *columns]})
+    presentations = presentations.drop_duplicates()
+    stimulus_rows = pd.DataFrame({column: np.asarray(stimuli[column].values)
+                                  for column in dict.fromkeys([key, *columns.values()])})
+    mismatches = []
+
+    duplicated = stimulus_rows[key].duplicated(keep='first')
+    if allow_duplicates:
+        for column in stimulus_rows.columns.drop(key):
+            values_per_key = stimulus_rows.groupby(key, sort=False)[column].nunique(dropna=False)
+            mismatches.append(_issues('inconsistent in stimuli', values_per_key.index[values_per_key > 1].to_numpy(),
+                                      column=column))
+    else:
+        mismatches.append(_issues('duplicate in stimuli', stimulus_rows[key][duplicated].unique()))
+    stimulus_rows = stimulus_rows[~duplicated]
+
+    for coord in columns:
+        values_per_key = presentations.groupby(key, sort=False)[coord].nunique(dropna=False)
+        mismatches.append(_issues('inconsistent in assembly', values_per_key.index[values_per_key > 1].to_numpy(),
+                                  column=coord))
+
+    assembly_keys = pd.Index(presentations[key].unique())
+    stimulus_keys = pd.Index(stimulus_rows[key])
+    mismatches.append(_issues('missing in stimuli', assembly_keys[~assembly_keys.isin(stimulus_keys)].to_numpy()))
+    if require_all_stimuli:
+        mismatches.append(_issues('missing in assembly', stimulus_keys[~stimulus_keys.isin(assembly_keys)].to_numpy()))
+
+    joined = presentations.merge(stimulus_rows, on=key, how='inner', suffixes=('', '__stimulus'))
+    for coord, column in columns.items():
+        stimulus_column = column if column not in presentations else column + '__stimulus'
+        if coord == key or column == key:
+            continue
+        unequal = _unequal(joined[coord].to_numpy(), joined[stimulus_column].to_numpy())
+        mismatches.append(_issues('value mismatch', joined[key].to_numpy()[unequal], column=coord,
+                                  assembly_values=joined[coord].to_numpy()[unequal],
+                                  stimulus_values=joined[stimulus_column].to_numpy()[unequal]))
+
+    mismatches = [mismatch for mismatch in mismatches if len(mismatch) > 0]
+    return pd.concat(mismatches, ignore_index=True) if mismatches else _issues(None, [])
+
+
+def validate_stimuli(assembly, stimuli, key='image_id', columns=(), require_all_stimuli=True, allow_duplicates=False):
+    """ Raise a `StimulusMismatchError` listing all `stimulus_mismatches` if there are any """
+    mismatches = stimulus_mismatches(assembly, stimuli, key=key, columns=columns,
+                                     require_all_stimuli=require_all_stimuli, allow_duplicates=allow_duplicates)
+    if len(mismatches) > 0:
+        raise StimulusMismatchError(mismatches)
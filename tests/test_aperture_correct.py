@@ -0,0 +1,60 @@
+import hashlib
+import os
+
+import imageio
+import numpy as np
+import pytest
+
+from mkgu_packaging.movshon.aperture_correct import ApplyCosineAperture, convert_stimuli
+
+
+def convert_image_previously(converter, image_path, target_path):
+    """ the aperture as applied before images were converted in batches """
+    im = imageio.imread(image_path)
+    im = im - converter.gray_c * np.ones(converter.size_px)
+    im_template = np.zeros(converter.size_px_out)
+    (rows_start, rows_stop), (columns_start, columns_stop) = converter.fill_ind
+    im_template[rows_start:rows_stop, columns_start:columns_stop] = im
+    im_masked = (im_template * converter.cos_mask) + converter.gray_c * np.ones(converter.size_px_out)
+    imageio.imwrite(target_path, np.uint8(im_masked))
+
+
+@pytest.fixture
+def image_paths(tmp_path):
+    rng = np.random.RandomState(0)
+    os.makedirs(tmp_path / 'stimuli')
+    paths = [str(tmp_path / 'stimuli' / f'tex-320x320-im{number}-smp1.png') for number in range(5)]
+    for path in paths:
+        imageio.imwrite(path, rng.randint(0, 256, (320, 320)).astype(np.uint8))
+    return paths
+
+
+def test_convert_images_matches_previous(tmp_path, image_paths):
+    os.makedirs(tmp_path / 'previous')
+    os.makedirs(tmp_path / 'converted')
+    converter = ApplyCosineAperture(target_dir=str(tmp_path / 'converted'))
+    converted = converter.convert_images([imageio.imread(path) for path in image_paths])
+    for image_path, image, (target_path, sha1) in zip(image_paths, converted, converter.convert_files(image_paths)):
+        previous_path = str(tmp_path / 'previous' / os.path.basename(image_path))
+        convert_image_previously(converter, image_path, previous_path)
+        np.testing.assert_array_equal(image, imageio.imread(previous_path))
+        with open(previous_path, 'rb') as previous, open(target_path, 'rb') as target:
+            previous_bytes = previous.read()
+            assert target.read() == previous_bytes
+        assert sha1 == hashlib.sha1(previous_bytes).hexdigest()
+
+
+def test_convert_stimuli_in_processes(tmp_path, image_paths):
+    StimulusSet = pytest.importorskip('brainio_base.stimuli').StimulusSet
+    image_ids = [f'image{number}' for number in range(len(image_paths))]
+    stimuli = StimulusSet({'image_id': image_ids, 'texture_family': range(len(image_paths))})
+    stimuli.image_paths = dict(zip(image_ids, image_paths))
+    converted = convert_stimuli(stimuli, 'movshon.test.aperture', str(tmp_path / 'converted'),
+                                batch_size=2, processes=2)
+    assert list(converted['image_id_without_aperture']) == image_ids
+    assert converted.name == 'movshon.test.aperture'
+    for image_id, converted_id in zip(image_ids, converted['image_id']):
+        converted_path = converted.image_paths[converted_id]
+        assert os.path.basename(converted_path) == os.path.basename(stimuli.image_paths[image_id])
+        with open(converted_path, 'rb') as f:
+            assert hashlib.sha1(f.read()).hexdigest() == converted_id
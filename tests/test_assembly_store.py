@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+import xarray as xr
+
+pytest.importorskip('netCDF4')
+from mkgu_packaging.assembly_store import chunk_sizes, encode_categorical, open_assembly, write_netcdf, write_zarr
+
+
+def _assembly():
+    values = np.round(np.random.RandomState(0).rand(200, 10, 2), 2)
+    assembly = xr.DataArray(values, dims=['presentation', 'neuroid', 'time_bin'],
+                            coords={'image_id': ('presentation', [f"image{i % 20}" for i in range(200)]),
+                                    'repetition': ('presentation', np.arange(200) // 20),
+                                    'neuroid_id': ('neuroid', [f"n{i}" for i in range(10)]),
+                                    'time_bin_start': ('time_bin', [70, 170]),
+                                    'time_bin_end': ('time_bin', [170, 270])})
+    return assembly.set_index(presentation=['image_id', 'repetition'])
+
+
+def test_chunk_sizes():
+    sizes = {'presentation': 1000, 'neuroid': 10, 'time_bin': 2}
+    assert chunk_sizes(list(sizes), sizes, 'float64', chunk_bytes=8 * 100) == (5, 10, 2)
+    assert chunk_sizes(list(sizes), sizes, 'float64', chunks={'neuroid': 1}, chunk_bytes=8 * 100) == (50, 1, 2)
+
+
+def test_write_netcdf(tmp_path):
+    assembly = _assembly()
+    write_netcdf(assembly, tmp_path / 'assembly.nc', dtype='float32', encodings={'repetition': {'dtype': 'int8'}},
+                 chunk_bytes=400, slab_bytes=1000)
+    written = xr.open_dataarray(tmp_path / 'assembly.nc')
+    expected = assembly.reset_index('presentation')
+    np.testing.assert_allclose(written.values, expected.values.astype(np.float32))
+    for coord in expected.coords:
+        np.testing.assert_array_equal(written[coord].values, expected[coord].values)
+    assert written.dtype == np.float32
+    assert written.encoding['zlib']
+    assert written.encoding['chunksizes'] == (5, 10, 2)
+
+
+def test_write_zarr(tmp_path):
+    pytest.importorskip('zarr')
+    assembly = _assembly()
+    write_zarr(assembly, tmp_path / 'assembly.zarr', chunk_bytes=800, slab_bytes=1600)
+    written = xr.open_dataarray(tmp_path / 'assembly.zarr', engine='zarr')
+    expected = assembly.reset_index('presentation')
+    np.testing.assert_array_equal(written.values, expected.values)
+    np.testing.assert_array_equal(written['image_id'].values, expected['image_id'].values)
+
+
+def test_categorical_roundtrip(tmp_path):
+    choices = np.array(['dog', 'car', 'dog', 'bear'], dtype=object)
+    assembly = xr.DataArray(choices, dims=['presentation'],
+                            coords={'image_id': ('presentation', ['a', 'b', 'a', 'c']),
+                                    'sample_obj': ('presentation', ['dog', 'dog', 'dog', 'dog']),
+                                    'rt': ('presentation', [.1, .2, .3, .4])})
+    encoded = encode_categorical(assembly)
+    assert encoded.dtype == np.int8 and encoded['image_id'].dtype == np.int8
+    assert encoded.attrs['categories'] == ['dog', 'car', 'bear']
+    assert encoded['rt'].dtype == np.float64
+    write_netcdf(assembly, tmp_path / 'assembly.nc', categorical=True)
+    written = open_assembly(tmp_path / 'assembly.nc')
+    assert list(written.values) == list(choices)
+    for coord in assembly.coords:
+        assert list(written[coord].values) == list(assembly[coord].values)
+    assert 'categories' not in written.attrs
@@ -0,0 +1,30 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from mkgu_packaging.coords import assign_frame_coords, lookup_values
+
+
+def test_assign_frame_coords():
+    assembly = xr.DataArray(np.zeros((3, 2)), dims=['image', 'neuroid'])
+    stimuli = pd.DataFrame({'image_id': ['a', 'b', 'c'], 'size': [1, 2, 3], 'degrees': [8., 8., 4.]})
+    assembly = assign_frame_coords(assembly, stimuli, 'image')
+    for column in stimuli.columns:
+        assert assembly[column].dims == ('image',)
+        np.testing.assert_array_equal(assembly[column].values, stimuli[column].values)
+    assert assembly['size'].dtype == np.int64
+    assert assembly['degrees'].dtype == np.float64
+
+
+def test_lookup_values():
+    stimuli = pd.DataFrame({'image_id': ['c', 'a', 'b'], 'image_number': [2, 0, 1]})
+    np.testing.assert_array_equal(lookup_values(stimuli, 'image_number', range(3)), ['a', 'b', 'c'])
+    np.testing.assert_array_equal(lookup_values(stimuli, 'image_number', [1, 1]), ['b', 'b'])
+
+
+def test_lookup_values_invalid():
+    with pytest.raises(ValueError, match='not found'):
+        lookup_values(pd.DataFrame({'image_id': ['a'], 'image_number': [0]}), 'image_number', range(2))
+    with pytest.raises(ValueError, match='duplicate'):
+        lookup_values(pd.DataFrame({'image_id': ['a', 'b'], 'image_number': [0, 0]}), 'image_number', range(1))
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+
+from mkgu_packaging.gallant import pivot_responses
+
+
+def _data():
+    return pd.DataFrame({
+        'neuroid': ['b', 'b', 'a', 'a', 'a', 'c'],
+        'response': [1., 2., 3., 4., 5., 6.],
+        'image_id': ['i1', 'i2', 'i1', 'i2', 'i3', 'i1'],
+        'image_file_name': ['i1.jpg', 'i2.jpg', 'i1.jpg', 'i2.jpg', 'i3.jpg', 'i1.jpg'],
+        'stimulusCategory': ['x'] * 6,
+        'stimulusRepeats': [1] * 6,
+        'area': ['V1', 'V1', 'V2', 'V2', 'V2', 'V1'],
+        'animal': ['m1', 'm1', 'm2', 'm2', 'm2', 'm3'],
+    })
+
+
+def test_pivot_dense():
+    assembly = pivot_responses(_data())
+    assert assembly.dims == ('image_id', 'neuroid')
+    np.testing.assert_array_equal(assembly['neuroid'].values, ['b', 'a', 'c'])
+    np.testing.assert_array_equal(assembly['region'].values, ['V1', 'V2', 'V1'])
+    np.testing.assert_array_equal(assembly['animal'].values, ['m1', 'm2', 'm3'])
+    expected = np.full((6, 3), np.nan)
+    expected[[0, 1], 0] = [1, 2]
+    expected[[2, 3, 4], 1] = [3, 4, 5]
+    expected[5, 2] = 6
+    np.testing.assert_array_equal(assembly.values, expected)
+
+
+def test_pivot_compact():
+    data = _data()
+    assembly = pivot_responses(data, compact=True)
+    assert assembly.dims == ('presentation',)
+    assert not np.isnan(assembly.values).any()
+    np.testing.assert_array_equal(assembly.values, data['response'].values)
+    np.testing.assert_array_equal(assembly['neuroid'].values, data['neuroid'].values)
+    np.testing.assert_array_equal(assembly['region'].values, data['area'].values)
@@ -0,0 +1,50 @@
+import hashlib
+import os
+
+from mkgu_packaging import hashing
+from mkgu_packaging.hashing import sha1_files
+
+
+def _write_files(directory, num_files):
+    paths = []
+    for i in range(num_files):
+        path = directory / f'image_{i}.png'
+        path.write_bytes(os.urandom(1000 + i))
+        paths.append(path)
+    return paths
+
+
+class TestSha1Files:
+    def test_digests(self, tmp_path):
+        paths = _write_files(tmp_path, 5)
+        sha1s = sha1_files(paths + paths[:2], processes=2, cache_path=None)
+        assert sha1s == [hashlib.sha1(path.read_bytes()).hexdigest() for path in paths + paths[:2]]
+
+    def test_cache(self, tmp_path, monkeypatch):
+        cache_path = tmp_path / 'cache' / 'sha1.sqlite'
+        paths = _write_files(tmp_path, 3)
+        sha1s = sha1_files(paths, processes=1, cache_path=cache_path)
+
+        def fail(path):
+            raise AssertionError(f"{path} should be cached")
+
+        monkeypatch.setattr(hashing, 'sha1_file', fail)
+        assert sha1_files(paths, processes=1, cache_path=cache_path) == sha1s
+
+        # changed files are hashed again
+        monkeypatch.undo()
+        paths[0].write_bytes(b'changed')
+        assert sha1_files(paths, processes=1, cache_path=cache_path) == \
+            [hashlib.sha1(b'changed').hexdigest()] + sha1s[1:]
+
+
+def test_cache_lookup_in_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(hashing, 'LOOKUP_BATCH', 2)
+    cache = hashing.Sha1Cache(tmp_path / 'sha1.sqlite')
+    try:
+        hashes = {(f'/images/image_{i}.png', 1000 + i, i): f'{i:040x}' for i in range(5)}
+        cache.update(hashes)
+        stale = ('/images/image_0.png', 1000, 99)  # modified since it was hashed
+        assert cache.lookup([*hashes, stale, ('/images/new.png', 1, 1)]) == hashes
+    finally:
+        cache.close()
@@ -0,0 +1,25 @@
+import hashlib
+import os
+import zipfile
+
+from mkgu_packaging.image_store import write_image_zip
+
+
+def test_write_image_zip(tmp_path):
+    paths, arcnames = [], []
+    for i, extension in enumerate(['.png', '.jpg', '.txt'] * 10):
+        path = tmp_path / 'images' / f'image_{i}{extension}'
+        path.parent.mkdir(exist_ok=True)
+        path.write_bytes(os.urandom(100) + b'a' * 1000)
+        paths.append(path)
+        arcnames.append(f'store/{path.name}')
+    target_zip_path = tmp_path / 'out' / 'image_test.zip'
+    sha1 = write_image_zip(paths, arcnames, target_zip_path, num_threads=4, max_pending=3)
+
+    assert sha1 == hashlib.sha1(target_zip_path.read_bytes()).hexdigest()
+    with zipfile.ZipFile(target_zip_path) as target_zip:
+        assert target_zip.testzip() is None
+        assert target_zip.namelist() == arcnames
+        for path, arcname in zip(paths, arcnames):
+            assert target_zip.read(arcname) == path.read_bytes()
+            assert target_zip.getinfo(arcname).compress_type == zipfile.ZIP_STORED
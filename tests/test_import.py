@@ -1,3 +1,41 @@
+import json
+import subprocess
+import sys
+
+import pytest
+
+HEAVY_MODULES = ['brainscore', 'brainio_base', 'brainio_collection', 'brainio_contrib', 'h5py', 'tables', 'boto3',
+                 'imageio', 'PIL', 'netCDF4', 'sklearn']
+_PROBE = """
+import json, sys
+try:
+    import {module}
+except ModuleNotFoundError as e:
+    print(json.dumps({{'missing': e.name}}))
+else:
+    print(json.dumps({{'heavy': [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+
 def test_import_brainio_collection():
     # noinspection PyUnresolvedReferences
-    from brainio_collection.packaging import package_stimulus_set, package_data_assembly
\ No newline at end of file
+    from brainio_collection.packaging import package_stimulus_set, package_data_assembly
+
+
+@pytest.mark.parametrize('module', [
+    'mkgu_packaging.assembly_store', 'mkgu_packaging.upload', 'mkgu_packaging.materialize', 'mkgu_packaging.lookup',
+    'mkgu_packaging.tolias', 'mkgu_packaging.dicarlo.sanghavi.sanghavimurty2020',
+    'mkgu_packaging.dicarlo.sanghavi.sanghavi2020', 'mkgu_packaging.dicarlo.kar2018.kar_hvm',
+    'mkgu_packaging.dicarlo.kar2018.kar_coco', 'mkgu_packaging.dicarlo.rajalingham2018objectome',
+    'mkgu_packaging.movshon.movshon', 'mkgu_packaging.movshon.aperture_correct',
+    'mkgu_packaging.dicarlo.sanghavi.solo', 'mkgu_packaging.dicarlo.kar2019ost',
+])
+def test_no_heavy_dependencies_at_import(module):
+    # in a new interpreter, since this one has likely imported them already
+    process = subprocess.run([sys.executable, '-c', _PROBE.format(module=module, heavy=HEAVY_MODULES)],
+                             capture_output=True, text=True, check=True)
+    result = json.loads(process.stdout.splitlines()[-1])
+    if 'missing' in result:
+        assert result['missing'].split('.')[0] not in HEAVY_MODULES, f"{module} imports {result['missing']}"
+        pytest.skip(f"{result['missing']} is not installed")
+    assert result['heavy'] == []
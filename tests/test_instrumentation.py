@@ -0,0 +1,49 @@
+import json
+
+import numpy as np
+import pytest
+
+from mkgu_packaging.instrumentation import Instrumentation
+
+
+def test_nested_stages_and_report(tmp_path):
+    instrumentation = Instrumentation(sample_interval=.01)
+    with instrumentation.stage('package'):
+        with instrumentation.stage('write'):
+            (tmp_path / 'data.bin').write_bytes(b'0' * 2 ** 20)
+        with instrumentation.stage('allocate'):
+            values = np.ones(50 * 2 ** 20 // 8)
+            values.sum()
+        del values  # only once the stage has read the RSS on exit, which does not depend on the sampler's timing
+    report = json.loads(instrumentation.write_report(tmp_path / 'report.json').read_text())
+    stages = {stage['name']: stage for stage in report['stages']}
+    assert list(stages) == ['package', 'package/write', 'package/allocate']
+    assert all(stage['status'] == 'ok' for stage in stages.values())
+    assert stages['package']['wall_seconds'] >= stages['package/write']['wall_seconds']
+    if stages['package/write']['written_bytes'] is not None:  # only where /proc/self/io is available
+        assert stages['package/write']['written_bytes'] >= 2 ** 20
+    assert stages['package/allocate']['peak_rss_bytes'] - stages['package/write']['peak_rss_bytes'] >= 40 * 2 ** 20
+
+
+def test_decorator_records_failure():
+    instrumentation = Instrumentation()
+
+    @instrumentation.stage()
+    def load():
+        raise IOError("missing file")
+
+    with pytest.raises(IOError):
+        load()
+    [record] = instrumentation.records
+    assert record['name'].endswith('load')
+    assert record['status'] == 'failed'
+
+
+def test_rss_unreadable_at_start(monkeypatch):
+    readings = iter([None, 2 ** 20])
+    monkeypatch.setattr('mkgu_packaging.instrumentation._rss_bytes', lambda: next(readings, 2 ** 20))
+    instrumentation = Instrumentation(sample_interval=60)
+    with instrumentation.stage('load'):
+        pass
+    [record] = instrumentation.records
+    assert record['peak_rss_bytes'] == 2 ** 20
@@ -0,0 +1,78 @@
+from types import SimpleNamespace
+
+import pandas as pd
+import peewee
+import pytest
+
+from mkgu_packaging.lookup import write_image_lookup
+
+
+@pytest.fixture
+def models():
+    sqlite_database = peewee.SqliteDatabase(':memory:')
+
+    class BaseModel(peewee.Model):
+        class Meta:
+            database = sqlite_database
+
+    class ImageModel(BaseModel):
+        image_id = peewee.CharField()
+
+    class AttributeModel(BaseModel):
+        name = peewee.CharField(unique=True)
+        type = peewee.CharField()
+
+    class ImageMetaModel(BaseModel):
+        image = peewee.ForeignKeyField(ImageModel, backref="image_meta_models")
+        attribute = peewee.ForeignKeyField(AttributeModel, backref="image_meta_models")
+        value = peewee.CharField()
+
+    class StimulusSetModel(BaseModel):
+        name = peewee.CharField()
+
+    class ImageStoreModel(BaseModel):
+        location_type = peewee.CharField()
+        store_type = peewee.CharField()
+        location = peewee.CharField()
+        unique_name = peewee.CharField(unique=True, null=True, index=True)
+        sha1 = peewee.CharField(unique=True, null=True, index=True)
+
+    class StimulusSetImageMap(BaseModel):
+        stimulus_set = peewee.ForeignKeyField(StimulusSetModel, backref="stimulus_set_image_maps")
+        image = peewee.ForeignKeyField(ImageModel, backref="stimulus_set_image_maps")
+
+    class ImageStoreMap(BaseModel):
+        image_store = peewee.ForeignKeyField(ImageStoreModel, backref="image_image_store_maps")
+        image = peewee.ForeignKeyField(ImageModel, backref="image_image_store_maps")
+        path = peewee.CharField()
+
+    models = SimpleNamespace(ImageModel=ImageModel, AttributeModel=AttributeModel, ImageMetaModel=ImageMetaModel,
+                             StimulusSetModel=StimulusSetModel, ImageStoreModel=ImageStoreModel,
+                             StimulusSetImageMap=StimulusSetImageMap, ImageStoreMap=ImageStoreMap)
+    sqlite_database.connect()
+    sqlite_database.create_tables(list(vars(models).values()))
+    yield models
+    sqlite_database.close()
+
+
+def test_write_image_lookup(models):
+    stimuli = pd.DataFrame({'image_id': [f'sha{i}' for i in range(1000)],
+                            'image_path_within_store': [f'{i}.png' for i in range(1000)],
+                            'image_label': ['dog', 'cat'] * 500})
+    stimulus_set = models.StimulusSetModel.create(name='test.stimuli')
+    image_store = models.ImageStoreModel.create(location_type="S3", store_type="zip", location="test.zip",
+                                                unique_name="image_test", sha1="abc")
+    label = models.AttributeModel.create(name="image_label", type="str")
+    models.ImageModel.create(image_id='sha0')  # already registered image
+
+    for _ in range(2):  # writing twice must not duplicate rows
+        write_image_lookup(stimuli, stimulus_set, image_store, path_column='image_path_within_store',
+                           attributes=[(label, 'image_label')], models=models)
+        assert models.ImageModel.select().count() == 1000
+        assert models.StimulusSetImageMap.select().count() == 1000
+        assert models.ImageStoreMap.select().count() == 1000
+        assert models.ImageMetaModel.select().count() == 1000
+
+    image = models.ImageModel.get(image_id='sha3')
+    assert models.ImageStoreMap.get(image=image).path == '3.png'
+    assert models.ImageMetaModel.get(image=image, attribute=label).value == 'cat'
@@ -0,0 +1,28 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+from mkgu_packaging.hashing import sha1_file
+from mkgu_packaging.materialize import materialize_images, write_images
+
+
+def test_materialize_images(tmp_path):
+    images = np.random.RandomState(0).randint(0, 256, size=(5, 8, 8, 3))
+    images[3] = images[1]
+    meta = materialize_images(images, tmp_path / 'images', chunk_size=2, processes=2)
+    np.testing.assert_array_equal(meta['image_index'], range(5))
+    assert meta['image_id'][3] == meta['image_id'][1]
+    assert len(os.listdir(tmp_path / 'images')) == 4
+    for index, row in meta.iterrows():
+        reference_path = tmp_path / f'reference{index}.png'
+        Image.fromarray(images[index].astype('uint8')).save(reference_path)
+        assert row['image_id'] == sha1_file(reference_path) == sha1_file(row['image_current_local_file_path'])
+        assert os.path.basename(row['image_current_local_file_path']) == row['image_id'] + '.png'
+
+
+def test_write_images_named(tmp_path):
+    images = np.random.RandomState(0).randint(0, 256, size=(2, 8, 8, 3))
+    written = write_images(images, str(tmp_path), format='JPEG', names=['a.jpg', 'b.jpg'])
+    assert [os.path.basename(path) for _, path in written] == ['a.jpg', 'b.jpg']
+    assert [sha1 for sha1, _ in written] == [sha1_file(path) for _, path in written]
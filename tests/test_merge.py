@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+import xarray as xr
+
+from mkgu_packaging.merge import merge_blocks
+
+
+def _block(animal, num_repetitions, num_neuroids, value):
+    return xr.DataArray(np.full((2 * num_repetitions, num_neuroids), value), dims=['presentation', 'neuroid'],
+                        coords={'image_id': ('presentation', ['a', 'b'] * num_repetitions),
+                                'repetition': ('presentation', np.repeat(range(num_repetitions), 2)),
+                                'neuroid_id': ('neuroid', [f"{animal}_{i}" for i in range(num_neuroids)])})
+
+
+def test_merge_padded():
+    merged = merge_blocks([_block('A', 1, 2, 1.), _block('B', 2, 1, 2.)],
+                          presentation_keys=['image_id', 'repetition'], neuroid_keys=['neuroid_id'])
+    assert merged.dims == ('presentation', 'neuroid')
+    np.testing.assert_array_equal(merged['neuroid_id'].values, ['A_0', 'A_1', 'B_0'])
+    np.testing.assert_array_equal(merged['repetition'].values, [0, 0, 1, 1])
+    np.testing.assert_array_equal(merged.values, [[1, 1, 2], [1, 1, 2], [np.nan, np.nan, 2], [np.nan, np.nan, 2]])
+
+
+def test_merge_ragged():
+    merged = merge_blocks([_block('A', 1, 2, 1.), _block('B', 2, 1, 2.)],
+                          presentation_keys=['image_id', 'repetition'], neuroid_keys=['neuroid_id'], ragged=True)
+    assert [block.shape for block in merged] == [(2, 2), (4, 1)]
+    assert not any(np.isnan(block.values).any() for block in merged)
+
+
+def test_merge_overlap():
+    with pytest.raises(ValueError, match='overlap'):
+        merge_blocks([_block('A', 1, 1, 1.), _block('A', 1, 1, 2.)],
+                     presentation_keys=['image_id', 'repetition'], neuroid_keys=['neuroid_id'])
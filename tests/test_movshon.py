@@ -0,0 +1,75 @@
+import h5py
+import numpy as np
+import pytest
+import xarray as xr
+
+from mkgu_packaging.movshon.movshon import textureNumOrder, image_name_from_fields, presentation_coords, \
+    write_responses_netcdf, open_responses
+
+
+@pytest.fixture
+def recording(tmp_path):
+    # (cellNum) x (timeBin) x (rep) x (sample) x (texType) x (texFamily), with few time bins, repetitions and samples
+    rng = np.random.RandomState(0)
+    response_file = tmp_path / 'responses.mat'
+    with h5py.File(response_file, 'w') as f:
+        for region, cells in [('v1', 3), ('v2', 6)]:
+            f.create_dataset(region, data=(rng.rand(cells, 5, 2, 3, 2, 15) < .3).astype(np.float32))
+    stimuli_directory = tmp_path / 'stim'
+    stimuli_directory.mkdir()
+    for texture_type in ['noise', 'texture']:
+        for family in textureNumOrder:
+            for sample in range(1, 4):
+                file_name = image_name_from_fields(texture_type, '320x320', family, sample)
+                (stimuli_directory / file_name).write_bytes(file_name.encode())
+    return response_file, stimuli_directory
+
+
+def stacked_in_memory(response_file, stimuli_directory):
+    """ the responses as previously loaded into memory at once, before they were streamed to netCDF """
+    with h5py.File(response_file, 'r') as f:
+        v1, v2 = f['v1'][()], f['v2'][()]
+    responses = np.concatenate([v1, v2])
+    assembly = xr.DataArray(responses,
+                            coords={
+                                'neuroid_id': ("neuroid", list(range(1, responses.shape[0] + 1))),
+                                'region': ('neuroid', ['V1'] * v1.shape[0] + ['V2'] * v2.shape[0]),
+                                'time_bin_start': ("time_bin", list(range(responses.shape[1]))),
+                                'time_bin_end': ("time_bin", list(range(1, responses.shape[1] + 1))),
+                                'repetition': list(range(responses.shape[2])),
+                                'sample': list(range(1, responses.shape[3] + 1)),
+                                'texture_type': ["noise", "texture"],
+                                'texture_family': textureNumOrder
+                            },
+                            dims=['neuroid', 'time_bin', 'repetition', 'sample', 'texture_type', 'texture_family'])
+    assembly = assembly.stack(presentation=['texture_type', 'texture_family', 'sample', 'repetition'])
+    presentations = presentation_coords(stimuli_directory, num_repetitions=responses.shape[2],
+                                        num_samples=responses.shape[3])
+    assembly["image_file_name"] = ("presentation", presentations['image_file_name'].values)
+    assembly["image_id"] = ("presentation", presentations['image_id'].values)
+    return assembly
+
+
+@pytest.mark.parametrize('cells_per_slab', [1, 4])
+def test_streamed_matches_in_memory(recording, tmp_path, cells_per_slab):
+    response_file, stimuli_directory = recording
+    target_netcdf_file = tmp_path / 'responses.nc'
+    presentations, nonzero = write_responses_netcdf(response_file, stimuli_directory, target_netcdf_file,
+                                                    cells_per_slab=cells_per_slab)
+    expected = stacked_in_memory(response_file, stimuli_directory)
+    assert nonzero == np.count_nonzero(expected.values)
+
+    assembly = open_responses(target_netcdf_file, presentations)
+    assert assembly.indexes['presentation'].equals(expected.indexes['presentation'])
+    assert list(assembly.indexes['presentation'].names) == ['texture_type', 'texture_family', 'sample', 'repetition']
+    xr.testing.assert_identical(xr.DataArray(assembly), expected)
+
+
+def test_open_responses_closes_file(recording, tmp_path):
+    response_file, stimuli_directory = recording
+    target_netcdf_file = tmp_path / 'responses.nc'
+    presentations, _ = write_responses_netcdf(response_file, stimuli_directory, target_netcdf_file)
+    assembly = open_responses(target_netcdf_file, presentations)
+    # writing to a file that is still open in xarray fails
+    write_responses_netcdf(response_file, stimuli_directory, target_netcdf_file)
+    assert assembly.sum() > 0  # and the returned assembly is not backed by the file
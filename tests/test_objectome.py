@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from mkgu_packaging.dicarlo.rajalingham2018objectome import to_xarray, write_netcdf
+
+
+def test_to_xarray_shares_strings():
+    pytest.importorskip('brainio_base')
+    rows = [('im0', 'bear', 'zebra', .5), ('im1', 'zebra', 'zebra', .7), ('im0', 'bear', 'bear', .6)]
+    # distinct objects per row, as after unpickling
+    objectome = pd.DataFrame({'id': [''.join(row[0]) for row in rows], 'sample_obj': [''.join(row[1]) for row in rows],
+                              'choice': [''.join(row[2]) for row in rows], 'rt': [row[3] for row in rows]})
+    assembly = to_xarray(objectome)
+    assert list(assembly.values) == ['zebra', 'zebra', 'bear']
+    assert len({id(value) for value in assembly.values}) == 2
+    for coord, column in [('image_id', 'id'), ('sample_obj', 'sample_obj'), ('rt', 'rt')]:
+        assert list(assembly[coord].values) == list(objectome[column])
+
+
+def test_published_netcdf_keeps_strings(tmp_path):
+    trials = pd.MultiIndex.from_arrays([['im0', 'im1', 'im0'], ['bear', 'zebra', 'bear'], ['bear', 'bear', 'zebra']],
+                                       names=['image_id', 'sample_obj', 'choice'])
+    assembly = xr.DataArray(np.array([[1, 0, 0]]), dims=['choice_dim', 'presentation'],
+                            coords={'presentation': trials, 'choice_dim': [0]})
+    write_netcdf(assembly, tmp_path / 'objectome.nc')
+    with xr.open_dataarray(tmp_path / 'objectome.nc') as written:
+        for coord in ['image_id', 'sample_obj', 'choice']:
+            assert list(written[coord].values) == list(trials.get_level_values(coord))
+            assert 'categories' not in written[coord].attrs
@@ -0,0 +1,86 @@
+import hashlib
+import threading
+import time
+
+import pytest
+
+from mkgu_packaging.hashing import sha1_files
+from mkgu_packaging.pipeline import Pipeline
+
+
+def test_results_passed_to_dependents():
+    pipeline = Pipeline()
+    pipeline.add('a', lambda: 1)
+    pipeline.add('b', lambda value: value * 2, 5)
+    pipeline.add('c', lambda a, b: a + b, requires=['a', 'b'])
+    assert pipeline.run() == {'a': 1, 'b': 10, 'c': 11}
+    assert set(pipeline.timings) == {'a', 'b', 'c'}
+
+
+def test_independent_branches_run_concurrently():
+    barrier = threading.Barrier(2, timeout=5)  # deadlocks unless both branches run at the same time
+    pipeline = Pipeline(max_workers=2)
+    pipeline.add('stimuli', barrier.wait)
+    pipeline.add('assembly', barrier.wait)
+    pipeline.add('register', lambda: 'done', after=['stimuli', 'assembly'])
+    assert pipeline.run()['register'] == 'done'
+
+
+def test_locks_exclude():
+    active, overlaps = [], []
+
+    def step():
+        active.append(1)
+        overlaps.append(len(active))
+        time.sleep(.05)
+        active.pop()
+
+    pipeline = Pipeline(max_workers=3)
+    for name in ['a', 'b', 'c']:
+        pipeline.add(name, step, locks=['hdf5'])
+    pipeline.run()
+    assert overlaps == [1, 1, 1]
+
+
+def test_retries():
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise IOError("connection reset")
+        return 'uploaded'
+
+    pipeline = Pipeline()
+    pipeline.step(retries=2, retry_delay=0)(flaky)
+    assert pipeline.run() == {'flaky': 'uploaded'}
+    assert len(attempts) == 3
+
+
+def test_failure_stops_dependents():
+    called = []
+    pipeline = Pipeline()
+    pipeline.add('fail', lambda: 1 / 0)
+    pipeline.add('dependent', lambda fail: called.append(fail), requires=['fail'])
+    with pytest.raises(ZeroDivisionError):
+        pipeline.run()
+    assert not called
+
+
+def test_unknown_dependency():
+    with pytest.raises(ValueError):
+        Pipeline().add('b', lambda a: a, requires=['a'])
+
+
+def test_process_pools_in_concurrent_steps(tmp_path):
+    paths = []
+    for i in range(4):
+        paths.append(tmp_path / f'{i}.bin')
+        paths[-1].write_bytes(bytes([i]) * 1000)
+    barrier = threading.Barrier(2, timeout=30)
+    pipeline = Pipeline(max_workers=2)
+    for name in ['first', 'second']:
+        pipeline.add(name, lambda: barrier.wait() is not None and sha1_files(paths, processes=2, cache_path=None))
+    results = pipeline.run()
+    expected = [hashlib.sha1(path.read_bytes()).hexdigest() for path in paths]
+    assert results['first'] == results['second'] == expected
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+import xarray as xr
+
+from mkgu_packaging.reliability import split_half_consistency, split_half_masks, filter_neuroids
+
+
+def _responses(num_images=50, num_repetitions=11, num_neuroids=30, seed=0):
+    rng = np.random.RandomState(seed)
+    signal = rng.rand(num_images, 1, num_neuroids)
+    noise_level = np.linspace(.01, 2, num_neuroids)
+    return signal + noise_level * rng.randn(num_images, num_repetitions, num_neuroids)
+
+
+def test_masks_match_shuffle_split():
+    model_selection = pytest.importorskip('sklearn.model_selection')
+    train, test = split_half_masks(11, num_splits=10, train_size=.5, seed=1)
+    splitter = model_selection.ShuffleSplit(n_splits=10, train_size=.5, test_size=None, random_state=1)
+    for split, (train_indices, test_indices) in enumerate(splitter.split(np.zeros(11))):
+        np.testing.assert_array_equal(np.where(train[split])[0], np.sort(train_indices))
+        np.testing.assert_array_equal(np.where(test[split])[0], np.sort(test_indices))
+
+
+def test_consistency_matches_loop():
+    stats = pytest.importorskip('scipy.stats')
+    responses = _responses()
+    train, test = split_half_masks(responses.shape[1])
+    expected = []
+    for train_mask, test_mask in zip(train, test):
+        half1, half2 = responses[:, train_mask].mean(axis=1), responses[:, test_mask].mean(axis=1)
+        correlation = np.array([stats.pearsonr(half1[:, n], half2[:, n])[0] for n in range(responses.shape[2])])
+        expected.append(2 * correlation / (1 + correlation))
+    consistency = split_half_consistency(responses, num_threads=2, neuroids_per_block=7)
+    np.testing.assert_allclose(consistency, np.mean(expected, axis=0))
+
+
+def test_filter_neuroids():
+    responses = _responses()
+    num_images, num_repetitions, num_neuroids = responses.shape
+    assembly = xr.DataArray(responses.reshape(num_images * num_repetitions, num_neuroids),
+                            coords={'image_id': ('presentation', np.repeat([f'im{i}' for i in range(num_images)],
+                                                                           num_repetitions)),
+                                    'repetition': ('presentation', np.tile(np.arange(num_repetitions), num_images)),
+                                    'neuroid_id': ('neuroid', np.arange(num_neuroids))},
+                            dims=['presentation', 'neuroid'])
+    filtered = filter_neuroids(assembly, threshold=.7)
+    expected = split_half_consistency(responses) >= .7
+    assert 0 < expected.sum() < num_neuroids
+    np.testing.assert_array_equal(filtered['neuroid_id'].values, np.where(expected)[0])
+    # same selection regardless of presentation order
+    shuffled = assembly.isel(presentation=np.random.RandomState(1).permutation(assembly.sizes['presentation']))
+    np.testing.assert_array_equal(filter_neuroids(shuffled, threshold=.7)['neuroid_id'].values,
+                                  filtered['neuroid_id'].values)
+
+
+def test_filter_neuroids_matches_brainscore():
+    ceiling = pytest.importorskip('brainscore.metrics.ceiling')
+    transformations = pytest.importorskip('brainscore.metrics.transformations')
+    from brainio_base.assemblies import NeuronRecordingAssembly
+
+    responses = _responses()
+    num_images, num_repetitions, num_neuroids = responses.shape
+    assembly = NeuronRecordingAssembly(
+        responses.reshape(num_images * num_repetitions, num_neuroids),
+        coords={'image_id': ('presentation', np.repeat([f'im{i}' for i in range(num_images)], num_repetitions)),
+                'repetition': ('presentation', np.tile(np.arange(num_repetitions), num_images)),
+                'neuroid_id': ('neuroid', np.arange(num_neuroids))},
+        dims=['presentation', 'neuroid'])
+    brainscore_ceiling = ceiling.InternalConsistency()(assembly).raw
+    brainscore_ceiling = transformations.CrossValidation().aggregate(brainscore_ceiling).sel(aggregation='center')
+    np.testing.assert_allclose(split_half_consistency(responses), brainscore_ceiling.values)
@@ -0,0 +1,108 @@
+import json
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from mkgu_packaging.dicarlo.sanghavi.solo import SoloRecording, bin_rates, load_rates
+
+timebins = [[70, 170], [170, 270], [50, 100], [100, 150], [150, 200], [200, 250], [70, 270]]
+photodiode_delay = 30
+timebase = np.arange(-100, 381, 10)
+
+
+def binned_by_loop(psth):
+    rate = np.empty((len(timebins), psth.shape[0], psth.shape[1], psth.shape[3]))
+    for idx, tb in enumerate(timebins):
+        t_cols = np.where((timebase >= (tb[0] + photodiode_delay)) & (timebase < (tb[1] + photodiode_delay)))[0]
+        rate[idx] = np.mean(psth[:, :, t_cols, :], axis=2)
+    return rate
+
+
+class TestBinRates:
+    def test_matches_loop(self):
+        psth = np.random.RandomState(0).poisson(5, size=(20, 3, len(timebase), 8)).astype(np.float32)
+        rate = bin_rates(psth, timebins, timebase, photodiode_delay)
+        assert rate.shape == (len(timebins), 20, 3, 8)
+        np.testing.assert_allclose(rate, binned_by_loop(psth), rtol=1e-6)
+
+    def test_single_bin(self):
+        psth = np.random.RandomState(1).rand(4, 2, len(timebase), 3)
+        rate = bin_rates(psth, [[70, 170]], timebase, photodiode_delay)[0]
+        t_cols = (timebase >= 100) & (timebase < 200)
+        np.testing.assert_allclose(rate, psth[:, :, t_cols, :].mean(axis=2))
+
+    @pytest.mark.parametrize('neuroids_per_block', [1, 5, 37, 100])
+    def test_blocks_match_loop(self, neuroids_per_block):
+        psth = np.random.RandomState(4).rand(6, 4, len(timebase), 37)
+        rate = bin_rates(psth, timebins, timebase, photodiode_delay, neuroids_per_block=neuroids_per_block)
+        np.testing.assert_allclose(rate, binned_by_loop(psth))
+
+    def test_peak_memory_below_full_cumulative_sum(self):
+        psth = np.random.RandomState(5).rand(50, 10, len(timebase), 64).astype(np.float32)
+        rate_bytes = len(timebins) * 50 * 10 * 64 * 8
+        full_cumulative_bytes = (len(timebase) + 1) * 50 * 10 * 64 * 8
+        tracemalloc.start()
+        try:
+            bin_rates(psth, timebins, timebase, photodiode_delay, neuroids_per_block=8)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        assert peak < rate_bytes + full_cumulative_bytes / 4
+
+    def test_empty_bin(self):
+        psth = np.zeros((1, 1, len(timebase), 1))
+        with pytest.raises(ValueError):
+            bin_rates(psth, [[500, 600]], timebase, photodiode_delay)
+
+
+class TestLoadRates:
+    def test_memory_budget_matches_eager(self, tmp_path):
+        psth = np.random.RandomState(2).rand(25, 4, len(timebase), 6)
+        psth_path = tmp_path / 'solo.rsvp.test.experiment_psth.npy'
+        np.save(psth_path, psth)
+        eager = load_rates(psth_path, timebins, timebase, photodiode_delay)
+        # budget of a few images per block, with the last block shorter
+        streamed = load_rates(psth_path, timebins, timebase, photodiode_delay, memory_budget=40 * 1024)
+        np.testing.assert_allclose(streamed, eager)
+        np.testing.assert_allclose(eager, binned_by_loop(psth))
+
+
+class TestSoloRecording:
+    @pytest.fixture
+    def recording(self, tmp_path):
+        rng = np.random.RandomState(3)
+        database_dir = tmp_path / 'database'
+        database_dir.mkdir()
+        # 6 channels driven by the images, 2 of noise only
+        signal = np.concatenate([rng.gamma(2., size=(10, 1, 1, 6)), np.zeros((10, 1, 1, 2))], axis=-1)
+        np.save(database_dir / 'solo.rsvp.test.normalizer_psth.npy',
+                signal + .1 * rng.standard_normal((10, 8, len(timebase), 8)))
+        np.save(database_dir / 'solo.rsvp.test.experiment_psth.npy', rng.rand(5, 3, len(timebase), 8))
+        (tmp_path / 'array-metadata').mkdir()
+        with open(tmp_path / 'array-metadata' / 'mapping.json', 'w') as f:
+            json.dump({'neuroid_id': [f'A-{channel:03d}' for channel in range(8)], 'elec': list(range(8))}, f)
+        return SoloRecording(database_dir, 'test', image_size_degree=8, stim_on_time_ms=100)
+
+    def test_filters_unreliable_neuroids(self, recording):
+        np.testing.assert_array_equal(recording.reliable_neuroids(), [True] * 6 + [False] * 2)
+
+    def test_load(self, recording):
+        stimuli = pd.DataFrame({'image_id': list('abcde'), 'category': [0, 0, 1, 1, 2]})
+        assembly = recording.load(stimuli)
+        assert assembly.dims == ('presentation', 'neuroid', 'time_bin')
+        assert assembly.shape == (5 * 3, 6, len(timebins))
+        assert list(assembly['image_id'].values[:4]) == ['a', 'a', 'a', 'b']
+        assert list(assembly['repetition'].values[:4]) == [0, 1, 2, 0]
+        assert list(assembly['neuroid_id'].values) == [f'A-{channel:03d}' for channel in range(6)]
+        assert assembly.attrs == {'image_size_degree': 8, 'stim_on_time_ms': 100}
+        rate = binned_by_loop(np.load(recording.database_dir / 'solo.rsvp.test.experiment_psth.npy'))
+        np.testing.assert_allclose(assembly.values[4], rate[:, 1, 1, :6].T)
+
+    def test_image_positions(self, recording):
+        stimuli = pd.DataFrame({'image_id': list('abcde')})
+        assembly = recording.load(stimuli, image_positions=[4, 3, 2, 1, 0])
+        rate = binned_by_loop(np.load(recording.database_dir / 'solo.rsvp.test.experiment_psth.npy'))
+        np.testing.assert_allclose(assembly.values[0], rate[:, 4, 0, :6].T)
+        assert assembly['image_id'].values[0] == 'a'
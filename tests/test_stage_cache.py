@@ -0,0 +1,102 @@
+import importlib
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from mkgu_packaging.stage_cache import stage, evict
+
+
+def _counting_stage(cache_dir, calls, **kwargs):
+    @stage(cache_dir=str(cache_dir), **kwargs)
+    def load(path, frame, memory_budget=None):
+        calls.append(path)
+        return np.loadtxt(path) + frame['offset'].sum()
+
+    return load
+
+
+def test_hit(tmp_path):
+    path = tmp_path / 'data.txt'
+    np.savetxt(path, [1., 2.])
+    calls = []
+    load = _counting_stage(tmp_path / 'cache', calls)
+    first = load(str(path), pd.DataFrame({'offset': [1]}))
+    second = load(str(path), pd.DataFrame({'offset': [1]}))
+    np.testing.assert_array_equal(first, second)
+    assert len(calls) == 1
+
+
+def test_changed_inputs_invalidate(tmp_path):
+    path = tmp_path / 'data.txt'
+    np.savetxt(path, [1., 2.])
+    calls = []
+    load = _counting_stage(tmp_path / 'cache', calls)
+    load(str(path), pd.DataFrame({'offset': [1]}))
+    load(str(path), pd.DataFrame({'offset': [2]}))
+    assert len(calls) == 2
+    np.savetxt(path, [3., 4.])
+    np.testing.assert_array_equal(load(str(path), pd.DataFrame({'offset': [2]})), [5., 6.])
+    assert len(calls) == 3
+
+
+def test_extra_inputs_and_ignored_arguments(tmp_path):
+    path, extra = tmp_path / 'data.txt', tmp_path / 'extra.txt'
+    np.savetxt(path, [1.])
+    extra.write_text('a')
+    calls = []
+    load = _counting_stage(tmp_path / 'cache', calls, inputs=lambda path, **_: [extra], ignore=['memory_budget'])
+    load(str(path), pd.DataFrame({'offset': [0]}), memory_budget=1)
+    load(str(path), pd.DataFrame({'offset': [0]}), memory_budget=2)
+    assert len(calls) == 1
+    extra.write_text('b')
+    load(str(path), pd.DataFrame({'offset': [0]}))
+    assert len(calls) == 2
+
+
+def test_changed_dependency_code_invalidates(tmp_path, monkeypatch):
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.delitem(sys.modules, 'stage_dependency', raising=False)
+    (tmp_path / 'stage_dependency.py').write_text('OFFSET = 1\n')
+    calls = []
+
+    def load(value):
+        calls.append(value)
+        return value
+
+    cached = stage(cache_dir=str(tmp_path / 'cache'), depends_on=['stage_dependency'])(load)
+    cached(1), cached(1)
+    assert len(calls) == 1
+    (tmp_path / 'stage_dependency.py').write_text('OFFSET = 2\n')
+    importlib.reload(sys.modules['stage_dependency'])
+    stage(cache_dir=str(tmp_path / 'cache'), depends_on=['stage_dependency'])(load)(1)  # as in a new process
+    assert len(calls) == 2
+
+
+def test_concurrent_writes(tmp_path):
+    cached = stage(cache_dir=str(tmp_path))(lambda value: np.arange(100000) + value)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(cached, [1] * 16))
+    for result in results:
+        np.testing.assert_array_equal(result, np.arange(100000) + 1)
+    assert len(os.listdir(tmp_path)) == 1 and os.listdir(tmp_path)[0].endswith('.pkl')
+
+
+def test_evict_least_recently_used(tmp_path):
+    for i, name in enumerate(['old', 'new']):
+        (tmp_path / f'{name}.pkl').write_bytes(b'0' * 100)
+        os.utime(tmp_path / f'{name}.pkl', ns=(i * 10 ** 9, i * 10 ** 9))
+    evict(str(tmp_path), max_bytes=150)
+    assert sorted(os.listdir(tmp_path)) == ['new.pkl']
+
+
+@pytest.mark.parametrize('value, hits', [('0', True), ('false', True), ('', True), ('1', False)])
+def test_disable(tmp_path, monkeypatch, value, hits):
+    monkeypatch.setenv('MKGU_STAGE_CACHE_DISABLE', value)
+    calls = []
+    cached = stage(cache_dir=str(tmp_path))(lambda value: calls.append(value))
+    cached(1), cached(1)
+    assert len(calls) == (1 if hits else 2)
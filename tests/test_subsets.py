@@ -0,0 +1,21 @@
+import numpy as np
+import xarray as xr
+
+from mkgu_packaging.subsets import split_masks, subset_splits
+
+
+def test_split_masks():
+    values = np.array(['a', 'b', 'c', 'a', 'd', 'b'])
+    masks = split_masks(values, {'public': ['a', 'c'], 'private': ['b']})
+    np.testing.assert_array_equal(masks['public'], [True, False, True, True, False, False])
+    np.testing.assert_array_equal(masks['private'], [False, True, False, False, False, True])
+
+
+def test_subset_splits():
+    assembly = xr.DataArray(np.arange(12).reshape(6, 2), dims=['presentation', 'neuroid'],
+                            coords={'variation': ('presentation', [0, 3, 6, 6, 0, 3])},
+                            attrs={'stimulus_set_name': 'test'})
+    subsets = dict(subset_splits(assembly, 'variation', {'public': [0, 3], 'private': [6]}))
+    np.testing.assert_array_equal(subsets['public']['variation'].values, [0, 3, 0, 3])
+    np.testing.assert_array_equal(subsets['private'].values, [[4, 5], [6, 7]])
+    assert subsets['private'].attrs['stimulus_set_name'] == 'test'
@@ -0,0 +1,61 @@
+import os
+
+import boto3
+import pytest
+
+moto = pytest.importorskip('moto')
+from mkgu_packaging.upload import UploadManager, MIN_PART_SIZE
+
+mock_s3 = getattr(moto, 'mock_aws', None) or getattr(moto, 'mock_s3')
+
+
+@pytest.fixture
+def client(monkeypatch):
+    for variable in ['AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY']:
+        monkeypatch.setenv(variable, 'testing')
+    with mock_s3():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket='brainio-test')
+        yield client
+
+
+def _write_file(path, size):
+    path.write_bytes(os.urandom(size))
+    return path
+
+
+class TestUploadManager:
+    def test_uploads(self, client, tmp_path):
+        large = _write_file(tmp_path / 'assy_test.nc', 2 * MIN_PART_SIZE + 123)
+        small = _write_file(tmp_path / 'image_test.zip', 1000)
+        manager = UploadManager(client=client, part_size=MIN_PART_SIZE, num_threads=4, state_dir=tmp_path / 'state')
+        stats = manager.upload([(large, 'brainio-test', large.name), (small, 'brainio-test', small.name)])
+        assert [stat['bytes'] for stat in stats] == [large.stat().st_size, small.stat().st_size]
+        for path in [large, small]:
+            assert client.get_object(Bucket='brainio-test', Key=path.name)['Body'].read() == path.read_bytes()
+        assert not os.listdir(tmp_path / 'state')
+
+    def test_resume(self, client, tmp_path):
+        large = _write_file(tmp_path / 'assy_test.nc', 3 * MIN_PART_SIZE + 123)
+        uploaded_parts = []
+        upload_part = client.upload_part
+
+        def flaky_upload_part(**kwargs):
+            if kwargs['PartNumber'] == 3 and not uploaded_parts.count('failed'):
+                uploaded_parts.append('failed')
+                raise ConnectionError("connection dropped")
+            uploaded_parts.append(kwargs['PartNumber'])
+            return upload_part(**kwargs)
+
+        client.upload_part = flaky_upload_part
+        manager = UploadManager(client=client, part_size=MIN_PART_SIZE, num_threads=1, state_dir=tmp_path / 'state')
+        with pytest.raises(ConnectionError):
+            manager.upload([(large, 'brainio-test', large.name)])
+        assert sorted(part for part in uploaded_parts if part != 'failed') == [1, 2, 4]
+
+        uploaded_parts.clear()
+        uploaded_parts.append('failed')  # do not fail again
+        stats = manager.upload([(large, 'brainio-test', large.name)])
+        assert uploaded_parts == ['failed', 3]
+        assert stats[0]['bytes'] == MIN_PART_SIZE
+        assert client.get_object(Bucket='brainio-test', Key=large.name)['Body'].read() == large.read_bytes()
@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from mkgu_packaging.validation import StimulusMismatchError, stimulus_mismatches, validate_stimuli
+
+
+def _assembly(image_ids, labels):
+    return xr.DataArray(np.zeros(len(image_ids)), dims=['presentation'],
+                        coords={'image_id': ('presentation', image_ids), 'label': ('presentation', labels)})
+
+
+def test_agreement():
+    assembly = _assembly(['a', 'b', 'a', 'b'], ['x', 'y', 'x', 'y'])
+    stimuli = pd.DataFrame({'image_id': ['a', 'b'], 'image_label': ['x', 'y']})
+    assert len(stimulus_mismatches(assembly, stimuli, columns={'label': 'image_label'})) == 0
+    validate_stimuli(assembly, stimuli, columns={'label': 'image_label'})
+
+
+def test_mismatches():
+    assembly = _assembly(['a', 'b', 'b', 'c'], ['x', 'y', 'z', 'w'])
+    stimuli = pd.DataFrame({'image_id': ['a', 'b', 'd', 'd'], 'label': ['v', 'y', 'u', 'u']})
+    mismatches = stimulus_mismatches(assembly, stimuli, columns=['label'])
+    issues = {(row.issue, row.key) for row in mismatches.itertuples()}
+    assert issues == {('duplicate in stimuli', 'd'), ('inconsistent in assembly', 'b'), ('missing in stimuli', 'c'),
+                      ('missing in assembly', 'd'), ('value mismatch', 'a'), ('value mismatch', 'b')}
+    row = mismatches[(mismatches['issue'] == 'value mismatch') & (mismatches['key'] == 'a')].iloc[0]
+    assert (row['column'], row['assembly_value'], row['stimulus_value']) == ('label', 'x', 'v')
+    assert len(stimulus_mismatches(assembly, stimuli, require_all_stimuli=False)) == 2
+    with pytest.raises(StimulusMismatchError, match='missing in stimuli') as error:
+        validate_stimuli(assembly, stimuli, columns=['label'])
+    assert len(error.value.mismatches) == len(mismatches)
+
+
+def test_duplicate_stimuli():
+    # like Kar2019: 6 stimuli of 5 images, one of which is shown as two stimuli
+    assembly = _assembly(['a', 'b', 'c', 'd', 'e', 'e'], ['x', 'y', 'x', 'y', 'z', 'z'])
+    stimuli = pd.DataFrame({'image_id': ['a', 'b', 'c', 'd', 'e', 'e'], 'label': ['x', 'y', 'x', 'y', 'z', 'z']})
+    with pytest.raises(StimulusMismatchError, match='duplicate in stimuli'):
+        validate_stimuli(assembly, stimuli, columns=['label'])
+    validate_stimuli(assembly, stimuli, columns=['label'], allow_duplicates=True)
+
+    stimuli.loc[5, 'label'] = 'w'
+    mismatches = stimulus_mismatches(assembly, stimuli, columns=['label'], allow_duplicates=True)
+    assert [(row.issue, row.key, row.column) for row in mismatches.itertuples()] == \
+           [('inconsistent in stimuli', 'e', 'label')]